@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Benchmarks for context_loader on synthetic canon trees.
+
+Generates deterministic canon directories with thousands of character files
+and chapter outlines and reports timings for manifest generation.
+
+Usage:
+    python scripts/bench_context_loader.py {hash,manifest,pack,sections,tokens} [--sizes 1000,5000,20000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from context_loader import (  # noqa: E402
+    estimate_tokens,
+    get_manifest,
+    get_manifest_hash,
+    get_manifest_with_meta,
+    pack_manifest,
+    slice_manifest,
+)
+
+
+# ---------------------------------------------------------------------------
+# Synthetic canon
+# ---------------------------------------------------------------------------
+
+def synthetic_canon(root: Path, n_files: int, *, acts: int = 3) -> dict[str, Any]:
+    """Write a canon tree of about *n_files* markdown files under *root*.
+
+    Half of the files are character profiles and half are chapter outlines
+    spread over *acts* acts, each with one scene draft directory; chapter N's
+    outline mentions characters N and N + 1. Returns a
+    pipeline state positioned at the first scene of Act 1, Chapter 1.
+    """
+    canon = root / "canon"
+    for rel in ("CLAUDE.md", "canon/index.md", "canon/preferences.md",
+                "canon/story-concept.md", "canon/story-arc.md"):
+        (root / rel).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel).write_text(f"# {rel}\nStub.\n", encoding="utf-8")
+    (canon / "relationships.yaml").write_text("entities: {}\nrelationships: []\n", encoding="utf-8")
+    (canon / "themes").mkdir()
+    (canon / "themes" / "motifs.md").write_text("# Motifs\n", encoding="utf-8")
+
+    chars = canon / "characters"
+    chars.mkdir()
+    for i in range(n_files // 2):
+        (chars / f"char-{i:05d}.md").write_text(f"# Character {i}\n" + "Trait.\n" * 20)
+
+    chapters = max(1, n_files // 2 // acts)
+    for act in range(1, acts + 1):
+        (canon / "acts" / f"act-{act}-outline.md").parent.mkdir(parents=True, exist_ok=True)
+        (canon / "acts" / f"act-{act}-outline.md").write_text(f"# Act {act}\n")
+        act_dir = canon / "acts" / f"act-{act}"
+        (act_dir / "ch1").mkdir(parents=True)
+        (act_dir / "ch1" / "sc1-draft.md").write_text("# Scene 1\n")
+        for ch in range(1, chapters + 1):
+            (act_dir / f"ch{ch}-outline.md").write_text(
+                f"# Chapter {ch}\nchar-{ch:05d} meets char-{ch + 1:05d}.\n" + "Beat.\n" * 40
+            )
+
+    return {
+        "position": {"level": "L5", "act": 1, "chapter": 1, "scene": 1},
+        "mode": "manual",
+        "canon_version": 1,
+        "max_context_tokens": 100000,
+    }
+
+
+def _per_call_ms(fn: Callable[[], Any], repeat: int) -> float:
+    """Return the mean wall time of *fn* in milliseconds over *repeat* calls."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def bench_manifest(sizes: list[int], repeat: int = 10) -> list[str]:
+    """L5 manifest with token estimate and hash, from a fresh scan each call."""
+    lines = [
+        f"{'files':>7} | {'manifest':>8} | {'meta ms':>7}",
+        f"{'-' * 7}-+-{'-' * 8}-+-{'-' * 7}",
+    ]
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            state = synthetic_canon(root, size)
+            meta_ms = _per_call_ms(lambda: get_manifest_with_meta(state, root), repeat)
+            meta = get_manifest_with_meta(state, root)
+        lines.append(f"{size:>7} | {len(meta['files']):>8} | {meta_ms:>7.1f}")
+    return lines
+
+
+def bench_pack(sizes: list[int], budget: int = 40000, repeat: int = 10) -> list[str]:
+    """L5 manifest packed into *budget* tokens: what is kept and what it costs."""
+    lines = [
+        f"{'files':>7} | {'manifest tok':>12} | {'packed tok':>10} | {'kept':>5} | {'pack ms':>7}",
+        f"{'-' * 7}-+-{'-' * 12}-+-{'-' * 10}-+-{'-' * 5}-+-{'-' * 7}",
+    ]
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            state = synthetic_canon(root, size)
+            full = get_manifest_with_meta(state, root)
+            packed = pack_manifest(state, root, budget)
+            pack_ms = _per_call_ms(lambda: pack_manifest(state, root, budget), repeat)
+        lines.append(
+            f"{size:>7} | {full['total_estimated_tokens']:>12} | "
+            f"{packed['total_estimated_tokens']:>10} | {len(packed['files']):>5} | {pack_ms:>7.1f}"
+        )
+    return lines
+
+
+def bench_sections(sizes: list[int], repeat: int = 5) -> list[str]:
+    """L5 manifest as whole files vs ``file#section`` slices for the chapter's cast."""
+    lines = [
+        f"{'files':>7} | {'whole tok':>9} | {'sliced tok':>10} | {'entries':>7} | {'slice ms':>8}",
+        f"{'-' * 7}-+-{'-' * 9}-+-{'-' * 10}-+-{'-' * 7}-+-{'-' * 8}",
+    ]
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            state = synthetic_canon(root, size)
+            whole = get_manifest_with_meta(state, root)
+            sliced = get_manifest_with_meta(state, root, sections=True)
+            slice_ms = _per_call_ms(lambda: slice_manifest(state, root), repeat)
+        lines.append(
+            f"{size:>7} | {whole['total_estimated_tokens']:>9} | "
+            f"{sliced['total_estimated_tokens']:>10} | {len(sliced['files']):>7} | {slice_ms:>8.1f}"
+        )
+    return lines
+
+
+def bench_tokens(sizes: list[int], repeat: int = 5) -> list[str]:
+    """Token estimate of the L5 manifest: counting every file vs the warm cache."""
+    lines = [
+        f"{'files':>7} | {'tokens':>8} | {'bytes/4':>8} | {'cold ms':>7} | {'cached ms':>9}",
+        f"{'-' * 7}-+-{'-' * 8}-+-{'-' * 8}-+-{'-' * 7}-+-{'-' * 9}",
+    ]
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            state = synthetic_canon(root, size)
+            files = get_manifest(state, root)
+            start = time.perf_counter()
+            tokens = estimate_tokens(root, files)
+            cold_ms = (time.perf_counter() - start) * 1e3
+            cached_ms = _per_call_ms(lambda: estimate_tokens(root, files), repeat)
+            quarter = sum((root / f).stat().st_size for f in files) // 4
+        lines.append(
+            f"{size:>7} | {tokens:>8} | {quarter:>8} | {cold_ms:>7.1f} | {cached_ms:>9.1f}"
+        )
+    return lines
+
+
+def bench_hash(sizes: list[int], repeat: int = 5) -> list[str]:
+    """Content hash of the L5 manifest: cold, warm, and after editing one file."""
+    lines = [
+        f"{'files':>7} | {'cold ms':>7} | {'cached ms':>9} | {'1 edit ms':>9}",
+        f"{'-' * 7}-+-{'-' * 7}-+-{'-' * 9}-+-{'-' * 9}",
+    ]
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            state = synthetic_canon(root, size)
+            cold_ms = _per_call_ms(lambda: get_manifest_hash(state, root), 1)
+            cached_ms = _per_call_ms(lambda: get_manifest_hash(state, root), repeat)
+            edited = root / "canon" / "characters" / "char-00000.md"
+            edited.write_text(edited.read_text() + "Edited.\n")
+            edit_ms = _per_call_ms(lambda: get_manifest_hash(state, root), 1)
+        lines.append(f"{size:>7} | {cold_ms:>7.1f} | {cached_ms:>9.1f} | {edit_ms:>9.1f}")
+    return lines
+
+
+_BENCHMARKS: dict[str, Callable[..., list[str]]] = {
+    "hash": bench_hash,
+    "manifest": bench_manifest,
+    "pack": bench_pack,
+    "sections": bench_sections,
+    "tokens": bench_tokens,
+}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark context_loader hot paths")
+    parser.add_argument("benchmark", choices=sorted(_BENCHMARKS), help="Benchmark to run.")
+    parser.add_argument(
+        "--sizes",
+        default="1000,5000,20000",
+        help="Comma-separated canon file counts (default: 1000,5000,20000).",
+    )
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    for line in _BENCHMARKS[args.benchmark](sizes):
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
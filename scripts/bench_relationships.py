@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""Benchmarks for relationship_query on synthetic canons.
+
+Generates deterministic relationship files of increasing size and reports
+timings for the hot paths used by the continuity agent.
+
+Usage:
+    python scripts/bench_relationships.py {matrix,mentions,positions,save,server,store,sweep,validate,yaml} [--sizes 500,5000,50000]
+    python scripts/bench_relationships.py positions --sizes 10000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from relationship_query import (  # noqa: E402
+    MentionMatcher,
+    RelationshipStore,
+    _is_active,
+    _request,
+    _validity_span,
+    parse_position,
+    position_key,
+    query,
+    render_matrix,
+    save,
+    socket_path,
+    validate_relationships,
+)
+from yaml_io import HAS_LIBYAML  # noqa: E402
+
+
+_VOCABULARY = {
+    "positive": ["trusts", "loves", "respects", "allies_with", "protects", "depends_on"],
+    "negative": ["distrusts", "fears", "hates", "suspects", "resents"],
+    "neutral": ["knows", "employs", "related_to", "located_at", "possesses"],
+    "causal": ["caused", "prevented", "enabled", "discovered"],
+}
+
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+def synthetic_data(
+    n_entities: int,
+    n_relationships: int,
+    *,
+    acts: int = 3,
+    chapters: int = 12,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """Build a deterministic relationships dict with the canonical layout.
+
+    Entity IDs are ``e0000``, ``e0001``, ...; each has two aliases. Roughly a
+    third of the relationships carry a ``valid_to`` later than ``valid_from``.
+    """
+    rng = random.Random(seed)
+    terms = [t for category in _VOCABULARY.values() for t in category]
+
+    entities: dict[str, Any] = {}
+    for i in range(n_entities):
+        eid = f"e{i:04d}"
+        entities[eid] = {
+            "type": "character" if i % 5 else "location",
+            "aliases": [f"E{i}", f"entity {i}"],
+            "introduced": "L1/concept",
+        }
+    ids = list(entities)
+
+    relationships: list[dict[str, Any]] = []
+    for n in range(1, n_relationships + 1):
+        start = (rng.randint(1, acts), rng.randint(1, chapters))
+        rec: dict[str, Any] = {
+            "id": f"rel_{n:03d}",
+            "from": rng.choice(ids),
+            "to": rng.choice(ids),
+            "rel": rng.choice(terms),
+            "context": f"synthetic relationship {n}",
+            "valid_from": f"Act{start[0]}/Ch{start[1]}",
+            "valid_to": None,
+            "confidence": "medium",
+            "source": f"canon/acts/act-{start[0]}/ch{start[1]}-outline.md#L{n}",
+            "supersedes": None,
+            "superseded_by": None,
+        }
+        if rng.random() < 0.33:
+            end_act = rng.randint(start[0], acts)
+            end_ch = rng.randint(start[1] + 1 if end_act == start[0] else 1, chapters + 1)
+            rec["valid_to"] = f"Act{end_act}/Ch{end_ch}"
+        relationships.append(rec)
+
+    return {"rel_vocabulary": _VOCABULARY, "entities": entities, "relationships": relationships}
+
+
+def supersession_chains(n_relationships: int, chain_length: int) -> dict[str, Any]:
+    """Build a valid relationships dict made of long revision histories.
+
+    Every chain is one ``(from, to, rel)`` triple re-asserted ``chain_length``
+    times: each record supersedes the previous one and is valid for one
+    chapter, so the file validates cleanly.
+    """
+    entities: dict[str, Any] = {}
+    relationships: list[dict[str, Any]] = []
+    for n in range(n_relationships):
+        chain, link = divmod(n, chain_length)
+        eid = f"e{chain:04d}"
+        entities.setdefault(eid, {"type": "character", "aliases": [], "introduced": "L1/concept"})
+        last = link == chain_length - 1 or n == n_relationships - 1
+        relationships.append({
+            "id": f"rel_{n + 1:03d}",
+            "from": eid,
+            "to": eid,
+            "rel": "trusts",
+            "context": f"revision {link} of chain {chain}",
+            "valid_from": f"Act1/Ch{link + 1}",
+            "valid_to": None if last else f"Act1/Ch{link + 2}",
+            "confidence": "medium",
+            "source": f"canon/acts/act-1/ch{link + 1}-outline.md",
+            "supersedes": f"rel_{n:03d}" if link else None,
+            "superseded_by": None if last else f"rel_{n + 2:03d}",
+        })
+    return {"rel_vocabulary": _VOCABULARY, "entities": entities, "relationships": relationships}
+
+
+def _per_call_us(fn: Callable[[], Any], repeat: int) -> float:
+    """Return the mean wall time of *fn* in microseconds over *repeat* calls."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def bench_store(sizes: list[int], repeat: int = 200) -> list[str]:
+    """Per-query latency of :func:`query` vs :class:`RelationshipStore`.
+
+    The cast grows with the file (one entity per 100 relationships) so each
+    entity's degree, and therefore the result size, stays constant.
+    """
+    lines = [
+        f"{'relationships':>13} | {'entities':>8} | {'build ms':>9} | "
+        f"{'query() us':>11} | {'store us':>9}",
+        f"{'-' * 13}-+-{'-' * 8}-+-{'-' * 9}-+-{'-' * 11}-+-{'-' * 9}",
+    ]
+    for size in sizes:
+        n_entities = max(2, size // 100)
+        data = synthetic_data(n_entities, size)
+        entities = [f"e{i % n_entities:04d}" for i in range(repeat)]
+
+        start = time.perf_counter()
+        store = RelationshipStore(data)
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        it = iter(entities)
+        scan_us = _per_call_us(lambda: query(data, next(it), as_of="Act2/Ch6"), repeat)
+        it = iter(entities)
+        store_us = _per_call_us(lambda: store.query(next(it), as_of="Act2/Ch6"), repeat)
+
+        lines.append(
+            f"{size:>13} | {n_entities:>8} | {build_ms:>9.2f} | "
+            f"{scan_us:>11.1f} | {store_us:>9.1f}"
+        )
+    return lines
+
+
+def bench_sweep(sizes: list[int], acts: int = 3, chapters: int = 12) -> list[str]:
+    """Scene-by-scene continuity sweep: active relationships at every chapter.
+
+    Compares the linear as_of filter used by :func:`render_matrix` with the
+    store's :class:`TemporalIndex` (build time included). The active fraction
+    of the synthetic data is high, so both columns are largely output-bound.
+    """
+    positions = [f"Act{a}/Ch{c}" for a in range(1, acts + 1) for c in range(1, chapters + 1)]
+    lines = [
+        f"{'relationships':>13} | {'linear ms':>10} | {'indexed ms':>10} | {'speedup':>7}",
+        f"{'-' * 13}-+-{'-' * 10}-+-{'-' * 10}-+-{'-' * 7}",
+    ]
+    for size in sizes:
+        data = synthetic_data(max(2, size // 100), size, acts=acts, chapters=chapters)
+        rels = data["relationships"]
+
+        start = time.perf_counter()
+        for as_of in positions:
+            pos = parse_position(as_of)
+            [r for r in rels if _is_active(r, pos)]
+        linear_ms = (time.perf_counter() - start) * 1e3
+
+        start = time.perf_counter()
+        store = RelationshipStore(data)
+        for as_of in positions:
+            store.active_at(as_of)
+        indexed_ms = (time.perf_counter() - start) * 1e3
+
+        lines.append(
+            f"{size:>13} | {linear_ms:>10.1f} | {indexed_ms:>10.1f} | "
+            f"{linear_ms / indexed_ms:>6.1f}x"
+        )
+    return lines
+
+
+def bench_matrix(sizes: list[int], n_entities: int = 200) -> list[str]:
+    """render_matrix views of a large cast: dense, sparse, edge list and 25x25 tiles."""
+    views: dict[str, dict[str, Any]] = {
+        "dense": {},
+        "sparse": {"sparse": True},
+        "edges": {"edges": True},
+        "tiled": {"page_size": 25},
+    }
+    lines = [
+        f"{'relationships':>13} | {'entities':>8} | "
+        + " | ".join(f"{name + ' ms':>9} | {name + ' KB':>9}" for name in views),
+        f"{'-' * 13}-+-{'-' * 8}" + "".join(f"-+-{'-' * 9}-+-{'-' * 9}" for _ in views),
+    ]
+    for size in sizes:
+        data = synthetic_data(n_entities, size)
+        cols = []
+        for options in views.values():
+            start = time.perf_counter()
+            md = render_matrix(data, as_of="Act2/Ch6", **options)
+            cols.append(f"{(time.perf_counter() - start) * 1e3:>9.1f} | {len(md) / 1e3:>9.1f}")
+        lines.append(f"{size:>13} | {n_entities:>8} | " + " | ".join(cols))
+    return lines
+
+
+def bench_positions(sizes: list[int], acts: int = 3, chapters: int = 12) -> list[str]:
+    """as_of filtering at every chapter: string parsing vs normalized spans.
+
+    ``string`` re-runs the position regexes for every comparison (the
+    pre-memoization path), ``memoized`` uses the cached :func:`parse_position`,
+    and ``packed`` normalizes every record to integer spans once (timed) and
+    then compares ints.
+    """
+    uncached = parse_position.__wrapped__
+    as_of_list = [f"Act{a}/Ch{c}" for a in range(1, acts + 1) for c in range(1, chapters + 1)]
+
+    def sweep_strings(rels: list[dict[str, Any]], parse: Callable[[str], Any]) -> int:
+        hits = 0
+        for as_of in as_of_list:
+            pos = parse(as_of)
+            for r in rels:
+                vt = r.get("valid_to")
+                if parse(r["valid_from"]) <= pos and (vt is None or pos < parse(vt)):
+                    hits += 1
+        return hits
+
+    def sweep_packed(rels: list[dict[str, Any]]) -> int:
+        spans = [_validity_span(r) for r in rels]
+        hits = 0
+        for as_of in as_of_list:
+            key = position_key(as_of)
+            for start, end in spans:
+                if start <= key < end:
+                    hits += 1
+        return hits
+
+    lines = [
+        f"{'relationships':>13} | {'string ms':>10} | {'memoized ms':>11} | {'packed ms':>10}",
+        f"{'-' * 13}-+-{'-' * 10}-+-{'-' * 11}-+-{'-' * 10}",
+    ]
+    for size in sizes:
+        rels = synthetic_data(max(2, size // 100), size, acts=acts, chapters=chapters)[
+            "relationships"
+        ]
+        timings = []
+        results = set()
+        for fn in (
+            lambda: sweep_strings(rels, uncached),
+            lambda: sweep_strings(rels, parse_position),
+            lambda: sweep_packed(rels),
+        ):
+            start = time.perf_counter()
+            results.add(fn())
+            timings.append((time.perf_counter() - start) * 1e3)
+        assert len(results) == 1, "paths disagree"
+        lines.append(
+            f"{size:>13} | {timings[0]:>10.1f} | {timings[1]:>11.1f} | {timings[2]:>10.1f}"
+        )
+    return lines
+
+
+def bench_validate(sizes: list[int], chain_length: int = 1000) -> list[str]:
+    """Full :func:`validate_relationships` on long supersession chains."""
+    lines = [
+        f"{'relationships':>13} | {'chain length':>12} | {'validate ms':>11}",
+        f"{'-' * 13}-+-{'-' * 12}-+-{'-' * 11}",
+    ]
+    for size in sizes:
+        data = supersession_chains(size, chain_length)
+        start = time.perf_counter()
+        result = validate_relationships(data)
+        elapsed_ms = (time.perf_counter() - start) * 1e3
+        assert result.ok, result.errors[:5]
+        lines.append(f"{size:>13} | {chain_length:>12} | {elapsed_ms:>11.1f}")
+    return lines
+
+
+def bench_yaml(sizes: list[int]) -> list[str]:
+    """Load and save throughput of a generated relationships file, in MB/s.
+
+    Compares PyYAML's pure-Python safe loader/dumper with the libyaml ones
+    :mod:`yaml_io` uses when available.
+    """
+    if not HAS_LIBYAML:
+        return ["PyYAML was built without libyaml; nothing to compare."]
+
+    dump_kwargs: dict[str, Any] = {
+        "default_flow_style": False, "sort_keys": False, "allow_unicode": True,
+    }
+    lines = [
+        f"{'relationships':>13} | {'MB':>6} | {'load py':>8} | {'load C':>8} | "
+        f"{'save py':>8} | {'save C':>8}",
+        f"{'-' * 13}-+-{'-' * 6}-+-{'-' * 8}-+-{'-' * 8}-+-{'-' * 8}-+-{'-' * 8}",
+    ]
+    for size in sizes:
+        data = synthetic_data(max(2, size // 100), size)
+        text = yaml.dump(data, Dumper=yaml.SafeDumper, **dump_kwargs)
+        mb = len(text.encode("utf-8")) / 1e6
+
+        rates = []
+        for loader in (yaml.SafeLoader, yaml.CSafeLoader):
+            start = time.perf_counter()
+            loaded = yaml.load(text, Loader=loader)
+            rates.append(mb / (time.perf_counter() - start))
+            assert loaded == data
+        for dumper in (yaml.SafeDumper, yaml.CSafeDumper):
+            start = time.perf_counter()
+            dumped = yaml.dump(data, Dumper=dumper, **dump_kwargs)
+            rates.append(mb / (time.perf_counter() - start))
+            assert dumped == text
+
+        lines.append(
+            f"{size:>13} | {mb:>6.1f} | {rates[0]:>8.2f} | {rates[1]:>8.2f} | "
+            f"{rates[2]:>8.2f} | {rates[3]:>8.2f}"
+        )
+    return lines
+
+
+def bench_server(sizes: list[int], repeat: int = 5) -> list[str]:
+    """Per-request latency of ``query`` from the CLI, cold and via ``serve``.
+
+    ``cold`` runs the CLI with ``--no-cache``, ``snapshot`` runs it with a
+    warm snapshot cache, ``client`` runs it while a server is up, and
+    ``socket`` sends the JSON request directly (no interpreter startup).
+    """
+    script = str(Path(__file__).resolve().parent / "relationship_query.py")
+    lines = [
+        f"{'relationships':>13} | {'cold ms':>8} | {'snapshot ms':>11} | "
+        f"{'client ms':>9} | {'socket ms':>9}",
+        f"{'-' * 13}-+-{'-' * 8}-+-{'-' * 11}-+-{'-' * 9}-+-{'-' * 9}",
+    ]
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = Path(tmp) / "relationships.yaml"
+            save(synthetic_data(max(2, size // 100), size), file_path)
+            query_args = ["query", "--entity", "e0001", "--as-of", "Act2/Ch6",
+                          "--file", str(file_path)]
+
+            def cli(*extra: str) -> None:
+                subprocess.run(
+                    [sys.executable, script, *extra, *query_args],
+                    check=True, capture_output=True,
+                )
+
+            cold_ms = _per_call_us(lambda: cli("--no-cache", "--no-server"), repeat) / 1e3
+            cli("--no-server")  # warm the snapshot
+            snapshot_ms = _per_call_us(lambda: cli("--no-server"), repeat) / 1e3
+
+            server = subprocess.Popen(
+                [sys.executable, script, "serve", "--file", str(file_path)],
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                sock = socket_path(file_path)
+                while _request(sock, {"op": "validate"}) is None:
+                    if server.poll() is not None:
+                        raise RuntimeError("serve exited before accepting requests")
+                    time.sleep(0.05)
+                client_ms = _per_call_us(cli, repeat) / 1e3
+                request = {"op": "query", "entity": "e0001", "as_of": "Act2/Ch6"}
+                socket_ms = _per_call_us(lambda: _request(sock, request), repeat * 20) / 1e3
+            finally:
+                server.terminate()
+                server.wait()
+
+        lines.append(
+            f"{size:>13} | {cold_ms:>8.1f} | {snapshot_ms:>11.1f} | "
+            f"{client_ms:>9.1f} | {socket_ms:>9.2f}"
+        )
+    return lines
+
+
+def bench_save(sizes: list[int], repeat: int = 20) -> list[str]:
+    """Per-record cost of persisting an ``add``: full rewrite vs append."""
+    lines = [
+        f"{'relationships':>13} | {'rewrite ms':>10} | {'append ms':>9}",
+        f"{'-' * 13}-+-{'-' * 10}-+-{'-' * 9}",
+    ]
+    for size in sizes:
+        data = synthetic_data(max(2, size // 100), size)
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = Path(tmp) / "relationships.yaml"
+            save(data, file_path)
+            store = RelationshipStore(data)
+            timings = []
+            for appended in (0, 1):
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    store.add("e0000", "e0001", "knows", "bench", "Act1/Ch1", "low",
+                              "canon/acts/act-1/ch1-outline.md#L1")
+                    save(data, file_path, appended=appended)
+                timings.append((time.perf_counter() - start) / repeat * 1e3)
+        lines.append(f"{size:>13} | {timings[0]:>10.2f} | {timings[1]:>9.3f}")
+    return lines
+
+
+def bench_mentions(sizes: list[int], words: int = 200_000) -> list[str]:
+    """Entity-mention scan of a synthetic manuscript (~1 MB of prose).
+
+    The cast is sized like :func:`bench_save`'s (one entity per hundred
+    relationships); about one word in twenty is an entity name.
+    """
+    lines = [
+        f"{'relationships':>13} | {'names':>7} | {'build ms':>8} | {'scan s':>6} | {'MB/s':>5}",
+        f"{'-' * 13}-+-{'-' * 7}-+-{'-' * 8}-+-{'-' * 6}-+-{'-' * 5}",
+    ]
+    rng = random.Random(0)
+    for size in sizes:
+        entities = synthetic_data(max(2, size // 100), 0)["entities"]
+        names = [alias for einfo in entities.values() for alias in einfo["aliases"]]
+        text = " ".join(
+            rng.choice(names) if rng.random() < 0.05 else rng.choice(("the", "zone", "said"))
+            for _ in range(words)
+        )
+        start = time.perf_counter()
+        matcher = MentionMatcher.from_entities(entities)
+        build_ms = (time.perf_counter() - start) * 1e3
+        start = time.perf_counter()
+        matcher.scan(text)
+        scan_s = time.perf_counter() - start
+        mb = len(text.encode("utf-8")) / 1e6
+        lines.append(
+            f"{size:>13} | {len(names):>7} | {build_ms:>8.1f} | {scan_s:>6.2f} | {mb / scan_s:>5.1f}"
+        )
+    return lines
+
+
+_BENCHMARKS: dict[str, Callable[..., list[str]]] = {
+    "matrix": bench_matrix,
+    "mentions": bench_mentions,
+    "positions": bench_positions,
+    "save": bench_save,
+    "server": bench_server,
+    "store": bench_store,
+    "sweep": bench_sweep,
+    "validate": bench_validate,
+    "yaml": bench_yaml,
+}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark relationship_query hot paths")
+    parser.add_argument("benchmark", choices=sorted(_BENCHMARKS), help="Benchmark to run.")
+    parser.add_argument(
+        "--sizes",
+        default="500,5000,50000",
+        help="Comma-separated relationship counts (default: 500,5000,50000).",
+    )
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    for line in _BENCHMARKS[args.benchmark](sizes):
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,26 +2,33 @@
 """Context loader for the fiction writing pipeline.
 
 Reads .pipeline-state.yaml and generates a deterministic context manifest
-based on the current position in the story hierarchy.
+based on the current position in the story hierarchy, then packs it into the
+state's ``max_context_tokens`` budget, most relevant files first. With
+``--sections``, L4/L5 manifests name ``file#section`` slices instead of
+whole outlines and character files.
 
 Usage:
-    python scripts/context_loader.py --state .pipeline-state.yaml
+    python scripts/context_loader.py --state .pipeline-state.yaml [--budget N | --no-budget] \\
+        [--sections]
 """
 
 from __future__ import annotations
 
 import argparse
+import fnmatch
 import hashlib
 import json
+import os
+import re
 import sys
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
-import yaml
+from yaml import YAMLError
 
-
-# Approximate tokens per byte (conservative estimate for English markdown).
-_TOKENS_PER_BYTE = 0.25
+from yaml_io import safe_load
 
 
 # ---------------------------------------------------------------------------
@@ -31,7 +38,7 @@ _TOKENS_PER_BYTE = 0.25
 def load_state(state_path: Path) -> dict[str, Any]:
     """Load the pipeline state YAML file."""
     with open(state_path, encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        return safe_load(f)
 
 
 # ---------------------------------------------------------------------------
@@ -47,7 +54,105 @@ _SYSTEM_FILES = [
 ]
 
 
-def get_manifest(state: dict[str, Any], root: Path) -> list[str]:
+class CanonScan:
+    """Directory listings under a project root, each read once with ``os.scandir``.
+
+    Manifest rules ask about the same few directories several times (does
+    this file exist, which outlines are in ``canon/acts``, how big is each
+    file); a scan answers all of them from one listing per directory, so a
+    manifest costs one ``scandir`` per directory and one ``stat`` per file.
+    Pass the same scan to the functions below to share it. Listings are not
+    refreshed: build a new scan to see later changes on disk.
+
+    Token counts come from the *tokenizer* in :data:`TOKEN_COUNTERS` through
+    a :class:`TokenCache` in ``.cache/`` under the root, unless *use_cache*
+    is False.
+    """
+
+    def __init__(self, root: Path, tokenizer: str = "approx", use_cache: bool = True) -> None:
+        self.root = root
+        self.tokenizer = tokenizer
+        self.use_cache = use_cache
+        self._dirs: dict[str, dict[str, os.stat_result]] = {}
+        self._tokens: TokenCache | None = None
+        self._cast: tuple[Any, dict[str, str]] | None = None  # see _cast_matcher
+
+    def listing(self, rel_dir: str) -> dict[str, os.stat_result]:
+        """Return ``{name: stat}`` for the regular files in *rel_dir*.
+
+        A missing or unreadable directory lists as empty.
+        """
+        listing = self._dirs.get(rel_dir)
+        if listing is None:
+            listing = {}
+            try:
+                with os.scandir(self.root / rel_dir) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_file():
+                                listing[entry.name] = entry.stat()
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+            self._dirs[rel_dir] = listing
+        return listing
+
+    def stat(self, rel_path: str) -> os.stat_result | None:
+        """Return the stat of *rel_path*, or None if it is not a regular file."""
+        rel_dir, _, name = rel_path.rpartition("/")
+        return self.listing(rel_dir).get(name)
+
+    def size(self, rel_path: str) -> int | None:
+        """Return the size of *rel_path* in bytes, or None if it is not a file."""
+        st = self.stat(rel_path)
+        return None if st is None else st.st_size
+
+    def exists(self, rel_path: str) -> bool:
+        """Return True if *rel_path* is a regular file."""
+        return self.stat(rel_path) is not None
+
+    def glob(self, rel_dir: str, pattern: str) -> list[str]:
+        """Return the files in *rel_dir* whose names match *pattern*, sorted."""
+        names = fnmatch.filter(self.listing(rel_dir), pattern)
+        return [f"{rel_dir}/{name}" for name in sorted(names)]
+
+    @property
+    def token_cache(self) -> TokenCache:
+        """The :class:`TokenCache` for this root and tokenizer, opened on first use."""
+        if self._tokens is None:
+            self._tokens = TokenCache(self.root, self.tokenizer, persistent=self.use_cache)
+        return self._tokens
+
+    def digest(self, rel_path: str) -> str | None:
+        """Return the SHA-256 of *rel_path*, or None if it is not a readable file."""
+        st = self.stat(rel_path)
+        return None if st is None else self.token_cache.digest(rel_path, st)
+
+    def sections(self, rel_path: str) -> list[Section]:
+        """Return the section index of *rel_path* (see :func:`parse_sections`)."""
+        st = self.stat(rel_path)
+        return [] if st is None else self.token_cache.sections(rel_path, st)
+
+    def tokens(self, entry: str) -> int:
+        """Return the token count of a manifest entry: a file or ``file#section``.
+
+        Returns 0 for a file that is not readable or a section it lacks.
+        """
+        rel_path, _, slug = entry.partition("#")
+        st = self.stat(rel_path)
+        if st is None:
+            return 0
+        if not slug:
+            return self.token_cache.tokens(rel_path, st)
+        slug, intro = _split_slug(slug)
+        for sec in self.token_cache.sections(rel_path, st):
+            if sec.slug == slug:
+                return sec.intro_tokens if intro else sec.tokens
+        return 0
+
+
+def get_manifest(state: dict[str, Any], root: Path, scan: CanonScan | None = None) -> list[str]:
     """Generate the context file manifest based on pipeline state.
 
     Rules:
@@ -57,128 +162,790 @@ def get_manifest(state: dict[str, Any], root: Path) -> list[str]:
         L4 (chapter): system + concept + arc + act outline + sibling ch outlines + current ch outline + characters
         L5 (scene):   system + concept + arc + act outline + ch outline + characters
     """
+    if scan is None:
+        scan = CanonScan(root)
     level = state.get("position", {}).get("level", "L1")
     act = state.get("position", {}).get("act")
     chapter = state.get("position", {}).get("chapter")
 
-    files: list[str] = []
+    # Insertion-ordered set: membership checks stay O(1) on large casts.
+    files: dict[str, None] = {}
 
     # Always include system files that exist.
     for sf in _SYSTEM_FILES:
-        if (root / sf).exists():
-            files.append(sf)
+        _add_if_exists(files, scan, sf)
 
     if level == "L1":
-        return files
+        return list(files)
 
     # L2+: add story concept
-    _add_if_exists(files, root, "canon/story-concept.md")
+    _add_if_exists(files, scan, "canon/story-concept.md")
 
     # L2+: add thematic architecture files
-    themes_dir = root / "canon" / "themes"
-    if themes_dir.exists():
-        for f in sorted(themes_dir.glob("*.md")):
-            if f.name == "README.md":
-                continue
-            _add_if_exists(files, root, f"canon/themes/{f.name}")
+    for rel in scan.glob("canon/themes", "*.md"):
+        if not rel.endswith("/README.md"):
+            _add_if_exists(files, scan, rel)
 
     if level == "L2":
-        return files
+        return list(files)
 
     # L3+: add story arc + act outlines
-    _add_if_exists(files, root, "canon/story-arc.md")
+    _add_if_exists(files, scan, "canon/story-arc.md")
 
     if level in ("L3", "L4", "L5") and act is not None:
         # Add all sibling act outlines (for cross-act awareness)
-        acts_dir = root / "canon" / "acts"
-        if acts_dir.exists():
-            for outline in sorted(acts_dir.glob("act-*-outline.md")):
-                rel = f"canon/acts/{outline.name}"
-                if rel not in files:
-                    files.append(rel)
+        for rel in scan.glob("canon/acts", "act-*-outline.md"):
+            _add_if_exists(files, scan, rel)
 
     if level == "L3":
-        return files
+        return list(files)
 
     # L4+: add current act's chapter outlines + character files
     if act is not None:
-        act_dir = root / "canon" / "acts" / f"act-{act}"
-        if act_dir.exists():
-            for ch_outline in sorted(act_dir.glob("ch*-outline.md")):
-                rel = f"canon/acts/act-{act}/{ch_outline.name}"
-                if rel not in files:
-                    files.append(rel)
+        for rel in scan.glob(f"canon/acts/act-{act}", "ch*-outline.md"):
+            _add_if_exists(files, scan, rel)
 
     # Add character files
-    chars_dir = root / "canon" / "characters"
-    if chars_dir.exists():
-        for char_file in sorted(chars_dir.glob("*.md")):
-            if char_file.name == "README.md":
-                continue
-            rel = f"canon/characters/{char_file.name}"
-            if rel not in files:
-                files.append(rel)
+    for rel in scan.glob("canon/characters", "*.md"):
+        if not rel.endswith("/README.md"):
+            _add_if_exists(files, scan, rel)
 
     if level == "L4":
-        return files
+        return list(files)
 
     # L5: add chapter outline (already added above) — no scene siblings to avoid context bloat.
-    return files
+    return list(files)
 
 
-def _add_if_exists(files: list[str], root: Path, rel_path: str) -> None:
+def _add_if_exists(files: dict[str, None], scan: CanonScan, rel_path: str) -> None:
     """Append rel_path to files if the file exists on disk."""
-    if (root / rel_path).exists() and rel_path not in files:
-        files.append(rel_path)
+    if scan.exists(rel_path):
+        files.setdefault(rel_path)
 
 
 # ---------------------------------------------------------------------------
 # Token estimation
 # ---------------------------------------------------------------------------
 
-def estimate_tokens(root: Path, files: list[str]) -> int:
-    """Estimate total tokens for a set of files based on byte count."""
-    total_bytes = 0
-    for f in files:
-        fpath = root / f
-        if fpath.exists():
+TokenCounter = Callable[[str], int]
+
+# Pre-tokenizer in the style of GPT BPE vocabularies: contractions, runs of
+# letters, one to three digits and runs of punctuation (each optionally led
+# by a space, which BPE merges into the token), and runs of whitespace.
+_PIECE_RE = re.compile(r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?(?:[^\s\w]|_)+|\s+")
+
+# First code point of the CJK, kana and hangul blocks, where BPE
+# vocabularies spend about a token per character.
+_CJK_START = 0x2E80
+
+
+def count_tokens(text: str) -> int:
+    """Estimate the BPE tokens in *text* with a word/punctuation model.
+
+    Splits *text* the way BPE pre-tokenizers do and prices each piece:
+    ASCII words cost a token per eight letters (common words are a single
+    token), other alphabets a token per three letters, CJK characters a
+    token each, numbers a token per three digits, punctuation a token per
+    three characters (``---`` and ``|`` in tables), and any whitespace run
+    one token. Unlike a flat bytes-per-token ratio this holds up on markdown
+    tables, YAML and non-English text.
+    """
+    total = 0
+    for piece in _PIECE_RE.findall(text):
+        body = piece[1:] if len(piece) > 1 and piece[0] == " " else piece
+        first = body[0]
+        if first.isspace() or first.isdigit():
+            total += 1
+        elif first.isalpha():
+            if body.isascii():
+                total += (len(body) + 7) // 8
+            else:
+                cjk = sum(1 for ch in body if ord(ch) >= _CJK_START)
+                total += cjk + (len(body) - cjk + 2) // 3
+        else:
+            total += (len(body) + 2) // 3
+    return total
+
+
+def _tiktoken_counter() -> TokenCounter:
+    try:
+        import tiktoken
+    except ImportError:
+        raise ValueError("The 'tiktoken' tokenizer needs the tiktoken package") from None
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+# Token counters by name, as factories so optional tokenizers load only when
+# used. Add an entry to plug in another counter; cached counts are keyed by
+# the name, so give a counter a new name when its counts change.
+TOKEN_COUNTERS: dict[str, Callable[[], TokenCounter]] = {
+    "approx": lambda: count_tokens,
+    "tiktoken": _tiktoken_counter,
+}
+
+# Bump when count_tokens() or parse_sections() change, to drop cached counts
+# and section indexes.
+_TOKEN_CACHE_VERSION = 3
+
+
+class TokenCache:
+    """Per-file content hashes, token counts and section indexes.
+
+    Kept in ``.cache/context-tokens.json`` under *root*. Each path remembers
+    the size, mtime and SHA-256 it was last seen with, so an unchanged file
+    is neither read nor re-hashed; :func:`manifest_hash` uses these hashes
+    too. Counts and section indexes are keyed by tokenizer and content hash,
+    so an edited file is counted again and files with identical content
+    share a count. The tokenizer is loaded on the first count.
+
+    Raises:
+        ValueError: If *tokenizer* is not in :data:`TOKEN_COUNTERS`, or (on
+            the first count) cannot be loaded.
+    """
+
+    def __init__(self, root: Path, tokenizer: str = "approx", persistent: bool = True) -> None:
+        factory = TOKEN_COUNTERS.get(tokenizer)
+        if factory is None:
+            raise ValueError(
+                f"Unknown tokenizer {tokenizer!r}; expected one of {', '.join(TOKEN_COUNTERS)}"
+            )
+        self.path = root / ".cache" / "context-tokens.json"
+        self.root = root
+        self.tokenizer = tokenizer
+        self.persistent = persistent
+        self._factory = factory
+        self._count: TokenCounter | None = None
+        # path -> [size, mtime_ns, sha256]; "tokenizer:sha256" -> tokens, and
+        # -> section index rows [slug, title, level, start, end, tokens].
+        self._files: dict[str, list[Any]] = {}
+        self._tokens: dict[str, int] = {}
+        self._sections: dict[str, list[list[Any]]] = {}
+        self._dirty = False
+        if persistent:
             try:
-                total_bytes += fpath.stat().st_size
-            except OSError:
-                pass
-    return int(total_bytes * _TOKENS_PER_BYTE)
+                with open(self.path, encoding="utf-8") as f:
+                    doc = json.load(f)
+                if doc.get("version") == _TOKEN_CACHE_VERSION:
+                    self._files, self._tokens = doc["files"], doc["tokens"]
+                    self._sections = doc["sections"]
+            except (OSError, ValueError, KeyError, AttributeError):
+                pass  # Missing or unreadable cache: count from scratch.
+
+    def digest(self, rel_path: str, st: os.stat_result) -> str | None:
+        """Return the SHA-256 of *rel_path*, re-hashing only if its stat changed.
+
+        Returns None if the file cannot be read.
+        """
+        return self._refresh(rel_path, st)[0]
+
+    def _refresh(self, rel_path: str, st: os.stat_result) -> tuple[str | None, bytes | None]:
+        """Return the hash of *rel_path* and, if it had to be read, its content."""
+        seen = self._files.get(rel_path)
+        if seen is not None and seen[0] == st.st_size and seen[1] == st.st_mtime_ns:
+            return seen[2], None
+        try:
+            content = (self.root / rel_path).read_bytes()
+        except OSError:
+            return None, None
+        sha = hashlib.sha256(content).hexdigest()
+        self._files[rel_path] = [st.st_size, st.st_mtime_ns, sha]
+        self._dirty = True
+        return sha, content
+
+    def _counter(self) -> TokenCounter:
+        if self._count is None:
+            self._count = self._factory()
+        return self._count
+
+    def tokens(self, rel_path: str, st: os.stat_result) -> int:
+        """Return the token count of *rel_path* (0 if it cannot be read)."""
+        sha, content = self._refresh(rel_path, st)
+        if sha is None:
+            return 0
+        key = f"{self.tokenizer}:{sha}"
+        count = self._tokens.get(key)
+        if count is None:
+            if content is None:
+                try:
+                    content = (self.root / rel_path).read_bytes()
+                except OSError:
+                    return 0
+            count = self._tokens[key] = self._counter()(content.decode("utf-8", errors="replace"))
+            self._dirty = True
+        return count
+
+    def sections(self, rel_path: str, st: os.stat_result) -> list[Section]:
+        """Return the :func:`parse_sections` index of *rel_path*, with token counts.
+
+        Indexes are cached by content hash like token counts, so an unchanged
+        file is not read again.
+        """
+        sha, content = self._refresh(rel_path, st)
+        if sha is None:
+            return []
+        key = f"{self.tokenizer}:{sha}"
+        rows = self._sections.get(key)
+        if rows is None:
+            if content is None:
+                try:
+                    content = (self.root / rel_path).read_bytes()
+                except OSError:
+                    return []
+            count = self._counter()
+            rows = self._sections[key] = [
+                [sec.slug, sec.title, sec.level, sec.start, sec.end,
+                 count(content[sec.start:sec.end].decode("utf-8", errors="replace")),
+                 sec.intro_end,
+                 count(content[sec.start:sec.intro_end].decode("utf-8", errors="replace"))]
+                for sec in parse_sections(content)
+            ]
+            self._dirty = True
+        return [Section(*row) for row in rows]
+
+    def save(self) -> None:
+        """Write the cache back if it changed, dropping counts no path uses."""
+        if not (self.persistent and self._dirty):
+            return
+        live = {sha for _, _, sha in self._files.values()}
+        tokens = {k: n for k, n in self._tokens.items() if k.partition(":")[2] in live}
+        sections = {k: rows for k, rows in self._sections.items() if k.partition(":")[2] in live}
+        doc = {
+            "version": _TOKEN_CACHE_VERSION,
+            "files": self._files,
+            "tokens": tokens,
+            "sections": sections,
+        }
+        try:
+            self.path.parent.mkdir(exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=".context-tokens.")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(doc, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except OSError:
+            return  # Read-only checkout: counts are recomputed next time.
+        self._dirty = False
+
+
+def file_tokens(root: Path, files: list[str], scan: CanonScan | None = None) -> dict[str, int]:
+    """Return the token count of each file in *files*, via the scan's cache."""
+    if scan is None:
+        scan = CanonScan(root)
+    counts = {f: scan.tokens(f) for f in files}
+    scan.token_cache.save()
+    return counts
+
+
+def estimate_tokens(root: Path, files: list[str], scan: CanonScan | None = None) -> int:
+    """Estimate total tokens for a set of files (see :func:`count_tokens`)."""
+    return sum(file_tokens(root, files, scan).values())
 
 
 # ---------------------------------------------------------------------------
 # Manifest with metadata
 # ---------------------------------------------------------------------------
 
-def get_manifest_with_meta(state: dict[str, Any], root: Path) -> dict[str, Any]:
-    """Return the manifest plus metadata (token estimate, hash)."""
-    files = get_manifest(state, root)
+def get_manifest_with_meta(
+    state: dict[str, Any],
+    root: Path,
+    scan: CanonScan | None = None,
+    sections: bool = False,
+) -> dict[str, Any]:
+    """Return the manifest plus metadata (token estimate, hash).
+
+    The file list, the estimate and the hash all come from one
+    :class:`CanonScan` of the tree. With *sections*, the list is
+    :func:`slice_manifest`'s.
+    """
+    if scan is None:
+        scan = CanonScan(root)
+    files = slice_manifest(state, root, scan) if sections else get_manifest(state, root, scan)
     return {
         "files": files,
-        "total_estimated_tokens": estimate_tokens(root, files),
-        "manifest_hash": get_manifest_hash(state, root),
+        "total_estimated_tokens": estimate_tokens(root, files, scan),
+        "manifest_hash": manifest_hash(root, files, scan),
     }
 
 
-def get_manifest_hash(state: dict[str, Any], root: Path) -> str:
+def get_manifest_hash(state: dict[str, Any], root: Path, scan: CanonScan | None = None) -> str:
     """Compute a deterministic hash of the manifest for reproducibility."""
-    files = get_manifest(state, root)
-    content = json.dumps(files, sort_keys=False)
-    return hashlib.sha256(content.encode()).hexdigest()[:16]
+    if scan is None:
+        scan = CanonScan(root)
+    return manifest_hash(root, get_manifest(state, root, scan), scan)
 
 
-def get_reproducibility_bundle(state: dict[str, Any], root: Path) -> dict[str, Any]:
-    """Build the reproducibility bundle for trace records."""
+def manifest_hash(root: Path, files: list[str], scan: CanonScan | None = None) -> str:
+    """Hash *files* and their contents, in order, as a Merkle tree.
+
+    Each leaf hashes an entry with the SHA-256 of its file's content (empty
+    for a missing file; a ``file#section`` slice uses the whole file's), so
+    the hash changes when a loaded file is edited, not only when the list
+    does. Content hashes come from the scan's
+    :class:`TokenCache`: only files whose size or mtime changed are read.
+    """
+    if scan is None:
+        scan = CanonScan(root)
+    level = [
+        hashlib.sha256(
+            b"\x00" + f"{rel}\x00{scan.digest(rel.partition('#')[0]) or ''}".encode()
+        ).digest()
+        for rel in files
+    ]
+    scan.token_cache.save()
+    if not level:
+        return hashlib.sha256(b"").hexdigest()[:16]
+    while len(level) > 1:
+        paired = [
+            hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest()
+            for i in range(0, len(level) - 1, 2)
+        ]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0].hex()[:16]
+
+
+def get_reproducibility_bundle(
+    state: dict[str, Any],
+    root: Path,
+    budget: int | None = None,
+    scan: CanonScan | None = None,
+    sections: bool = False,
+) -> dict[str, Any]:
+    """Build the reproducibility bundle for trace records.
+
+    The hash is that of the manifest the CLI loads: :func:`pack_manifest`
+    with the same *budget* and *sections*.
+    """
+    packed = pack_manifest(state, root, budget, scan, sections=sections)
     return {
-        "context_manifest_hash": get_manifest_hash(state, root),
+        "context_manifest_hash": packed["manifest_hash"],
         "canon_version": state.get("canon_version", 0),
         "agent_config": state.get("agents", {}),
     }
 
 
+# ---------------------------------------------------------------------------
+# Section slicing
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Section:
+    """One markdown heading and the text under it, as byte offsets.
+
+    ``[start, end)`` runs from the heading line to the next heading of the
+    same or a higher level, so a section includes its subsections. ``slug``
+    is the GitHub-style anchor that names it in ``file#slug`` entries.
+    ``[start, intro_end)`` is its intro: the heading and the text before
+    its first subsection, named ``file#slug:intro``.
+    """
+
+    slug: str
+    title: str
+    level: int
+    start: int
+    end: int
+    tokens: int = 0
+    intro_end: int = 0
+    intro_tokens: int = 0
+
+
+# Suffix naming a section's intro rather than the whole section; slugify()
+# never produces a colon, so it cannot clash with a real slug.
+_INTRO_SUFFIX = ":intro"
+
+
+def _split_slug(slug: str) -> tuple[str, bool]:
+    """Split an entry's ``slug`` or ``slug:intro`` into the slug and an intro flag."""
+    if slug.endswith(_INTRO_SUFFIX):
+        return slug[:-len(_INTRO_SUFFIX)], True
+    return slug, False
+
+
+_HEADING_RE = re.compile(rb"^(#{1,6})[ \t]+(.*?)[ \t#]*$")
+_FENCE_RE = re.compile(rb"^ {0,3}(```|~~~)")
+_CHAPTER_RE = re.compile(r"\b(?:chapter|ch)[ .]*(\d+)\b", re.IGNORECASE)
+_CHAPTER_OUTLINE_RE = re.compile(r"^canon/acts/act-[^/]+/ch[^/]*-outline\.md$")
+
+
+def slugify(title: str) -> str:
+    """Return the GitHub-style anchor for a heading *title*."""
+    slug = re.sub(r"[^\w\- ]", "", title.strip().lower())
+    return slug.replace(" ", "-")
+
+
+def parse_sections(content: bytes) -> list[Section]:
+    """Index the ATX headings in *content*, in document order.
+
+    Headings inside fenced code blocks are ignored; repeated slugs get
+    ``-1``, ``-2``, ... suffixes as on GitHub. Text before the first heading
+    belongs to no section.
+    """
+    sections: list[Section] = []
+    seen: dict[str, int] = {}
+    open_sections: list[Section] = []
+    fence: bytes | None = None
+    offset = 0
+    for line in content.splitlines(keepends=True):
+        stripped = line.rstrip(b"\r\n")
+        fence_match = _FENCE_RE.match(stripped)
+        if fence_match:
+            if fence is None:
+                fence = fence_match.group(1)
+            elif fence_match.group(1) == fence:
+                fence = None
+        elif fence is None and (match := _HEADING_RE.match(stripped)):
+            level = len(match.group(1))
+            while open_sections and open_sections[-1].level >= level:
+                open_sections.pop().end = offset
+            title = match.group(2).decode("utf-8", errors="replace")
+            slug = slugify(title)
+            if slug in seen:
+                seen[slug] += 1
+                slug = f"{slug}-{seen[slug]}"
+            else:
+                seen[slug] = 0
+            section = Section(slug, title, level, offset, len(content))
+            sections.append(section)
+            open_sections.append(section)
+        offset += len(line)
+    for sec, following in zip(sections, [*sections[1:], None]):
+        nested = following is not None and following.start < sec.end
+        sec.intro_end = following.start if nested else sec.end
+    return sections
+
+
+def read_entry(root: Path, entry: str) -> str:
+    """Return the text of a manifest entry: a whole file, a ``file#section``
+    or a ``file#section:intro``.
+
+    Raises:
+        KeyError: If the file has no section with that slug.
+    """
+    rel_path, _, slug = entry.partition("#")
+    content = (root / rel_path).read_bytes()
+    if slug:
+        slug, intro = _split_slug(slug)
+        for sec in parse_sections(content):
+            if sec.slug == slug:
+                content = content[sec.start:sec.intro_end if intro else sec.end]
+                break
+        else:
+            raise KeyError(f"{rel_path} has no section {slug!r}")
+    return content.decode("utf-8", errors="replace")
+
+
+def _chapter_of(title: str) -> int | None:
+    match = _CHAPTER_RE.search(title)
+    return int(match.group(1)) if match else None
+
+
+def _slices_without(rel_path: str, sections: list[Section], drop: list[Section]) -> list[str]:
+    """Cover *rel_path* with section entries, leaving out the *drop* sections.
+
+    Sections that contain none of *drop* are kept whole; those that do are
+    split into their intro (``slug:intro``) and their subsections. Text
+    before the first heading, and headings with an empty slug, cannot be
+    named and are left out. Returns ``[rel_path]`` when nothing is dropped,
+    and also when nothing would be left, so a file is never lost entirely.
+    """
+    if not drop:
+        return [rel_path]
+    entries: list[str] = []
+    covered = 0
+    for sec in sections:
+        if sec.start < covered:
+            continue  # Inside a section already kept or dropped.
+        if sec in drop:
+            covered = sec.end
+        elif not any(sec.start <= d.start < sec.end for d in drop):
+            if sec.slug:
+                entries.append(f"{rel_path}#{sec.slug}")
+            covered = sec.end
+        elif sec.slug:
+            entries.append(f"{rel_path}#{sec.slug}{_INTRO_SUFFIX}")
+    return entries or [rel_path]
+
+
+def _outline_slices(rel_path: str, chapter: int | None, scan: CanonScan) -> list[str]:
+    """Return *rel_path* without the sections for chapters other than *chapter*."""
+    sections = scan.sections(rel_path)
+    drop = [
+        sec for sec in sections
+        if (n := _chapter_of(sec.title)) is not None and n != chapter
+    ]
+    return _slices_without(rel_path, sections, drop)
+
+
+def _chapter_text(state: dict[str, Any], root: Path, scan: CanonScan) -> str:
+    """Return the outline text for the current chapter.
+
+    That is the chapter outline file when there is one, else the act
+    outline's section for the chapter, else the whole act outline.
+    """
+    position = state.get("position", {})
+    act, chapter = position.get("act"), position.get("chapter")
+    chapter_outline = f"canon/acts/act-{act}/ch{chapter}-outline.md"
+    if scan.exists(chapter_outline):
+        return read_entry(root, chapter_outline)
+    act_outline = f"canon/acts/act-{act}-outline.md"
+    if not scan.exists(act_outline):
+        return ""
+    for sec in scan.sections(act_outline):
+        if _chapter_of(sec.title) == chapter:
+            return read_entry(root, f"{act_outline}#{sec.slug}")
+    return read_entry(root, act_outline)
+
+
+def _character_slices(rel_path: str, cast: set[str], matcher: Any, scan: CanonScan) -> list[str]:
+    """Return the parts of a character file about the entities in *cast*.
+
+    A file named after a cast member is kept whole; in any other file (a
+    shared cast list, say) only the top-most sections whose headings name
+    a cast member are kept.
+    """
+    if rel_path.rpartition("/")[2][:-3] in cast:
+        return [rel_path]
+    entries = []
+    covered = 0
+    for sec in scan.sections(rel_path):
+        if sec.start < covered:
+            continue
+        if sec.slug and any(set(m.entity_ids) & cast for m in matcher.scan(sec.title)):
+            entries.append(f"{rel_path}#{sec.slug}")
+            covered = sec.end
+    return entries
+
+
+def slice_manifest(state: dict[str, Any], root: Path, scan: CanonScan | None = None) -> list[str]:
+    """Return the manifest with whole files narrowed to the sections a scene needs.
+
+    At L4 and L5 (with an act and chapter set), entries may be ``file#slug``
+    slices naming a :class:`Section`:
+
+    - act outlines lose the sections for other chapters;
+    - at L5, the other chapters' outline files are left out;
+    - character files are kept only for the characters mentioned in the
+      current chapter's outline (see :func:`referenced_characters`), whole
+      when the file is named after one and as the matching sections of
+      shared files otherwise.
+
+    Other levels and files are returned as :func:`get_manifest` lists them.
+    """
+    if scan is None:
+        scan = CanonScan(root)
+    files = get_manifest(state, root, scan)
+    position = state.get("position", {})
+    level, act, chapter = position.get("level"), position.get("act"), position.get("chapter")
+    if level not in ("L4", "L5") or act is None or chapter is None:
+        return files
+
+    matcher, character_files = _cast_matcher(root, scan)
+    text = _chapter_text(state, root, scan)
+    cast = {eid for m in matcher.scan(text) for eid in m.entity_ids} if text else set()
+    current = _current_outlines(state)
+    entries: list[str] = []
+    for rel in files:
+        if rel.startswith("canon/characters/"):
+            entries.extend(_character_slices(rel, cast, matcher, scan))
+        elif _CHAPTER_OUTLINE_RE.match(rel):
+            if rel in current or level == "L4":
+                entries.append(rel)
+        elif rel.startswith("canon/acts/"):
+            entries.extend(_outline_slices(rel, chapter if rel in current else None, scan))
+        else:
+            entries.append(rel)
+    return entries
+
+
+# ---------------------------------------------------------------------------
+# Budgeted packing
+# ---------------------------------------------------------------------------
+
+# Packing tiers, most important first. System files are always loaded; the
+# other tiers are filled greedily, in order, while they fit the budget.
+PACK_TIERS = (
+    "system",      # _SYSTEM_FILES
+    "current",     # current act outline and, at L4/L5, chapter outline
+    "parents",     # story concept and story arc
+    "cast",        # characters mentioned in the current outline
+    "themes",      # canon/themes/*.md
+    "siblings",    # other act/chapter outlines, nearest first
+    "characters",  # every other character file
+)
+
+_NUMBER_RE = re.compile(r"(\d+)")
+
+
+def _current_outlines(state: dict[str, Any]) -> list[str]:
+    """Return the outlines for the current position, most specific first."""
+    position = state.get("position", {})
+    level, act, chapter = position.get("level", "L1"), position.get("act"), position.get("chapter")
+    outlines = []
+    if level in ("L4", "L5") and act is not None and chapter is not None:
+        outlines.append(f"canon/acts/act-{act}/ch{chapter}-outline.md")
+    if level in ("L3", "L4", "L5") and act is not None:
+        outlines.append(f"canon/acts/act-{act}-outline.md")
+    return outlines
+
+
+def _sibling_distance(rel_path: str, current: Any) -> int:
+    """How far the act/chapter numbered in *rel_path* is from *current*."""
+    match = _NUMBER_RE.search(rel_path.rpartition("/")[2])
+    if match is None or not isinstance(current, int):
+        return sys.maxsize
+    return abs(int(match.group(1)) - current)
+
+
+def _cast_matcher(root: Path, scan: CanonScan) -> tuple[Any, dict[str, str]]:
+    """Return a mention matcher for the cast and ``{entity ID: character file}``.
+
+    Names come from ``canon/relationships.yaml`` (entity IDs, labels and
+    aliases) plus each character file's own name, so a file such as
+    ``canon/characters/marcus.md`` is picked up by "Marcus" even before
+    Marcus is in the relationships file. Matching uses
+    ``relationship_query.MentionMatcher``.
+
+    The relationships file is only parsed, never indexed or snapshotted, and
+    a missing, unreadable or malformed one counts as having no entities.
+    The result is kept on *scan*.
+    """
+    if scan._cast is not None:
+        return scan._cast
+    # Imported here: only packing and slicing need the relationships machinery.
+    from relationship_query import MentionMatcher, entity_names, load
+
+    character_files = {
+        rel.rpartition("/")[2][:-3]: rel
+        for rel in scan.glob("canon/characters", "*.md")
+        if not rel.endswith("/README.md")
+    }
+    entities: dict[str, Any] = {}
+    if scan.exists("canon/relationships.yaml"):
+        try:
+            data = load(root / "canon/relationships.yaml")
+        except (OSError, ValueError, YAMLError):
+            data = None
+        raw = data.get("entities") if isinstance(data, dict) else None
+        if isinstance(raw, dict):
+            for eid, info in raw.items():
+                info = info if isinstance(info, dict) else {}
+                aliases = info.get("aliases")
+                entities[str(eid)] = {
+                    "label": info.get("label"),
+                    "aliases": aliases if isinstance(aliases, list) else [],
+                }
+    names = entity_names(entities)
+    for stem in character_files:
+        for name in (stem, stem.replace("-", " ").replace("_", " ")):
+            names.setdefault(name, set()).add(stem)
+    scan._cast = MentionMatcher(names), character_files
+    return scan._cast
+
+
+def referenced_characters(root: Path, outline: str, scan: CanonScan) -> list[str]:
+    """Return the character files for the entities mentioned in *outline*."""
+    if not scan.exists(outline):
+        return []
+    matcher, character_files = _cast_matcher(root, scan)
+    if not character_files:
+        return []
+    found: dict[str, None] = {}
+    for mention in matcher.scan(read_entry(root, outline)):
+        for eid in mention.entity_ids:
+            if eid in character_files:
+                found.setdefault(character_files[eid])
+    return list(found)
+
+
+def _rank(
+    state: dict[str, Any],
+    root: Path,
+    files: list[str],
+    scan: CanonScan,
+) -> list[tuple[int, str]]:
+    """Return ``(tier index, entry)`` for each of *files*, best first.
+
+    Slices rank with their file, except that character slices are always
+    in the cast tier: :func:`slice_manifest` keeps only mentioned characters.
+    """
+    position = state.get("position", {})
+    current = _current_outlines(state)
+    cast = referenced_characters(root, current[0], scan) if current else []
+    tier = {name: i for i, name in enumerate(PACK_TIERS)}
+
+    def key(entry: str) -> tuple[int, int]:
+        rel, _, slug = entry.partition("#")
+        if slug and rel.startswith("canon/characters/"):
+            return tier["cast"], len(cast)
+        if rel in _SYSTEM_FILES:
+            return tier["system"], 0
+        if rel in current:
+            return tier["current"], current.index(rel)
+        if rel in ("canon/story-concept.md", "canon/story-arc.md"):
+            return tier["parents"], 0
+        if rel in cast:
+            return tier["cast"], cast.index(rel)
+        if rel.startswith("canon/themes/"):
+            return tier["themes"], 0
+        if rel.startswith("canon/acts/act-") and "/" in rel[len("canon/acts/"):]:
+            return tier["siblings"], _sibling_distance(rel, position.get("chapter"))
+        if rel.startswith("canon/acts/"):
+            return tier["siblings"], _sibling_distance(rel, position.get("act"))
+        return tier["characters"], 0
+
+    # Ties keep manifest order.
+    ranked = sorted((key(rel), i, rel) for i, rel in enumerate(files))
+    return [(rank[0], rel) for rank, _, rel in ranked]
+
+
+def pack_manifest(
+    state: dict[str, Any],
+    root: Path,
+    budget: int | None = None,
+    scan: CanonScan | None = None,
+    sections: bool = False,
+) -> dict[str, Any]:
+    """Return the subset of the manifest that fits the token budget.
+
+    With *sections*, the candidates are the entries of :func:`slice_manifest`
+    rather than whole files.
+
+    *budget* defaults to the state's ``max_context_tokens``. Files are taken
+    tier by tier (see :data:`PACK_TIERS`); a file that does not fit is
+    dropped and smaller files after it may still be taken. System files are
+    always kept, so ``over_budget`` is True only when they alone exceed the
+    budget. ``files`` keeps manifest order; ``dropped`` lists each left-out
+    file with its estimate and tier, best first.
+    """
+    if scan is None:
+        scan = CanonScan(root)
+    if budget is None:
+        budget = state.get("max_context_tokens", 100000)
+    files = slice_manifest(state, root, scan) if sections else get_manifest(state, root, scan)
+    tokens = file_tokens(root, files, scan)
+
+    kept: set[str] = set()
+    dropped = []
+    total = 0
+    for tier, rel in _rank(state, root, files, scan):
+        if PACK_TIERS[tier] == "system" or total + tokens[rel] <= budget:
+            kept.add(rel)
+            total += tokens[rel]
+        else:
+            dropped.append({"file": rel, "tokens": tokens[rel], "tier": PACK_TIERS[tier]})
+
+    packed = [rel for rel in files if rel in kept]
+    return {
+        "files": packed,
+        "dropped": dropped,
+        "total_estimated_tokens": total,
+        "max_context_tokens": budget,
+        "over_budget": total > budget,
+        "manifest_hash": manifest_hash(root, packed, scan),
+    }
+
+
 # ---------------------------------------------------------------------------
 # CLI
 # ---------------------------------------------------------------------------
@@ -187,6 +954,26 @@ def main(argv: list[str] | None = None) -> int:
     parser = argparse.ArgumentParser(description="Generate context manifest from pipeline state")
     parser.add_argument("--state", required=True, help="Path to .pipeline-state.yaml")
     parser.add_argument("--root", default=".", help="Project root directory")
+    parser.add_argument(
+        "--budget", type=int, default=None,
+        help="Token budget (default: max_context_tokens from the state file)",
+    )
+    parser.add_argument(
+        "--no-budget", action="store_true",
+        help="List the full manifest without packing it into the budget",
+    )
+    parser.add_argument(
+        "--sections", action="store_true",
+        help="At L4/L5, load file#section slices for the current chapter and its cast",
+    )
+    parser.add_argument(
+        "--tokenizer", choices=sorted(TOKEN_COUNTERS), default="approx",
+        help="Token counter for estimates (default: approx)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Read and write no cache files (token counts, content hashes, sections)",
+    )
     args = parser.parse_args(argv)
 
     state_path = Path(args.state)
@@ -197,14 +984,31 @@ def main(argv: list[str] | None = None) -> int:
         return 1
 
     state = load_state(state_path)
-    meta = get_manifest_with_meta(state, root)
+    scan = CanonScan(root, args.tokenizer, use_cache=not args.no_cache)
+    try:
+        if args.no_budget:
+            meta = get_manifest_with_meta(state, root, scan, sections=args.sections)
+        else:
+            meta = pack_manifest(state, root, args.budget, scan, sections=args.sections)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
 
     print("Context manifest:")
     for f in meta["files"]:
-        exists = "OK" if (root / f).exists() else "MISSING"
+        exists = "OK" if scan.exists(f.partition("#")[0]) else "MISSING"
         print(f"  [{exists}] {f}")
     print(f"\nTotal files: {len(meta['files'])}")
-    print(f"Estimated tokens: {meta['total_estimated_tokens']}")
+    if args.no_budget:
+        print(f"Estimated tokens: {meta['total_estimated_tokens']}")
+    else:
+        print(f"Estimated tokens: {meta['total_estimated_tokens']} / {meta['max_context_tokens']}")
+        if meta["dropped"]:
+            print(f"Dropped {len(meta['dropped'])} files over budget:")
+            for d in meta["dropped"]:
+                print(f"  [{d['tier']}] {d['file']} (~{d['tokens']} tokens)")
+        if meta["over_budget"]:
+            print("Warning: system files alone exceed the budget", file=sys.stderr)
     print(f"Manifest hash: {meta['manifest_hash']}")
     return 0
 
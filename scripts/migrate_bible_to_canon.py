@@ -24,15 +24,27 @@ from typing import Any
 # ---------------------------------------------------------------------------
 try:
     import yaml as _yaml  # type: ignore[import-untyped]
+except ImportError:
+    _yaml = None
+
+if _yaml is not None:
+    try:
+        from yaml_io import safe_dump as _safe_dump
+        from yaml_io import safe_load as _safe_load
+    except ImportError:
+        # scripts/ is not on sys.path: PyYAML is still here, just without
+        # the libyaml-aware helpers.
+        _safe_dump = _yaml.safe_dump
+        _safe_load = _yaml.safe_load
 
     def _dump_yaml(data: Any) -> str:
-        return _yaml.dump(data, default_flow_style=False, sort_keys=False, allow_unicode=True)
+        return _safe_dump(data, default_flow_style=False, sort_keys=False, allow_unicode=True)
 
     def _load_yaml(text: str) -> Any:
-        return _yaml.safe_load(text)
+        return _safe_load(text)
 
     _HAS_YAML = True
-except ImportError:
+else:
     _HAS_YAML = False
 
     def _dump_yaml(data: Any) -> str:  # type: ignore[misc]
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""SQLite index over a relationships YAML file.
+
+``RelationshipDB`` mirrors the YAML into a local SQLite database (entities,
+aliases, vocabulary and relationships with packed validity positions, all
+indexed) and answers ``query``, ``query_many``, ``render_matrix``, ``diff``
+and ``validate`` with indexed SQL instead of scanning every record. The YAML
+stays the source of truth: :meth:`RelationshipDB.sync` compares the file's
+hash with the one recorded at the last sync and, when it changed, rewrites
+only the rows whose records changed.
+
+Results are the same objects, in the same order, as the matching
+``relationship_query`` functions return. ``relationship_query.py --db``
+routes those commands through the database kept next to the snapshot cache.
+
+Usage:
+    from relationship_db import RelationshipDB
+    db = RelationshipDB.for_file("canon/relationships.yaml")
+    db.query("marcus", as_of="Act2/Ch1")
+"""
+
+from __future__ import annotations
+
+import itertools
+import pickle
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterable
+
+from relationship_query import (
+    RelationshipDiff,
+    ValidationResult,
+    _alias_errors,
+    _content_hash,
+    _flatten_vocabulary,
+    _is_active,
+    _match_strings,
+    _overlapping_spans,
+    _pair_supersessions,
+    _render_matrix,
+    _supersession_cycles,
+    _validity_span,
+    load,
+    parse_position,
+    position_key,
+    record_format_errors,
+    snapshot_path,
+)
+
+# Bump when the table layout or the pickled row format changes.
+_SCHEMA_VERSION = 1
+
+# Columns without a declared type keep Python ints and strings apart, as
+# the YAML does; ``doc`` is the pickled record, returned as-is.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS entities (id PRIMARY KEY, type, ord INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS aliases (alias, entity_id, ord INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS aliases_by_alias ON aliases (alias);
+CREATE INDEX IF NOT EXISTS aliases_by_entity ON aliases (entity_id);
+CREATE TABLE IF NOT EXISTS relationships (
+    pos INTEGER PRIMARY KEY,
+    id,
+    has_id INTEGER NOT NULL,
+    src,
+    dst,
+    rel,
+    supersedes,
+    superseded_by,
+    start INTEGER,
+    "end" INTEGER,
+    checked INTEGER NOT NULL,
+    errors BLOB NOT NULL,
+    doc BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS relationships_by_src ON relationships (src);
+CREATE INDEX IF NOT EXISTS relationships_by_dst ON relationships (dst);
+CREATE INDEX IF NOT EXISTS relationships_by_id ON relationships (id, pos);
+CREATE INDEX IF NOT EXISTS relationships_by_triple ON relationships (src, dst, rel, pos);
+CREATE INDEX IF NOT EXISTS relationships_by_start ON relationships (start);
+CREATE INDEX IF NOT EXISTS relationships_by_end ON relationships ("end");
+CREATE INDEX IF NOT EXISTS relationships_by_supersedes ON relationships (supersedes);
+"""
+
+# The record that owns each ID: the last one in file order, as in
+# ``validate_relationships``.
+_OWNERS = "SELECT id, MAX(pos) AS pos FROM relationships WHERE has_id GROUP BY id"
+
+
+def _row(pos: int, r: dict[str, Any], vocab: set[str], doc: bytes) -> tuple[Any, ...]:
+    span = _validity_span(r)
+    # Overlap checks skip records whose valid_from is missing, unlike
+    # temporal lookups, which treat it as open.
+    checked = span is not None and r.get("valid_from") is not None
+    return (
+        pos,
+        r.get("id", f"<missing@{pos}>"),
+        "id" in r,
+        r.get("from", ""),
+        r.get("to", ""),
+        r.get("rel", ""),
+        r.get("supersedes"),
+        r.get("superseded_by"),
+        None if span is None else span[0],
+        None if span is None else span[1],
+        checked,
+        pickle.dumps(record_format_errors(r, vocab), protocol=pickle.HIGHEST_PROTOCOL),
+        doc,
+    )
+
+
+class RelationshipDB:
+    """SQLite mirror of one relationships file with the store's query API."""
+
+    def __init__(self, db_path: str | Path, source: str | Path) -> None:
+        self.path = Path(db_path)
+        self.source = Path(source)
+        self.conn = sqlite3.connect(self.path)
+        (version,) = self.conn.execute("PRAGMA user_version").fetchone()
+        if version != _SCHEMA_VERSION:
+            with self.conn:
+                for table in ("meta", "entities", "aliases", "relationships"):
+                    self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self.conn.executescript(_SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self.entities: dict[str, Any] = pickle.loads(self._meta("entities") or pickle.dumps({}))
+
+    @classmethod
+    def for_file(cls, file_path: str | Path, cache_dir: str | Path | None = None) -> RelationshipDB:
+        """Open (creating if needed) and :meth:`sync` the database for *file_path*.
+
+        The database lives next to the snapshot cache, as ``<snapshot>.sqlite``.
+        """
+        db_path = snapshot_path(file_path, cache_dir).with_suffix(".sqlite")
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        db = cls(db_path, file_path)
+        db.sync()
+        return db
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _meta(self, key: str) -> Any:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    # -- Sync --------------------------------------------------------------
+
+    def sync(self) -> int:
+        """Bring the database up to date with the YAML; return the rows rewritten.
+
+        Nothing is read beyond the file hash if it matches the last sync.
+        Otherwise the file is parsed and compared record by record: changed
+        and new records are rewritten, records past the new end are
+        dropped, and the entity tables are rebuilt only if ``entities``
+        changed. A ``rel_vocabulary`` change re-checks every record.
+        """
+        digest = _content_hash(self.source)
+        if self._meta("sha256") == digest:
+            return 0
+        data = load(self.source)
+        entities = data.get("entities") or {}
+        vocabulary = data.get("rel_vocabulary") or {}
+        vocab = _flatten_vocabulary(vocabulary)
+        relationships = data.get("relationships") or []
+
+        entities_blob = pickle.dumps(entities, protocol=pickle.HIGHEST_PROTOCOL)
+        vocab_blob = pickle.dumps(vocabulary, protocol=pickle.HIGHEST_PROTOCOL)
+        recheck = self._meta("vocabulary") != vocab_blob
+        stored = dict(self.conn.execute("SELECT pos, doc FROM relationships"))
+
+        rows = []
+        for pos, r in enumerate(relationships):
+            doc = pickle.dumps(r, protocol=pickle.HIGHEST_PROTOCOL)
+            if recheck or stored.get(pos) != doc:
+                rows.append(_row(pos, r, vocab, doc))
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO relationships VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.execute("DELETE FROM relationships WHERE pos >= ?", (len(relationships),))
+            if self._meta("entities") != entities_blob:
+                self.conn.execute("DELETE FROM entities")
+                self.conn.execute("DELETE FROM aliases")
+                self.conn.executemany(
+                    "INSERT INTO entities VALUES (?, ?, ?)",
+                    (
+                        (eid, (einfo or {}).get("type"), n)
+                        for n, (eid, einfo) in enumerate(entities.items())
+                    ),
+                )
+                self.conn.executemany(
+                    "INSERT INTO aliases VALUES (?, ?, ?)",
+                    (
+                        (alias, eid, n)
+                        for n, (eid, einfo) in enumerate(entities.items())
+                        for alias in (einfo or {}).get("aliases", [])
+                    ),
+                )
+            for key, value in (
+                ("entities", entities_blob), ("vocabulary", vocab_blob), ("sha256", digest)
+            ):
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+        self.entities = entities
+        return len(rows)
+
+    # -- Queries -----------------------------------------------------------
+
+    def entity_ids_for(self, entity: str) -> set[str]:
+        """Return the entity IDs *entity* could refer to (see ``query``)."""
+        ids = {
+            eid for (eid,) in self.conn.execute(
+                "SELECT entity_id FROM aliases WHERE alias = ?", (entity,)
+            )
+        }
+        if entity in self.entities:
+            ids.add(entity)
+        return ids
+
+    def query(self, entity: str, as_of: str | None = None) -> list[dict[str, Any]]:
+        """SQL equivalent of ``query``; same matching and ordering."""
+        match = sorted(_match_strings(self.entities, entity, self.entity_ids_for(entity)), key=str)
+        marks = ", ".join("?" * len(match))
+        sql = (
+            f"SELECT doc, start FROM relationships WHERE pos IN ("
+            f"SELECT pos FROM relationships WHERE src IN ({marks}) "
+            f"UNION SELECT pos FROM relationships WHERE dst IN ({marks}))"
+        )
+        params: list[Any] = [*match, *match]
+        as_of_pos = None
+        if as_of is not None:
+            key = position_key(as_of)
+            as_of_pos = parse_position(as_of)
+            sql += ' AND (start IS NULL OR (start <= ? AND ? < "end"))'
+            params += [key, key]
+        results = []
+        for doc, start in self.conn.execute(sql + " ORDER BY pos", params):
+            rel = pickle.loads(doc)
+            # Malformed position: defer to query()'s check so the same
+            # records are skipped or raise the same error.
+            if start is None and as_of_pos is not None and not _is_active(rel, as_of_pos):
+                continue
+            results.append(rel)
+        return results
+
+    def query_many(
+        self,
+        entities: Iterable[str],
+        as_of: str | None = None,
+    ) -> dict[str, list[dict[str, Any]]]:
+        """SQL equivalent of ``query_many``."""
+        return {entity: self.query(entity, as_of=as_of) for entity in dict.fromkeys(entities)}
+
+    def active_at(self, as_of: str) -> list[dict[str, Any]]:
+        """Return every relationship active at *as_of*, in file order."""
+        key = position_key(as_of)
+        return [
+            pickle.loads(doc) for (doc,) in self.conn.execute(
+                'SELECT doc FROM relationships WHERE start <= ? AND ? < "end" ORDER BY pos',
+                (key, key),
+            )
+        ]
+
+    def relationships(self) -> list[dict[str, Any]]:
+        """Return every relationship, in file order."""
+        return [
+            pickle.loads(doc)
+            for (doc,) in self.conn.execute("SELECT doc FROM relationships ORDER BY pos")
+        ]
+
+    def render_matrix(self, as_of: str | None = None, **options: Any) -> str:
+        """SQL equivalent of ``render_matrix``; takes the same options."""
+        active = self.active_at(as_of) if as_of is not None else self.relationships()
+        return _render_matrix(self.entities, active, **options)
+
+    def diff(self, pos_from: str, pos_to: str) -> RelationshipDiff:
+        """SQL equivalent of ``diff``, over the start and end indexes."""
+        start, end = position_key(pos_from), position_key(pos_to)
+        if start > end:
+            raise ValueError(f"diff --from {pos_from} is after --to {pos_to}")
+        # One object per row, so pairs match the ``ended`` records by identity.
+        records: dict[int, dict[str, Any]] = {}
+
+        def fetch(sql: str, params: tuple[Any, ...]) -> list[dict[str, Any]]:
+            return [
+                records.setdefault(pos, pickle.loads(doc))
+                for pos, doc in self.conn.execute(sql + " ORDER BY pos", params)
+            ]
+
+        added = fetch(
+            'SELECT pos, doc FROM relationships WHERE start > ? AND start <= ? AND "end" > ?',
+            (start, end, end),
+        )
+        ended = fetch(
+            'SELECT pos, doc FROM relationships WHERE "end" > ? AND "end" <= ? AND start <= ?',
+            (start, end, start),
+        )
+        owner_sql = (
+            'SELECT pos, doc FROM relationships WHERE has_id AND id = ? AND pos = '
+            "(SELECT MAX(pos) FROM relationships WHERE has_id AND id = ?)"
+        )
+
+        def find(rid: Any) -> dict[str, Any] | None:
+            found = fetch(owner_sql, (rid, rid))
+            return found[0] if found else None
+
+        def active_at_start(rel: dict[str, Any]) -> bool:
+            span = _validity_span(rel)
+            return span is not None and span[0] <= start < span[1]
+
+        return _pair_supersessions(pos_from, pos_to, added, ended, find, active_at_start)
+
+    # -- Validation --------------------------------------------------------
+
+    def validate(self) -> ValidationResult:
+        """SQL equivalent of ``validate_relationships``; same errors, same order.
+
+        Per-record format checks are stored at sync time; duplicate IDs,
+        supersession links and temporal overlaps are indexed joins, and only
+        the ``supersedes`` edges are walked in Python for cycles.
+        """
+        conn = self.conn
+        errors = [
+            f"Duplicate relationship ID: {rid}" for (rid,) in conn.execute(
+                "SELECT r.id FROM relationships r WHERE r.pos > "
+                "(SELECT MIN(d.pos) FROM relationships d WHERE d.id IS r.id) ORDER BY r.pos"
+            )
+        ]
+        errors.extend(_alias_errors(self.entities))
+
+        link_errors: dict[int, list[str]] = {}
+        for link, back in (("supersedes", "superseded_by"), ("superseded_by", "supersedes")):
+            sql = (
+                f"SELECT r.pos, r.id, r.has_id, r.{link}, t.pos, t.{back} "
+                f"FROM relationships r "
+                f"LEFT JOIN ({_OWNERS}) o ON o.id = r.{link} "
+                f"LEFT JOIN relationships t ON t.pos = o.pos "
+                f"WHERE r.{link} IS NOT NULL AND (t.pos IS NULL OR t.{back} IS NOT r.id "
+                f"OR NOT r.has_id)"
+            )
+            for pos, rid, has_id, target, target_pos, target_back in conn.execute(sql):
+                rid = rid if has_id else "<unknown>"
+                if target_pos is None:
+                    msg = f"{rid}: {link} '{target}' which does not exist"
+                elif target_back == rid:
+                    continue
+                else:
+                    msg = (
+                        f"{rid}: {link} '{target}', but "
+                        f"'{target}'.{back} = {target_back!r} (expected '{rid}')"
+                    )
+                link_errors.setdefault(pos, []).append(msg)
+        for pos, blob in conn.execute(
+            "SELECT pos, errors FROM relationships WHERE length(errors) > 0 ORDER BY pos"
+        ):
+            own = pickle.loads(blob) + link_errors.pop(pos, [])
+            link_errors[pos] = own
+        for pos in sorted(link_errors):
+            errors.extend(link_errors[pos])
+
+        errors.extend(self._cycle_errors())
+        errors.extend(self._overlap_errors())
+        return ValidationResult(ok=not errors, errors=errors)
+
+    def _cycle_errors(self) -> list[str]:
+        owners = {
+            rid: {"supersedes": supersedes}
+            for rid, supersedes in self.conn.execute(
+                f"SELECT r.id, r.supersedes FROM ({_OWNERS}) o "
+                f"JOIN relationships r ON r.pos = o.pos"
+            )
+        }
+        first = dict(self.conn.execute("SELECT id, MIN(pos) FROM relationships GROUP BY id"))
+        starts = sorted(
+            (rid for rid, rel in owners.items() if rel["supersedes"] is not None),
+            key=first.__getitem__,
+        )
+        cycles = []
+        for cycle in _supersession_cycles(owners, starts):
+            i = min(range(len(cycle)), key=lambda n: first[cycle[n]])
+            cycles.append(cycle[i:] + cycle[:i])
+        cycles.sort(key=lambda cycle: first[cycle[0]])
+        return [
+            "Circular supersession chain detected involving: "
+            + " -> ".join(str(rid) for rid in cycle + [cycle[0]])
+            for cycle in cycles
+        ]
+
+    def _overlap_errors(self) -> list[str]:
+        # Checked records in (triple, pos) order, off the triple index; each
+        # triple's spans are swept in start order as in validate_relationships.
+        rows = self.conn.execute(
+            "SELECT pos, CASE WHEN has_id THEN id END, src, dst, rel, start, \"end\" "
+            "FROM relationships WHERE checked ORDER BY src, dst, rel, pos"
+        ).fetchall()
+        found = []
+        for (src, dst, rel), group in itertools.groupby(rows, key=lambda row: row[2:5]):
+            group = list(group)
+            if len(group) < 2:
+                continue
+            pairs = _overlapping_spans([(row[5], row[6], n) for n, row in enumerate(group)])
+            if not pairs:
+                continue
+            (first,) = self.conn.execute(
+                "SELECT MIN(pos) FROM relationships WHERE src IS ? AND dst IS ? AND rel IS ?",
+                (src, dst, rel),
+            ).fetchone()
+            found.extend(
+                (first, group[i][0], group[j][0], group[i][1], group[j][1], src, dst, rel)
+                for i, j in pairs
+            )
+        found.sort(key=lambda item: item[:3])
+        return [
+            f"Temporal overlap: {a_id} and {b_id} "
+            f"share ({src}, {dst}, {rel}) with overlapping validity"
+            for _, _, _, a_id, b_id, src, dst, rel in found
+        ]
@@ -2,27 +2,74 @@
 """CLI tool for querying and mutating a YAML entity-relationship file.
 
 Supports querying relationships by entity (with alias resolution and temporal
-filtering), adding new relationships with vocabulary validation, full semantic
-validation, and rendering a markdown adjacency matrix.
+filtering), adding new relationships with vocabulary validation (one at a
+time or imported in bulk from JSONL/CSV), full semantic validation, rendering
+a markdown adjacency matrix, and streaming the graph to CSV, JSON, GraphML
+or DOT. ``RelationshipStore`` wraps a loaded file with alias/edge indexes for
+callers that issue many lookups against the same data.
+The CLI keeps a pickled snapshot of the built store in ``.cache/`` next to
+the file, so repeated invocations skip YAML parsing until the file changes
+(``--no-cache`` bypasses it, ``--stats`` prints hit/miss counters). ``serve``
+keeps the store in a long-lived process listening on a Unix socket; while it
+runs, the other commands are answered by it over JSON lines instead of
+loading the file (``--no-server`` opts out). ``--db`` answers queries,
+matrices, diffs and validation from the SQLite index in ``relationship_db``.
+``mentions`` finds entity IDs, labels and aliases in scene or chapter files
+and lists the resolved IDs for a continuity report's ``entities_checked``.
 
 Usage:
     python scripts/relationship_query.py query --entity NAME [--as-of POS] --file PATH
+    python scripts/relationship_query.py query --batch FILE|- [--as-of POS] --file PATH
     python scripts/relationship_query.py add --from FROM --to TO --rel REL \\
         --context CTX --valid-from POS --confidence CONF --source SRC --file PATH
-    python scripts/relationship_query.py render-matrix [--as-of POS] --file PATH
+    python scripts/relationship_query.py import --input PATH|- [--format {jsonl,csv}] --file PATH
+    python scripts/relationship_query.py render-matrix [--as-of POS] [--sparse | --edges] \\
+        [--type TYPE] [--entities IDS] [--page-size N [--page K]] --file PATH
+    python scripts/relationship_query.py diff --from POS --to POS --file PATH
+    python scripts/relationship_query.py neighbors --entity NAME [--hops N] [--as-of POS] \\
+        [--category CAT] [--direction {both,out,in}] --file PATH
+    python scripts/relationship_query.py path --from NAME --to NAME [--as-of POS] \\
+        [--category CAT] [--direction {both,out,in}] --file PATH
+    python scripts/relationship_query.py mentions --input PATH [PATH ...] --file PATH
+    python scripts/relationship_query.py export --format {csv,json,graphml,dot} \\
+        [--as-of POS] [--output PATH] --file PATH
     python scripts/relationship_query.py --validate --file PATH
+    python scripts/relationship_query.py shard --file PATH --output DIR
+    python scripts/relationship_query.py serve --file PATH [--socket PATH]
+
+Every ``--file`` may also name a sharded directory written by ``shard``
+(``header.yaml`` plus one ``act-N.yaml`` per act); ``--validate`` then also
+checks that records sit in the right shard.
 """
 
 from __future__ import annotations
 
 import argparse
+import bisect
+import csv
+import functools
+import hashlib
+import heapq
+import json
+import os
+import pickle
 import re
+import shutil
+import signal
+import socket
+import socketserver
 import sys
-from dataclasses import dataclass, field
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
-from typing import Any
+from typing import IO, Any, Callable, Container, Iterable, Iterator
+from xml.sax.saxutils import escape as xml_escape
+from xml.sax.saxutils import quoteattr
 
-import yaml
+from yaml_io import safe_dump, safe_load
 
 
 # ---------------------------------------------------------------------------
@@ -37,12 +84,52 @@ class VocabularyError(ValueError):
 # Dataclasses
 # ---------------------------------------------------------------------------
 
+@dataclass
+class RelationshipDiff:
+    """Relationship changes between two temporal positions.
+
+    ``superseded`` holds ``{"old": ..., "new": ...}`` pairs; records in a pair
+    are not repeated in ``added`` or ``ended``. All lists are in file order.
+    """
+
+    pos_from: str
+    pos_to: str
+    added: list[dict[str, Any]] = field(default_factory=list)
+    ended: list[dict[str, Any]] = field(default_factory=list)
+    superseded: list[dict[str, dict[str, Any]]] = field(default_factory=list)
+
+
+@dataclass
+class ImportReport:
+    """Outcome of a bulk import: the records added and why rows were not."""
+
+    accepted: list[dict[str, Any]] = field(default_factory=list)
+    rejected: list[tuple[int, str]] = field(default_factory=list)
+
+
+@dataclass
+class Mention:
+    """One entity name found in a text by :class:`MentionMatcher`.
+
+    ``entity_ids`` holds every entity the matched name belongs to (more than
+    one when an alias is shared). ``line`` is 1-based; ``column`` and
+    ``offset`` are 0-based character offsets into the line and the text.
+    """
+
+    entity_ids: list[str]
+    text: str
+    line: int
+    column: int
+    offset: int
+
+
 @dataclass
 class ValidationResult:
     """Outcome of a semantic validation pass."""
 
     ok: bool
     errors: list[str] = field(default_factory=list)
+    state: ValidationState | None = field(default=None, repr=False, compare=False)
 
 
 # ---------------------------------------------------------------------------
@@ -53,6 +140,7 @@ _ACT_CH_RE = re.compile(r"^Act(\d+)/Ch(\d+)$")
 _LWORD_RE = re.compile(r"^L(\d+)/(\w+)$")
 
 
+@functools.lru_cache(maxsize=4096)
 def parse_position(pos: str) -> tuple[int, int]:
     """Parse a temporal position string into a comparable ``(act, chapter)`` tuple.
 
@@ -60,6 +148,10 @@ def parse_position(pos: str) -> tuple[int, int]:
         ``Act{N}/Ch{M}`` -- returns ``(N, M)``
         ``L{N}/{word}``  -- returns ``(0, 0)`` (pre-story backstory positions)
 
+    Results are memoized: a canon uses a few hundred distinct positions, so
+    repeated lookups of the same ``valid_from``/``valid_to``/``as_of`` string
+    return the same interned tuple without re-running the regexes.
+
     Raises:
         ValueError: If *pos* does not match either format.
     """
@@ -77,6 +169,27 @@ def parse_position(pos: str) -> tuple[int, int]:
     )
 
 
+# Chapters occupy the low bits of a packed position.
+_CHAPTER_BITS = 20
+
+
+@functools.lru_cache(maxsize=4096)
+def position_key(pos: str) -> int:
+    """Return *pos* packed into a single comparable integer.
+
+    ``Act{N}/Ch{M}`` packs to ``N << 20 | M``, so integer order is the tuple
+    order of :func:`parse_position`; backstory ``L{N}/{word}`` positions pack
+    to 0. Hot paths compare these ints instead of re-parsing strings.
+
+    Raises:
+        ValueError: If *pos* is malformed or its chapter does not fit.
+    """
+    act, chapter = parse_position(pos)
+    if chapter >> _CHAPTER_BITS:
+        raise ValueError(f"Chapter number out of range in position: {pos!r}")
+    return act << _CHAPTER_BITS | chapter
+
+
 # ---------------------------------------------------------------------------
 # Vocabulary helpers
 # ---------------------------------------------------------------------------
@@ -94,16 +207,125 @@ def _flatten_vocabulary(rel_vocabulary: dict[str, list[str]]) -> set[str]:
 # Core functions
 # ---------------------------------------------------------------------------
 
-def load(file_path: str | Path) -> dict[str, Any]:
-    """Load a relationships YAML file and return its contents as a dict."""
-    with open(file_path, encoding="utf-8") as f:
-        return yaml.safe_load(f)
+def load(file_path: str | Path, as_of: str | None = None) -> dict[str, Any]:
+    """Load a relationships YAML file and return its contents as a dict.
+
+    *file_path* may also be a sharded directory (see :func:`load_shards`);
+    *as_of* then skips shards with no relationship active at that position.
+    """
+    path = Path(file_path)
+    if path.is_dir():
+        return load_shards(path, as_of)
+    with open(path, encoding="utf-8") as f:
+        return safe_load(f)
+
+
+def save(data: dict[str, Any], file_path: str | Path, *, appended: int = 0) -> None:
+    """Write *data* back to a YAML file (or a sharded directory, see :func:`save_shards`).
+
+    The file is rewritten through a temporary file that is fsynced and then
+    renamed over it, so a crash leaves either the old or the new contents.
+
+    *appended* says that the file already holds *data* except for its last
+    *appended* relationships (e.g. after :func:`add`). Those records are then
+    appended to the end of the file as one write instead, which costs
+    O(new records) rather than O(file size). This is only done when
+    ``relationships`` is the last key of *data* and the file tail looks like
+    a block-style list; otherwise the whole file is rewritten.
+    """
+    path = Path(file_path)
+    if path.is_dir():
+        save_shards(data, path, appended=appended)
+        return
+    if appended > 0 and _append_relationships(data, path, appended):
+        return
+    _write_yaml(data, path)
+
+
+def _current_umask() -> int:
+    """The process umask (reading it means setting it, so put it back)."""
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+
+def _write_yaml(doc: dict[str, Any], path: Path) -> None:
+    """Atomically replace *path* with *doc*: temporary file, fsync, rename."""
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            safe_dump(doc, f, default_flow_style=False, sort_keys=False, allow_unicode=True)
+            f.flush()
+            os.fsync(f.fileno())
+        if path.exists():
+            shutil.copymode(path, tmp_name)
+        else:
+            # mkstemp creates 0600; a new file gets the mode open() would give it.
+            os.chmod(tmp_name, 0o666 & ~_current_umask())
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+# Bytes read from the end of the file to find how list items are indented.
+_APPEND_TAIL_BYTES = 64 * 1024
+_LIST_ITEM_RE = re.compile(r"^( *)- \S", re.MULTILINE)
+_TOP_LEVEL_KEY_RE = re.compile(r"^([^\s#-][^:\n]*):", re.MULTILINE)
+
+
+def _append_relationships(data: dict[str, Any], path: Path, count: int) -> bool:
+    """Append the last *count* relationships of *data* to *path*.
+
+    Returns False, without touching the file, when the layout does not allow
+    it. A failed write is truncated back to the original size.
+    """
+    relationships = data.get("relationships")
+    if not isinstance(relationships, list) or not 0 < count <= len(relationships):
+        return False
+    if next(reversed(data)) != "relationships" or count == len(relationships):
+        return False
+    return _append_records(path, relationships[-count:])
 
 
-def save(data: dict[str, Any], file_path: str | Path) -> None:
-    """Write *data* back to a YAML file."""
-    with open(file_path, "w", encoding="utf-8") as f:
-        yaml.dump(data, f, default_flow_style=False, sort_keys=False, allow_unicode=True)
+def _append_records(path: Path, records: list[dict[str, Any]]) -> bool:
+    """Append *records* to the ``relationships`` list that ends *path*.
+
+    Returns False, without touching the file, if the file tail is not a
+    non-empty block-style ``relationships`` list.
+    """
+    try:
+        with open(path, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - _APPEND_TAIL_BYTES))
+            tail = f.read().decode("utf-8", errors="ignore")
+    except OSError:
+        return False
+    if size > _APPEND_TAIL_BYTES:
+        tail = tail[tail.find("\n") + 1:]  # Drop the partial first line.
+    keys = _TOP_LEVEL_KEY_RE.findall(tail)
+    if keys and keys[-1] != "relationships":
+        return False
+    # Existing records are the least indented "- " lines near the end.
+    indents = [len(m.group(1)) for m in _LIST_ITEM_RE.finditer(tail)]
+    if not indents:
+        return False
+    pad = " " * min(indents)
+    block = safe_dump(records, default_flow_style=False, sort_keys=False, allow_unicode=True)
+    lines = block.splitlines(keepends=True)
+    text = "".join(pad + line if line.strip() else line for line in lines)
+    if not tail.endswith("\n"):
+        text = "\n" + text
+
+    with open(path, "ab") as f:
+        try:
+            f.write(text.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.truncate(size)
+            raise
+    return True
 
 
 def _entity_ids_for(data: dict[str, Any], entity: str) -> set[str]:
@@ -148,16 +370,7 @@ def query(
     """
     # Resolve entity to a set of canonical entity IDs.
     match_ids = _entity_ids_for(data, entity)
-
-    # Also allow a direct string match on from/to for convenience (in case
-    # an alias string is used directly in a relationship record).
-    match_strings: set[str] = {entity} | match_ids
-
-    # Collect aliases of every matched entity so we can also match those.
-    entities = data.get("entities", {})
-    for eid in list(match_ids):
-        aliases = entities.get(eid, {}).get("aliases", [])
-        match_strings.update(aliases)
+    match_strings = _match_strings(data.get("entities", {}), entity, match_ids)
 
     as_of_pos: tuple[int, int] | None = None
     if as_of is not None:
@@ -171,20 +384,92 @@ def query(
         if from_e not in match_strings and to_e not in match_strings:
             continue
 
-        # Temporal filtering.
-        if as_of_pos is not None:
-            vf = rel.get("valid_from")
-            vt = rel.get("valid_to")
-            if vf is not None and parse_position(vf) > as_of_pos:
-                continue
-            if vt is not None and parse_position(vt) <= as_of_pos:
-                continue
+        if as_of_pos is not None and not _is_active(rel, as_of_pos):
+            continue
 
         results.append(rel)
 
     return results
 
 
+def query_many(
+    data: dict[str, Any],
+    entities: Iterable[str],
+    as_of: str | None = None,
+) -> dict[str, list[dict[str, Any]]]:
+    """Return :func:`query` results for every entity in *entities* in one pass.
+
+    Aliases are indexed once and the relationship list is traversed once for
+    the whole batch, instead of once per entity. Keys follow the order of
+    *entities* (duplicates collapse); each value is exactly what
+    ``query(data, entity, as_of)`` returns.
+    """
+    entity_table = data.get("entities", {})
+    alias_owners: dict[str, set[str]] = defaultdict(set)
+    for eid, einfo in entity_table.items():
+        for alias in einfo.get("aliases", []):
+            alias_owners[alias].add(eid)
+
+    results: dict[str, list[dict[str, Any]]] = {}
+    requested_by: dict[str, list[str]] = defaultdict(list)
+    for entity in entities:
+        if entity in results:
+            continue
+        results[entity] = []
+        match_ids = set(alias_owners.get(entity, ()))
+        if entity in entity_table:
+            match_ids.add(entity)
+        for s in _match_strings(entity_table, entity, match_ids):
+            requested_by[s].append(entity)
+
+    as_of_pos: tuple[int, int] | None = None
+    if as_of is not None:
+        as_of_pos = parse_position(as_of)
+
+    for rel in data.get("relationships", []):
+        hits = requested_by.get(rel.get("from", ""), []) + requested_by.get(rel.get("to", ""), [])
+        if not hits:
+            continue
+        if as_of_pos is not None and not _is_active(rel, as_of_pos):
+            continue
+        for entity in dict.fromkeys(hits):
+            results[entity].append(rel)
+
+    return results
+
+
+def _match_strings(
+    entities: dict[str, Any],
+    entity: str,
+    match_ids: set[str],
+) -> set[str]:
+    """Return every ``from``/``to`` string that should match *entity*.
+
+    Besides the resolved entity IDs this allows a direct string match (in
+    case an alias string is used directly in a relationship record) and the
+    aliases of every matched entity.
+    """
+    match_strings: set[str] = {entity} | match_ids
+    for eid in match_ids:
+        match_strings.update(entities.get(eid, {}).get("aliases", []))
+    return match_strings
+
+
+def _is_active(rel: dict[str, Any], as_of_pos: tuple[int, int]) -> bool:
+    """Return True if *rel* is valid at the parsed position *as_of_pos*.
+
+    Raises:
+        ValueError: If the record's ``valid_from``/``valid_to`` is malformed.
+    """
+    vf = rel.get("valid_from")
+    vt = rel.get("valid_to")
+    if vf is not None and parse_position(vf) > as_of_pos:
+        return False
+    if vt is not None and parse_position(vt) <= as_of_pos:
+        return False
+    return True
+
+
 def add(
     data: dict[str, Any],
     from_e: str,
@@ -202,23 +487,74 @@ def add(
         VocabularyError: If *rel* is not in the file's ``rel_vocabulary``.
     """
     vocab = _flatten_vocabulary(data.get("rel_vocabulary", {}))
+    relationships = data.setdefault("relationships", [])
+    new_rel = _new_relationship(
+        vocab, _next_rel_number(relationships),
+        from_e, to_e, rel, context, valid_from, confidence, source, valid_to,
+    )
+    relationships.append(new_rel)
+    return new_rel
+
+
+def bulk_add(data: dict[str, Any], records: Iterable[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Add every record in *records* to *data*; return the new records.
+
+    Each record uses the file's field names (``from``, ``to``, ``rel``,
+    ``context``, ``valid_from``, ``confidence``, ``source`` and optionally
+    ``valid_to``). The batch is checked in one pass before anything is
+    added, and IDs continue from the highest existing one, so adding n
+    records costs O(n + existing) rather than n full scans.
+
+    Raises:
+        VocabularyError: If any record's ``rel`` is not in the vocabulary;
+            nothing is added.
+        ValueError: If a record lacks a required field; nothing is added.
+    """
+    vocab = _flatten_vocabulary(data.get("rel_vocabulary", {}))
+    relationships = data.setdefault("relationships", [])
+    new_rels = _new_relationships(vocab, _next_rel_number(relationships), records)
+    relationships.extend(new_rels)
+    return new_rels
+
+
+_REL_ID_RE = re.compile(r"^rel_(\d+)$")
+_RECORD_FIELDS = ("from", "to", "rel", "context", "valid_from", "confidence", "source")
+
+
+def _rel_number(rel_id: Any) -> int:
+    """Return N for a ``rel_N`` ID, or 0 for any other ID."""
+    m = _REL_ID_RE.match(rel_id) if isinstance(rel_id, str) else None
+    return int(m.group(1)) if m else 0
+
+
+def _next_rel_number(relationships: list[dict[str, Any]]) -> int:
+    return max((_rel_number(r.get("id")) for r in relationships), default=0) + 1
+
+
+def _new_relationship(
+    vocab: Iterable[str],
+    number: int,
+    from_e: str,
+    to_e: str,
+    rel: str,
+    context: str,
+    valid_from: str,
+    confidence: str,
+    source: str,
+    valid_to: str | None = None,
+) -> dict[str, Any]:
+    """Build the record :func:`add` appends, with ID ``rel_<number>``.
+
+    Raises:
+        VocabularyError: If *rel* is not in *vocab*.
+    """
     if rel not in vocab:
         raise VocabularyError(
             f"Relationship term {rel!r} is not in the controlled vocabulary. "
             f"Allowed terms: {sorted(vocab)}"
         )
-
-    # Determine next ID.
-    existing_ids: list[int] = []
-    for r in data.get("relationships", []):
-        m = re.match(r"^rel_(\d+)$", r.get("id", ""))
-        if m:
-            existing_ids.append(int(m.group(1)))
-    next_num = max(existing_ids, default=0) + 1
-    new_id = f"rel_{next_num:03d}"
-
     new_rel: dict[str, Any] = {
-        "id": new_id,
+        "id": f"rel_{number:03d}",
         "from": from_e,
         "to": to_e,
         "rel": rel,
@@ -229,353 +565,2995 @@ def add(
     }
     if valid_to is not None:
         new_rel["valid_to"] = valid_to
-
-    data.setdefault("relationships", []).append(new_rel)
     return new_rel
 
 
+def _new_relationships(
+    vocab: Iterable[str],
+    first_number: int,
+    records: Iterable[dict[str, Any]],
+) -> list[dict[str, Any]]:
+    """Build the records :func:`bulk_add` appends, numbering from *first_number*.
+
+    Raises:
+        VocabularyError: Listing every record whose ``rel`` is unknown.
+        ValueError: Listing every record that lacks a required field.
+    """
+    records = list(records)
+    missing = [
+        f"record {n}: missing {', '.join(f for f in _RECORD_FIELDS if f not in record)}"
+        for n, record in enumerate(records, start=1)
+        if not all(f in record for f in _RECORD_FIELDS)
+    ]
+    if missing:
+        raise ValueError("Cannot add relationships:\n  " + "\n  ".join(missing))
+    unknown = [
+        f"record {n}: {record['rel']!r}"
+        for n, record in enumerate(records, start=1)
+        if record["rel"] not in vocab
+    ]
+    if unknown:
+        raise VocabularyError(
+            "Relationship terms not in the controlled vocabulary:\n  "
+            + "\n  ".join(unknown)
+            + f"\nAllowed terms: {sorted(vocab)}"
+        )
+    return [
+        _new_relationship(
+            vocab, first_number + n, record["from"], record["to"], record["rel"],
+            record["context"], record["valid_from"], record["confidence"],
+            record["source"], record.get("valid_to"),
+        )
+        for n, record in enumerate(records)
+    ]
+
+
 # ---------------------------------------------------------------------------
-# Semantic validation
+# Temporal index
 # ---------------------------------------------------------------------------
 
-_VALID_FROM_RE = re.compile(r"^(L\d+/\w+|Act\d+/Ch\d+)$")
-_SOURCE_RE = re.compile(r"^canon/.+\.md(#L\d+)?$")
+# Packed sentinels for a missing ``valid_from`` (active since forever) and a
+# null ``valid_to`` (still active). They sort before / after every position.
+_OPEN_START = -1
+_OPEN_END = sys.maxsize
 
+# Half-open ``[start, end)`` validity as packed positions.
+Span = tuple[int, int]
 
-def validate_relationships(data: dict[str, Any]) -> ValidationResult:
-    """Run full semantic validation on a relationships data structure.
 
-    Checks performed:
-    - No duplicate relationship IDs
-    - No alias collisions across entities
-    - Every ``rel`` matches a term in ``rel_vocabulary``
-    - Supersession bidirectional consistency
-    - Circular supersession detection
-    - Temporal overlap for identical ``(from, to, rel)`` triples
-    - Source citation format
-    - ``valid_from`` / ``valid_to`` format
+def _validity_span(rel: dict[str, Any]) -> Span | None:
+    """Return the packed half-open ``[start, end)`` validity of *rel*.
+
+    Returns None if either endpoint is malformed; such records are reported
+    by :func:`validate_relationships` and skipped by temporal lookups, as in
+    :func:`render_matrix`.
+    """
+    vf = rel.get("valid_from")
+    vt = rel.get("valid_to")
+    try:
+        start = position_key(vf) if vf is not None else _OPEN_START
+        end = position_key(vt) if vt is not None else _OPEN_END
+    except (TypeError, ValueError):
+        return None
+    return start, end
+
+
+class _IntervalNode:
+    """Node of a centered interval tree.
+
+    Holds the intervals containing ``center`` twice: sorted by start
+    (ascending) and by end (descending). ``left`` holds intervals that end at
+    or before ``center``; ``right`` those that start after it.
     """
-    errors: list[str] = []
-    vocab = _flatten_vocabulary(data.get("rel_vocabulary", {}))
-    relationships: list[dict[str, Any]] = data.get("relationships", [])
-    entities: dict[str, Any] = data.get("entities", {})
-
-    # -- Duplicate relationship IDs ----------------------------------------
-    seen_ids: dict[str, int] = {}
-    for idx, r in enumerate(relationships):
-        rid = r.get("id", f"<missing@{idx}>")
-        if rid in seen_ids:
-            errors.append(f"Duplicate relationship ID: {rid}")
-        else:
-            seen_ids[rid] = idx
 
-    # -- Alias collisions across entities ----------------------------------
-    alias_owner: dict[str, str] = {}
-    for eid, einfo in entities.items():
-        for alias in einfo.get("aliases", []):
-            if alias in alias_owner:
-                errors.append(
-                    f"Alias collision: '{alias}' is claimed by both "
-                    f"'{alias_owner[alias]}' and '{eid}'"
-                )
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, spans: list[tuple[int, int, int]]) -> None:
+        starts = sorted(span[0] for span in spans)
+        center = starts[len(starts) // 2]
+        here: list[tuple[int, int, int]] = []
+        left: list[tuple[int, int, int]] = []
+        right: list[tuple[int, int, int]] = []
+        for span in spans:
+            if span[1] <= center:
+                left.append(span)
+            elif span[0] > center:
+                right.append(span)
             else:
-                alias_owner[alias] = eid
+                here.append(span)
 
-    # -- Per-relationship checks -------------------------------------------
-    rel_by_id: dict[str, dict[str, Any]] = {r["id"]: r for r in relationships if "id" in r}
+        self.center = center
+        self.by_start = sorted(here, key=lambda span: span[0])
+        self.by_end = sorted(here, key=lambda span: span[1], reverse=True)
+        self.left = _IntervalNode(left) if left else None
+        self.right = _IntervalNode(right) if right else None
 
-    for r in relationships:
-        rid = r.get("id", "<unknown>")
 
-        # rel in vocabulary
-        if r.get("rel") not in vocab:
-            errors.append(f"{rid}: rel '{r.get('rel')}' not in rel_vocabulary")
+class TemporalIndex:
+    """Index of relationship validity ranges keyed on packed positions.
 
-        # valid_from format
-        vf = r.get("valid_from", "")
-        if not _VALID_FROM_RE.match(str(vf)):
-            errors.append(f"{rid}: invalid valid_from format: {vf!r}")
+    Answers "which relationships are active at P" with a centered interval
+    tree and "which relationships start or end between P1 and P2" with
+    sorted endpoint lists, both in O(log n + k). Positions are
+    :func:`position_key` ints and results are indices into the span list, in
+    ascending order. Activity matches :func:`query`: a record is active at P
+    when ``valid_from <= P < valid_to``.
 
-        # valid_to format (if present and not null)
-        vt = r.get("valid_to")
-        if vt is not None and not _VALID_FROM_RE.match(str(vt)):
-            errors.append(f"{rid}: invalid valid_to format: {vt!r}")
+    *spans* is read, not copied: spans appended after construction go to a
+    pending list that is scanned linearly and folded into the tree on the
+    next lookup once it grows past ``rebuild_threshold``.
+    """
 
-        # source format
-        src = r.get("source", "")
-        if not _SOURCE_RE.match(str(src)):
-            errors.append(f"{rid}: invalid source format: {src!r}")
+    rebuild_threshold = 64
+
+    def __init__(self, spans: list[Span | None]) -> None:
+        self._spans = spans
+        self._build()
+
+    @classmethod
+    def from_relationships(cls, relationships: list[dict[str, Any]]) -> TemporalIndex:
+        """Build an index over the validity of *relationships*."""
+        return cls([_validity_span(rel) for rel in relationships])
+
+    def _build(self) -> None:
+        spans = [
+            (span[0], span[1], idx)
+            for idx, span in enumerate(self._spans)
+            if span is not None
+        ]
+
+        # Empty or inverted ranges are never active; keep them out of the tree.
+        proper = [span for span in spans if span[0] < span[1]]
+        self._root = _IntervalNode(proper) if proper else None
+
+        starts = sorted((span[0], span[2]) for span in spans if span[0] != _OPEN_START)
+        ends = sorted((span[1], span[2]) for span in spans if span[1] != _OPEN_END)
+        self._start_keys = [pos for pos, _ in starts]
+        self._start_idx = [idx for _, idx in starts]
+        self._end_keys = [pos for pos, _ in ends]
+        self._end_idx = [idx for _, idx in ends]
+
+        self._indexed = len(self._spans)
+
+    def _refresh(self) -> list[tuple[int, int, int]]:
+        """Fold appended spans into the index; return the still-pending ones."""
+        if len(self._spans) - self._indexed > self.rebuild_threshold:
+            self._build()
+            return []
+        return [
+            (span[0], span[1], idx)
+            for idx in range(self._indexed, len(self._spans))
+            if (span := self._spans[idx]) is not None
+        ]
+
+    def active_at(self, pos: int) -> list[int]:
+        """Return indices of relationships active at the packed position *pos*."""
+        pending = self._refresh()
+        found: list[int] = []
+        node = self._root
+        while node is not None:
+            if pos < node.center:
+                for start, _, idx in node.by_start:
+                    if start > pos:
+                        break
+                    found.append(idx)
+                node = node.left
+            else:
+                for _, end, idx in node.by_end:
+                    if end <= pos:
+                        break
+                    found.append(idx)
+                node = node.right
+        found.extend(idx for start, end, idx in pending if start <= pos < end)
+        found.sort()
+        return found
+
+    def changed_between(self, pos_from: int, pos_to: int) -> tuple[list[int], list[int]]:
+        """Return ``(started, ended)`` indices for changes in ``(pos_from, pos_to]``.
+
+        *started* holds records whose ``valid_from`` falls in the range,
+        *ended* records whose ``valid_to`` does (they stop being active there).
+        """
+        pending = self._refresh()
+        lo = bisect.bisect_right(self._start_keys, pos_from)
+        hi = bisect.bisect_right(self._start_keys, pos_to)
+        started = self._start_idx[lo:hi]
+        lo = bisect.bisect_right(self._end_keys, pos_from)
+        hi = bisect.bisect_right(self._end_keys, pos_to)
+        ended = self._end_idx[lo:hi]
+
+        started.extend(idx for start, _, idx in pending if pos_from < start <= pos_to)
+        ended.extend(idx for _, end, idx in pending if pos_from < end <= pos_to)
+        started.sort()
+        ended.sort()
+        return started, ended
 
-        # Supersession bidirectional consistency
-        supersedes = r.get("supersedes")
-        if supersedes is not None:
-            target = rel_by_id.get(supersedes)
-            if target is None:
-                errors.append(
-                    f"{rid}: supersedes '{supersedes}' which does not exist"
-                )
-            elif target.get("superseded_by") != rid:
-                errors.append(
-                    f"{rid}: supersedes '{supersedes}', but "
-                    f"'{supersedes}'.superseded_by = {target.get('superseded_by')!r} "
-                    f"(expected '{rid}')"
-                )
 
-        superseded_by = r.get("superseded_by")
-        if superseded_by is not None:
-            target = rel_by_id.get(superseded_by)
-            if target is None:
-                errors.append(
-                    f"{rid}: superseded_by '{superseded_by}' which does not exist"
-                )
-            elif target.get("supersedes") != rid:
-                errors.append(
-                    f"{rid}: superseded_by '{superseded_by}', but "
-                    f"'{superseded_by}'.supersedes = {target.get('supersedes')!r} "
-                    f"(expected '{rid}')"
-                )
+# ---------------------------------------------------------------------------
+# Sharded storage
+# ---------------------------------------------------------------------------
 
-    # -- Circular supersession detection -----------------------------------
-    for r in relationships:
-        rid = r.get("id")
-        if rid is None:
-            continue
-        visited: set[str] = set()
-        current: str | None = rid
-        while current is not None:
-            if current in visited:
-                errors.append(f"Circular supersession chain detected involving: {rid}")
-                break
-            visited.add(current)
-            next_rel = rel_by_id.get(current)
-            current = next_rel.get("supersedes") if next_rel else None
+# A sharded canon is a directory holding ``header.yaml`` (every top-level key
+# except ``relationships``, plus the ``shards`` index) and one
+# ``act-N.yaml`` file per act with the relationships whose ``valid_from``
+# falls in that act. Backstory and malformed positions go to ``act-0.yaml``.
+SHARD_HEADER = "header.yaml"
+_SHARD_RE = re.compile(r"^act-(\d+)\.yaml$")
 
-    # -- Temporal overlap for identical (from, to, rel) triples ------------
-    from collections import defaultdict
 
-    triple_groups: dict[tuple[str, str, str], list[dict[str, Any]]] = defaultdict(list)
-    for r in relationships:
-        key = (r.get("from", ""), r.get("to", ""), r.get("rel", ""))
-        triple_groups[key].append(r)
+def shard_name(rel: dict[str, Any]) -> str:
+    """Return the shard file that holds *rel*."""
+    try:
+        act = parse_position(rel.get("valid_from"))[0]
+    except (TypeError, ValueError):
+        act = 0
+    return f"act-{act}.yaml"
 
-    for triple_key, group in triple_groups.items():
-        if len(group) < 2:
-            continue
-        # Compare every pair.
-        for i in range(len(group)):
-            for j in range(i + 1, len(group)):
-                a = group[i]
-                b = group[j]
-                try:
-                    a_start = parse_position(str(a.get("valid_from", "")))
-                    b_start = parse_position(str(b.get("valid_from", "")))
-                except ValueError:
-                    continue  # Format errors already reported.
-
-                a_end_raw = a.get("valid_to")
-                b_end_raw = b.get("valid_to")
-
-                # None means "still active" -- treat as infinity.
-                a_end: tuple[int, int] | None = None
-                b_end: tuple[int, int] | None = None
-                try:
-                    if a_end_raw is not None:
-                        a_end = parse_position(str(a_end_raw))
-                    if b_end_raw is not None:
-                        b_end = parse_position(str(b_end_raw))
-                except ValueError:
-                    continue
 
-                # Overlap: a_start < b_end AND b_start < a_end
-                a_before_b_end = (b_end is None) or (a_start < b_end)
-                b_before_a_end = (a_end is None) or (b_start < a_end)
+def _shard_files(directory: Path) -> list[Path]:
+    """Return the ``act-N.yaml`` files in *directory*, in act order."""
+    shards = [
+        (int(m.group(1)), path)
+        for path in directory.iterdir()
+        if (m := _SHARD_RE.match(path.name))
+    ]
+    return [path for _, path in sorted(shards)]
 
-                if a_before_b_end and b_before_a_end:
-                    errors.append(
-                        f"Temporal overlap: {a.get('id')} and {b.get('id')} "
-                        f"share ({triple_key[0]}, {triple_key[1]}, {triple_key[2]}) "
-                        f"with overlapping validity"
-                    )
 
-    return ValidationResult(ok=len(errors) == 0, errors=errors)
+def _shard_summary(
+    records: list[dict[str, Any]],
+    previous: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    """Return the ``shards`` index entry for *records* (added to *previous*).
 
+    ``start`` is the earliest ``valid_from`` and ``end`` the latest
+    ``valid_to``; either is None when a record is open-ended on that side.
+    """
+    count = len(records)
+    start_key, end_key = _OPEN_END, _OPEN_START
+    start = end = None
+    if previous is not None:
+        count += previous.get("count", 0)
+        start, end = previous.get("start"), previous.get("end")
+        try:
+            start_key = _OPEN_START if start is None else position_key(start)
+            end_key = _OPEN_END if end is None else position_key(end)
+        except ValueError:
+            start_key, end_key = _OPEN_START, _OPEN_END
+    for rel in records:
+        span = _validity_span(rel)
+        if span is None:
+            start_key, end_key = _OPEN_START, _OPEN_END
+            break
+        if span[0] < start_key:
+            start_key, start = span[0], rel.get("valid_from")
+        if span[1] > end_key:
+            end_key, end = span[1], rel.get("valid_to")
+    return {
+        "count": count,
+        "start": None if start_key == _OPEN_START else start,
+        "end": None if end_key == _OPEN_END else end,
+    }
 
-# ---------------------------------------------------------------------------
-# Matrix rendering
-# ---------------------------------------------------------------------------
 
-def render_matrix(data: dict[str, Any], as_of: str | None = None) -> str:
-    """Render a markdown adjacency matrix of entity relationships.
+def _shard_active_at(summary: dict[str, Any], key: int) -> bool:
+    """Whether a shard with index entry *summary* may hold a record active at *key*."""
+    try:
+        start = summary.get("start")
+        end = summary.get("end")
+        return (start is None or position_key(start) <= key) and (
+            end is None or key < position_key(end)
+        )
+    except (AttributeError, ValueError):
+        return True
 
-    Rows and columns are entity IDs. Cells contain the ``rel`` value(s)
-    connecting the row entity (``from``) to the column entity (``to``).
+
+def _shard_key(name: str) -> int:
+    m = _SHARD_RE.match(name)
+    return int(m.group(1)) if m else -1
+
+
+def _group_by_shard(records: Iterable[dict[str, Any]]) -> dict[str, list[dict[str, Any]]]:
+    groups: dict[str, list[dict[str, Any]]] = {}
+    for rel in records:
+        groups.setdefault(shard_name(rel), []).append(rel)
+    return groups
+
+
+def load_shards(directory: str | Path, as_of: str | None = None) -> dict[str, Any]:
+    """Load a sharded canon into the same dict shape :func:`load` returns.
+
+    With *as_of*, shards whose ``shards`` index range cannot contain a
+    relationship active at that position are not read at all; the result
+    then holds a subset of the relationships and must not be saved back.
+    Relationships are returned in act order, then in file order.
     """
-    entities = data.get("entities", {})
-    entity_ids = list(entities.keys())
+    directory = Path(directory)
+    with open(directory / SHARD_HEADER, encoding="utf-8") as f:
+        data = safe_load(f) or {}
+    index = data.pop("shards", None) or {}
+    key = position_key(as_of) if as_of is not None else None
+
+    relationships: list[dict[str, Any]] = []
+    for path in _shard_files(directory):
+        summary = index.get(path.name)
+        if key is not None and summary is not None and not _shard_active_at(summary, key):
+            continue
+        with open(path, encoding="utf-8") as f:
+            shard = safe_load(f) or {}
+        relationships.extend(shard.get("relationships") or [])
+    data["relationships"] = relationships
+    return data
+
+
+def save_shards(data: dict[str, Any], directory: str | Path, *, appended: int = 0) -> None:
+    """Write *data* as a sharded canon in *directory* (created if needed).
+
+    Every shard with records in *data* is rewritten atomically; shard files
+    with none are left alone. With *appended* (see :func:`save`), only the
+    shards receiving the new records are touched, each by an append. The
+    header is written first with index ranges covering both the old and the
+    new shard contents, so a crash part-way never hides a record from an
+    ``as_of`` load.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    header_path = directory / SHARD_HEADER
+    relationships = data.get("relationships") or []
+    header = {k: v for k, v in data.items() if k != "relationships"}
+
+    index: dict[str, Any] = {}
+    if header_path.exists():
+        with open(header_path, encoding="utf-8") as f:
+            index = dict((safe_load(f) or {}).get("shards") or {})
+    existing = {path.name for path in _shard_files(directory)}
+    index = {name: summary for name, summary in index.items() if name in existing}
+
+    def write_header(shards: dict[str, Any]) -> None:
+        header["shards"] = {name: shards[name] for name in sorted(shards, key=_shard_key)}
+        _write_yaml(header, header_path)
+
+    if appended > 0 and header_path.exists():
+        groups = _group_by_shard(relationships[-appended:])
+        for name, records in groups.items():
+            index[name] = _shard_summary(records, index.get(name))
+        write_header(index)
+        for name, records in groups.items():
+            path = directory / name
+            if not (name in existing and _append_records(path, records)):
+                shard = [r for r in relationships if shard_name(r) == name]
+                _write_yaml({"relationships": shard}, path)
+        return
+
+    groups = _group_by_shard(relationships)
+    summaries = {name: _shard_summary(records) for name, records in groups.items()}
+    covering = {
+        **index,
+        **{
+            name: _widen(index[name], summary) if name in index else summary
+            for name, summary in summaries.items()
+        },
+    }
+    write_header(covering)
+    for name, records in groups.items():
+        _write_yaml({"relationships": records}, directory / name)
+    write_header({**index, **summaries})
 
-    if not entity_ids:
-        return "(no entities defined)"
 
-    # Gather active relationships.
-    as_of_pos: tuple[int, int] | None = None
-    if as_of is not None:
-        as_of_pos = parse_position(as_of)
+def _widen(old: dict[str, Any], new: dict[str, Any]) -> dict[str, Any]:
+    """Return *new* with its range widened to cover *old*'s."""
+    def key(pos: str | None, default: int) -> int:
+        try:
+            return default if pos is None else position_key(pos)
+        except (TypeError, ValueError):
+            return default
 
-    # Build cell contents: (from_id, to_id) -> list of rel strings.
-    from collections import defaultdict
+    widened = dict(new)
+    if key(old.get("start"), _OPEN_START) < key(new.get("start"), _OPEN_START):
+        widened["start"] = old.get("start")
+    if key(old.get("end"), _OPEN_END) > key(new.get("end"), _OPEN_END):
+        widened["end"] = old.get("end")
+    return widened
 
-    cells: dict[tuple[str, str], list[str]] = defaultdict(list)
 
-    for r in data.get("relationships", []):
-        if as_of_pos is not None:
-            vf = r.get("valid_from")
-            vt = r.get("valid_to")
-            try:
-                if vf is not None and parse_position(vf) > as_of_pos:
-                    continue
-                if vt is not None and parse_position(vt) <= as_of_pos:
-                    continue
-            except ValueError:
-                continue
+def shard_errors(directory: str | Path) -> list[str]:
+    """Return layout errors of a sharded canon.
 
-        from_e = r.get("from", "")
-        to_e = r.get("to", "")
-        rel_term = r.get("rel", "")
-        cells[(from_e, to_e)].append(rel_term)
+    Reports records stored in the wrong act file and ``shards`` index
+    entries that are missing or do not match their file. Constraints that
+    span shards (duplicate IDs, supersession links, overlaps) are checked by
+    :func:`validate_relationships` on the full :func:`load_shards` result.
+    """
+    directory = Path(directory)
+    errors: list[str] = []
+    with open(directory / SHARD_HEADER, encoding="utf-8") as f:
+        index = (safe_load(f) or {}).get("shards") or {}
+    files = _shard_files(directory)
+    for name in sorted(set(index) - {path.name for path in files}, key=_shard_key):
+        errors.append(f"{SHARD_HEADER}: shards lists {name}, which does not exist")
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            records = (safe_load(f) or {}).get("relationships") or []
+        for rel in records:
+            expected = shard_name(rel)
+            if expected != path.name:
+                errors.append(
+                    f"{rel.get('id', '<unknown>')}: stored in {path.name} but "
+                    f"valid_from {rel.get('valid_from')!r} belongs in {expected}"
+                )
+        if index.get(path.name) != _shard_summary(records):
+            errors.append(f"{SHARD_HEADER}: shards entry for {path.name} is missing or stale")
+    return errors
 
-    # Build markdown table.
-    header = "| From / To |"
-    separator = "| --- |"
-    for eid in entity_ids:
-        header += f" {eid} |"
-        separator += " --- |"
 
-    lines: list[str] = [header, separator]
-    for row_id in entity_ids:
-        row = f"| **{row_id}** |"
-        for col_id in entity_ids:
-            if row_id == col_id:
-                row += " --- |"
-            else:
-                terms = cells.get((row_id, col_id), [])
-                cell_text = ", ".join(terms) if terms else ""
-                row += f" {cell_text} |"
-        lines.append(row)
+# ---------------------------------------------------------------------------
+# Indexed store
+# ---------------------------------------------------------------------------
 
-    return "\n".join(lines)
+DIRECTIONS = ("both", "out", "in")
+"""Edge directions accepted by the store's graph traversals."""
+
+
+class RelationshipStore:
+    """Indexed view over a loaded relationships dict.
+
+    Built once per load, the store keeps alias -> entity, entity -> outgoing
+    and incoming edge, and rel-term -> edge indexes so that lookups cost
+    O(matching edges) instead of a scan over every entity and relationship.
+    Adjacency lists for neighbourhood and path queries, and the matcher for
+    entity mentions, are built on first use.
+    Edges are stored as positions in ``data["relationships"]``, so results
+    keep file order. Validity ranges are normalized once, at build time, to
+    packed :func:`position_key` spans, so temporal filters compare ints
+    instead of parsing strings.
+
+    The wrapped dict is shared, not copied: ``store.data`` can be passed to
+    :func:`save`, :func:`render_matrix` or :func:`validate_relationships`.
+    Mutate relationships through :meth:`add` or :meth:`bulk_add`; records
+    appended to the list directly are indexed on the next add, records
+    edited in place, and any change to ``rel_vocabulary``, must be reported
+    with :meth:`reindex`.
+    """
+
+    def __init__(self, data: dict[str, Any]) -> None:
+        self.data = data
+        self._aliases: dict[str, set[str]] = {}
+        self._outgoing: dict[str, list[int]] = {}
+        self._incoming: dict[str, list[int]] = {}
+        self._by_rel: dict[str, list[int]] = {}
+        self._by_id: dict[Any, int] = {}
+        self._spans: list[Span | None] = []
+        self._temporal: TemporalIndex | None = None
+        self._validation: ValidationState | None = None
+        self._graph: dict[str, list[tuple[str, int, bool]]] | None = None
+        self._mentions: MentionMatcher | None = None
+        self._id_high_water = 0
+        self._vocab = frozenset(_flatten_vocabulary(data.get("rel_vocabulary", {})))
+        # (from, to, rel, id) each record was indexed under, for reindex().
+        self._keys: list[tuple[Any, Any, Any, Any]] = []
+        self._changed: set[int] = set()
+
+        for eid, einfo in data.get("entities", {}).items():
+            for alias in einfo.get("aliases", []):
+                self._aliases.setdefault(alias, set()).add(eid)
+
+        self._records = self.relationships
+        for idx, rel in enumerate(self._records):
+            self._index_relationship(idx, rel)
+
+    @classmethod
+    def from_file(cls, file_path: str | Path) -> RelationshipStore:
+        """Load *file_path* and build a store over its contents."""
+        return cls(load(file_path))
+
+    @property
+    def relationships(self) -> list[dict[str, Any]]:
+        """The underlying relationship records, in file order."""
+        return self.data.setdefault("relationships", [])
+
+    def _index_relationship(self, idx: int, rel: dict[str, Any]) -> None:
+        key = (rel.get("from", ""), rel.get("to", ""), rel.get("rel", ""), rel.get("id"))
+        self._outgoing.setdefault(key[0], []).append(idx)
+        self._incoming.setdefault(key[1], []).append(idx)
+        self._by_rel.setdefault(key[2], []).append(idx)
+        if "id" in rel:
+            self._by_id[rel["id"]] = idx
+            self._id_high_water = max(self._id_high_water, _rel_number(rel["id"]))
+        self._keys.append(key)
+        self._spans.append(_validity_span(rel))
+        if self._graph is not None:
+            self._link(idx, rel)
+
+    def entity_ids_for(self, entity: str) -> set[str]:
+        """Return the entity IDs *entity* could refer to (see :func:`query`)."""
+        ids = set(self._aliases.get(entity, ()))
+        if entity in self.data.get("entities", {}):
+            ids.add(entity)
+        return ids
+
+    def query(self, entity: str, as_of: str | None = None) -> list[dict[str, Any]]:
+        """Indexed equivalent of :func:`query`; same matching and ordering."""
+        match_strings = _match_strings(
+            self.data.get("entities", {}), entity, self.entity_ids_for(entity)
+        )
+
+        as_of_key: int | None = None
+        if as_of is not None:
+            as_of_key = position_key(as_of)
+
+        indices: set[int] = set()
+        for s in match_strings:
+            indices.update(self._outgoing.get(s, ()))
+            indices.update(self._incoming.get(s, ()))
+
+        relationships = self.relationships
+        spans = self._spans
+        results: list[dict[str, Any]] = []
+        for idx in sorted(indices):
+            rel = relationships[idx]
+            if as_of_key is not None:
+                span = spans[idx]
+                if span is None:
+                    # Malformed position: defer to query()'s check so the
+                    # same records are skipped or raise the same error.
+                    if not _is_active(rel, parse_position(as_of)):
+                        continue
+                elif not span[0] <= as_of_key < span[1]:
+                    continue
+            results.append(rel)
+        return results
+
+    def query_many(
+        self,
+        entities: Iterable[str],
+        as_of: str | None = None,
+    ) -> dict[str, list[dict[str, Any]]]:
+        """Indexed equivalent of :func:`query_many`."""
+        return {entity: self.query(entity, as_of=as_of) for entity in dict.fromkeys(entities)}
+
+    @property
+    def temporal(self) -> TemporalIndex:
+        """Validity-range index over the relationships, built on first use."""
+        if self._temporal is None:
+            self._temporal = TemporalIndex(self._spans)
+        return self._temporal
+
+    def active_at(self, as_of: str) -> list[dict[str, Any]]:
+        """Return every relationship active at *as_of*, in file order."""
+        relationships = self.relationships
+        return [relationships[idx] for idx in self.temporal.active_at(position_key(as_of))]
+
+    def changed_between(
+        self,
+        pos_from: str,
+        pos_to: str,
+    ) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        """Return ``(started, ended)`` relationships changing in ``(pos_from, pos_to]``."""
+        started, ended = self.temporal.changed_between(
+            position_key(pos_from), position_key(pos_to)
+        )
+        relationships = self.relationships
+        return [relationships[i] for i in started], [relationships[i] for i in ended]
+
+    def diff(self, pos_from: str, pos_to: str) -> RelationshipDiff:
+        """Indexed equivalent of :func:`diff`.
+
+        Only records with an endpoint in ``(pos_from, pos_to]`` can change
+        state, so the sorted endpoint lists of the temporal index supply the
+        candidates in one bisect each.
+        """
+        start, end = position_key(pos_from), position_key(pos_to)
+        if start > end:
+            raise ValueError(f"diff --from {pos_from} is after --to {pos_to}")
+
+        started, stopped = self.temporal.changed_between(start, end)
+        relationships = self.relationships
+        spans = self._spans
+        # Started after *start*: added if still open at *end*. Stopped in
+        # range: ended if already open at *start*.
+        added = [relationships[i] for i in started if spans[i][1] > end]
+        ended = [relationships[i] for i in stopped if spans[i][0] <= start]
+
+        def active_at_start(rel: dict[str, Any]) -> bool:
+            span = spans[self._by_id[rel["id"]]]
+            return span is not None and span[0] <= start < span[1]
+
+        def find(rid: Any) -> dict[str, Any] | None:
+            idx = self._by_id.get(rid)
+            return relationships[idx] if idx is not None else None
+
+        return _pair_supersessions(pos_from, pos_to, added, ended, find, active_at_start)
+
+    def render_matrix(self, as_of: str | None = None, **options: Any) -> str:
+        """Indexed equivalent of :func:`render_matrix`; takes the same options."""
+        active = self.active_at(as_of) if as_of is not None else self.relationships
+        return _render_matrix(self.data.get("entities", {}), active, **options)
+
+    def export(self, out: IO[str], fmt: str, as_of: str | None = None) -> int:
+        """Indexed equivalent of :func:`export_graph`."""
+        active = self.active_at(as_of) if as_of is not None else self.relationships
+        return _export_graph(self.data.get("entities", {}), active, out, fmt, as_of)
+
+    @property
+    def mentions(self) -> MentionMatcher:
+        """A :class:`MentionMatcher` over the entity names, built on first use."""
+        if self._mentions is None:
+            self._mentions = MentionMatcher.from_entities(self.data.get("entities", {}))
+        return self._mentions
+
+    def find_mentions(self, text: str) -> list[Mention]:
+        """Indexed equivalent of :func:`find_mentions`."""
+        return self.mentions.scan(text)
+
+    def with_rel(self, rel: str) -> list[dict[str, Any]]:
+        """Return every relationship whose ``rel`` term is *rel*."""
+        relationships = self.relationships
+        return [relationships[idx] for idx in self._by_rel.get(rel, ())]
+
+    # -- Graph traversal ----------------------------------------------------
+
+    def _node_ids(self, endpoint: str) -> set[str]:
+        """Graph nodes for a ``from``/``to`` string: entity ID, alias owners, or itself."""
+        if endpoint in self.data.get("entities", {}):
+            return {endpoint}
+        return self._aliases.get(endpoint) or {endpoint}
+
+    def _link(self, idx: int, rel: dict[str, Any]) -> None:
+        assert self._graph is not None
+        for src in self._node_ids(rel.get("from", "")):
+            for dst in self._node_ids(rel.get("to", "")):
+                if src != dst:
+                    self._graph.setdefault(src, []).append((dst, idx, True))
+                    self._graph.setdefault(dst, []).append((src, idx, False))
+
+    @property
+    def graph(self) -> dict[str, list[tuple[str, int, bool]]]:
+        """Adjacency lists over entity IDs, built on first use.
+
+        Each node maps to ``(neighbour, edge index, outgoing)`` entries, one
+        per relationship touching it; alias endpoints resolve to their
+        entity. Self-relationships are left out.
+        """
+        if self._graph is None:
+            self._graph = {}
+            for idx, rel in enumerate(self.relationships):
+                self._link(idx, rel)
+        return self._graph
+
+    def _edge_filter(
+        self,
+        as_of: str | None,
+        categories: Iterable[str] | None,
+        direction: str,
+    ) -> set[int] | None:
+        """Indices of edges usable at *as_of* within *categories*; None for all.
+
+        Raises:
+            ValueError: If a category is not a ``rel_vocabulary`` key, or
+                *direction* is not one of :data:`DIRECTIONS`.
+        """
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Unknown direction {direction!r}. Expected one of {DIRECTIONS}")
+        allowed: set[int] | None = None
+        if categories is not None:
+            vocabulary = self.data.get("rel_vocabulary", {})
+            allowed = set()
+            for category in categories:
+                if category not in vocabulary:
+                    raise ValueError(
+                        f"Unknown rel category {category!r}. "
+                        f"Known categories: {sorted(vocabulary)}"
+                    )
+                for term in vocabulary[category] or ():
+                    allowed.update(self._by_rel.get(term, ()))
+        if as_of is not None:
+            active = self.temporal.active_at(position_key(as_of))
+            allowed = set(active) if allowed is None else allowed.intersection(active)
+        return allowed
+
+    def _steps(
+        self,
+        node: str,
+        allowed: set[int] | None,
+        direction: str,
+    ) -> Iterator[tuple[str, int]]:
+        """Yield ``(neighbour, edge index)`` for the usable edges at *node*."""
+        for neighbour, idx, outgoing in self.graph.get(node, ()):
+            if direction == "out" and not outgoing or direction == "in" and outgoing:
+                continue
+            if allowed is None or idx in allowed:
+                yield neighbour, idx
+
+    def neighborhood(
+        self,
+        entity: str,
+        hops: int = 1,
+        *,
+        as_of: str | None = None,
+        categories: Iterable[str] | None = None,
+        direction: str = "both",
+    ) -> dict[str, int]:
+        """Return every entity within *hops* edges of *entity*, with its distance.
+
+        A breadth-first search over :attr:`graph`, so it costs O(V + E) at
+        most. *entity* may be an ID or alias (distance 0). Only relationships
+        active at *as_of* and whose ``rel`` belongs to one of the
+        ``rel_vocabulary`` *categories* are followed. *direction* is ``"out"``
+        (follow ``from`` -> ``to``), ``"in"`` or ``"both"``. Entities are
+        listed in BFS order.
+        """
+        allowed = self._edge_filter(as_of, categories, direction)
+        distance = {node: 0 for node in self.entity_ids_for(entity) or {entity}}
+        frontier = list(distance)
+        for hop in range(1, hops + 1):
+            next_frontier: list[str] = []
+            for node in frontier:
+                for neighbour, _ in self._steps(node, allowed, direction):
+                    if neighbour not in distance:
+                        distance[neighbour] = hop
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        return distance
+
+    def shortest_path(
+        self,
+        source: str,
+        target: str,
+        *,
+        as_of: str | None = None,
+        categories: Iterable[str] | None = None,
+        direction: str = "both",
+    ) -> list[dict[str, Any]] | None:
+        """Return the relationships on a shortest chain from *source* to *target*.
+
+        Breadth-first over :attr:`graph` with the same filters as
+        :meth:`neighborhood`. Returns the records in path order, ``[]`` if
+        *source* and *target* resolve to the same entity, or None if they are
+        not connected.
+        """
+        allowed = self._edge_filter(as_of, categories, direction)
+        starts = self.entity_ids_for(source) or {source}
+        goals = self.entity_ids_for(target) or {target}
+        parent: dict[str, tuple[str, int] | None] = {node: None for node in starts}
+        frontier = list(starts)
+        reached = next((node for node in frontier if node in goals), None)
+        while frontier and reached is None:
+            next_frontier: list[str] = []
+            for node in frontier:
+                for neighbour, idx in self._steps(node, allowed, direction):
+                    if neighbour in parent:
+                        continue
+                    parent[neighbour] = (node, idx)
+                    if neighbour in goals:
+                        reached = neighbour
+                        break
+                    next_frontier.append(neighbour)
+                if reached is not None:
+                    break
+            frontier = next_frontier
+        if reached is None:
+            return None
+
+        path: list[dict[str, Any]] = []
+        step = parent[reached]
+        while step is not None:
+            node, idx = step
+            path.append(self.relationships[idx])
+            step = parent[node]
+        path.reverse()
+        return path
+
+    # -- Mutation -----------------------------------------------------------
+
+    @property
+    def vocabulary(self) -> frozenset[str]:
+        """The flattened ``rel_vocabulary`` as of construction or the last :meth:`reindex`."""
+        return self._vocab
+
+    @property
+    def stale(self) -> bool:
+        """Whether ``data["relationships"]`` was replaced or shrunk outside the store."""
+        relationships = self.data.get("relationships")
+        return relationships is not self._records or len(relationships) < len(self._spans)
+
+    def _sync(self) -> None:
+        """Index records appended to ``data["relationships"]`` outside the store.
+
+        Raises:
+            ValueError: If records were removed or the list replaced; the
+                store must be rebuilt.
+        """
+        if self.stale:
+            raise ValueError("Relationships were removed outside the store; rebuild it.")
+        for idx in range(len(self._spans), len(self._records)):
+            self._index_relationship(idx, self._records[idx])
+
+    def reindex(self, changed: Iterable[int] = ()) -> None:
+        """Re-index the relationships at indices *changed*, edited in place.
+
+        The store cannot see in-place edits by itself: finding them would
+        mean the scan over every record that the indexes exist to avoid.
+        Reported records move to their new ``from``/``to``/``rel``/``id``
+        entries, the high-water mark takes in any new ID, and the next
+        :meth:`validate` re-checks them. :attr:`vocabulary` is rebuilt from
+        ``rel_vocabulary`` too, so call this with no indices after editing it.
+
+        Raises:
+            ValueError: As :meth:`add`, if the store must be rebuilt instead.
+        """
+        self._sync()
+        self._vocab = frozenset(_flatten_vocabulary(self.data.get("rel_vocabulary", {})))
+        changed = sorted(set(changed))
+        for idx in changed:
+            rel = self._records[idx]
+            old_from, old_to, old_rel, old_id = self._keys[idx]
+            for index, old, new in (
+                (self._outgoing, old_from, rel.get("from", "")),
+                (self._incoming, old_to, rel.get("to", "")),
+                (self._by_rel, old_rel, rel.get("rel", "")),
+            ):
+                if old != new:
+                    index[old].remove(idx)
+                    bisect.insort(index.setdefault(new, []), idx)
+            if self._by_id.get(old_id) == idx:
+                del self._by_id[old_id]
+            if "id" in rel:
+                self._by_id[rel["id"]] = idx
+                self._id_high_water = max(self._id_high_water, _rel_number(rel["id"]))
+            self._keys[idx] = (rel.get("from", ""), rel.get("to", ""), rel.get("rel", ""),
+                               rel.get("id"))
+            self._spans[idx] = _validity_span(rel)
+        if changed:
+            # Both are cheap to rebuild lazily and awkward to patch.
+            self._temporal = None
+            self._graph = None
+            self._changed.update(changed)
+
+    def add(
+        self,
+        from_e: str,
+        to_e: str,
+        rel: str,
+        context: str,
+        valid_from: str,
+        confidence: str,
+        source: str,
+        valid_to: str | None = None,
+    ) -> dict[str, Any]:
+        """Indexed equivalent of :func:`add`; also indexes the new record.
+
+        The next ID comes from a high-water mark kept by the indexes and the
+        vocabulary check uses :attr:`vocabulary`, so an add is O(1) instead
+        of a scan over every relationship.
+        """
+        self._sync()
+        new_rel = _new_relationship(
+            self.vocabulary, self._id_high_water + 1,
+            from_e, to_e, rel, context, valid_from, confidence, source, valid_to,
+        )
+        self._extend([new_rel])
+        return new_rel
+
+    def bulk_add(self, records: Iterable[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Indexed equivalent of :func:`bulk_add`; O(len(records))."""
+        self._sync()
+        new_rels = _new_relationships(self.vocabulary, self._id_high_water + 1, records)
+        self._extend(new_rels)
+        return new_rels
+
+    def import_records(self, rows: Iterable[tuple[int, dict[str, Any]]]) -> ImportReport:
+        """Indexed equivalent of :func:`import_records`; O(len(rows))."""
+        self._sync()
+        report = _import_batch(rows, self.vocabulary, self._by_id, self._id_high_water)
+        self._extend(report.accepted)
+        return report
+
+    def _extend(self, new_rels: list[dict[str, Any]]) -> None:
+        for new_rel in new_rels:
+            self.relationships.append(new_rel)
+            self._index_relationship(len(self.relationships) - 1, new_rel)
+
+    def validate(self) -> ValidationResult:
+        """Run :func:`validate_relationships` over the wrapped data.
+
+        The first call is a full pass; later calls re-check only the records
+        added through :meth:`add` or reported to :meth:`reindex` since,
+        reusing the kept validation state.
+        """
+        result = validate_relationships(
+            self.data, previous=self._validation, changed=sorted(self._changed)
+        )
+        self._validation = result.state
+        self._changed.clear()
+        return result
 
 
 # ---------------------------------------------------------------------------
-# CLI
+# Relationship diff
 # ---------------------------------------------------------------------------
 
-def _build_parser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(
-        prog="relationship_query",
-        description="Query and mutate a YAML entity-relationship file.",
-    )
-    parser.add_argument(
-        "--validate",
-        action="store_true",
-        help="Run semantic validation on the file and exit.",
-    )
-    parser.add_argument(
-        "--file",
-        type=str,
-        help="Path to the relationships YAML file.",
-    )
+def diff(data: dict[str, Any], pos_from: str, pos_to: str) -> RelationshipDiff:
+    """Return how the active relationships change from *pos_from* to *pos_to*.
 
-    subparsers = parser.add_subparsers(dest="command")
+    A relationship is *added* if it is active at *pos_to* but not at
+    *pos_from*, and *ended* if the reverse holds. An added record whose
+    ``supersedes`` names a record active at *pos_from* is reported as a
+    superseded pair instead, and neither side is listed as added or ended.
+    Records with a malformed position are skipped, as in :func:`render_matrix`.
 
-    # -- query -------------------------------------------------------------
-    q = subparsers.add_parser("query", help="Query relationships for an entity.")
-    q.add_argument("--entity", required=True, help="Entity ID or alias to search for.")
-    q.add_argument("--as-of", default=None, help="Temporal position filter (Act1/Ch2).")
-    q.add_argument("--file", required=True, dest="query_file", help="Relationships YAML file.")
+    Raises:
+        ValueError: If a position is malformed or *pos_from* is after *pos_to*.
+    """
+    start, end = parse_position(pos_from), parse_position(pos_to)
+    if start > end:
+        raise ValueError(f"diff --from {pos_from} is after --to {pos_to}")
 
-    # -- add ---------------------------------------------------------------
-    a = subparsers.add_parser("add", help="Add a new relationship.")
+    relationships = data.get("relationships", [])
+    rel_by_id = {r["id"]: r for r in relationships if "id" in r}
+
+    def active_at_start(rel: dict[str, Any]) -> bool:
+        try:
+            return _is_active(rel, start)
+        except ValueError:
+            return False
+
+    added: list[dict[str, Any]] = []
+    ended: list[dict[str, Any]] = []
+    for r in relationships:
+        try:
+            was, now = _is_active(r, start), _is_active(r, end)
+        except ValueError:
+            continue
+        if now and not was:
+            added.append(r)
+        elif was and not now:
+            ended.append(r)
+
+    return _pair_supersessions(pos_from, pos_to, added, ended, rel_by_id.get, active_at_start)
+
+
+def _pair_supersessions(
+    pos_from: str,
+    pos_to: str,
+    added: list[dict[str, Any]],
+    ended: list[dict[str, Any]],
+    find: Callable[[Any], dict[str, Any] | None],
+    active_at_start: Callable[[dict[str, Any]], bool],
+) -> RelationshipDiff:
+    """Move added records that supersede a record active at the start into pairs.
+
+    *find* maps a relationship ID to its record (None if unknown).
+    """
+    result = RelationshipDiff(pos_from=pos_from, pos_to=pos_to)
+    replaced: set[int] = set()
+    for r in added:
+        supersedes = r.get("supersedes")
+        old = find(supersedes) if supersedes is not None else None
+        if old is not None and active_at_start(old):
+            result.superseded.append({"old": old, "new": r})
+            replaced.add(id(old))
+        else:
+            result.added.append(r)
+    result.ended = [r for r in ended if id(r) not in replaced]
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Semantic validation
+# ---------------------------------------------------------------------------
+
+_VALID_FROM_RE = re.compile(r"^(L\d+/\w+|Act\d+/Ch\d+)$")
+_SOURCE_RE = re.compile(r"^canon/.+\.md(#L\d+)?$")
+
+# What the cross-record checks read from one relationship:
+# (id key, has "id", (from, to, rel), supersedes, superseded_by).
+_RecordKeys = tuple[Any, bool, tuple[str, str, str], Any, Any]
+
+
+@dataclass
+class ValidationState:
+    """Indexes and per-check errors kept from a validation pass.
+
+    Returned as ``ValidationResult.state``; pass it back to
+    :func:`validate_relationships` as *previous* to re-check only what a
+    delta of relationship edits can affect. Errors are stored keyed by what
+    produced them so they can be replaced piecemeal and reassembled in
+    full-pass order.
+    """
+
+    vocab: set[str]
+    alias_errors: list[str]
+    keys: list[_RecordKeys] = field(default_factory=list)
+    ids: dict[Any, list[int]] = field(default_factory=dict)
+    rel_by_id: dict[Any, dict[str, Any]] = field(default_factory=dict)
+    referrers: dict[Any, set[int]] = field(default_factory=dict)
+    triples: dict[tuple[str, str, str], list[int]] = field(default_factory=dict)
+    duplicate_errors: dict[Any, list[tuple[int, str]]] = field(default_factory=dict)
+    record_errors: dict[int, list[str]] = field(default_factory=dict)
+    cycles: dict[Any, list[Any]] = field(default_factory=dict)
+    cycle_of: dict[Any, Any] = field(default_factory=dict)
+    overlap_errors: dict[tuple[str, str, str], list[str]] = field(default_factory=dict)
+
+
+def _supersession_cycles(
+    rel_by_id: dict[Any, dict[str, Any]],
+    start_ids: Iterable[Any],
+) -> list[list[Any]]:
+    """Return the cycles in the ``supersedes`` graph reachable from *start_ids*.
+
+    Each record supersedes at most one other, so every walk along
+    ``supersedes`` either ends or enters exactly one cycle. Walks colour the
+    IDs they pass (on the current path, then done) and stop at the first
+    coloured ID, so every relationship is visited once and each cycle is
+    found once, listed in chain order from the member the walk entered by.
+    """
+    on_path, done = 1, 2
+    colour: dict[Any, int] = {}
+    cycles: list[list[Any]] = []
+    for rid in start_ids:
+        path: list[Any] = []
+        current: Any = rid
+        while current is not None and current not in colour:
+            colour[current] = on_path
+            path.append(current)
+            next_rel = rel_by_id.get(current)
+            current = next_rel.get("supersedes") if next_rel else None
+        if current is not None and colour[current] == on_path:
+            cycles.append(path[path.index(current):])
+        for visited in path:
+            colour[visited] = done
+    return cycles
+
+
+def _overlapping_pairs(group: list[dict[str, Any]]) -> list[tuple[int, int]]:
+    """Return ``(i, j)`` index pairs, ``i < j``, of records in *group* whose validity overlaps.
+
+    Two records overlap when ``a.valid_from < b.valid_to`` and
+    ``b.valid_from < a.valid_to``, with a null ``valid_to`` meaning "still
+    active". Records with a missing or malformed endpoint are skipped (their
+    format errors are reported separately).
+
+    Positions are packed once, then proper ranges are swept in start order
+    against a heap of still-open ranges, so a group costs O(k log k) plus one
+    step per reported pair. Empty or inverted ranges are rare data errors and
+    are compared directly against every other record. Pairs are returned in
+    the order a pairwise scan would report them.
+    """
+    spans: list[tuple[int, int, int]] = []
+    for idx, r in enumerate(group):
+        vt = r.get("valid_to")
+        try:
+            start = position_key(str(r.get("valid_from", "")))
+            end = position_key(str(vt)) if vt is not None else _OPEN_END
+        except ValueError:
+            continue
+        spans.append((start, end, idx))
+    return _overlapping_spans(spans)
+
+
+def _overlapping_spans(spans: list[tuple[int, int, int]]) -> list[tuple[int, int]]:
+    """Return the sorted ``(i, j)`` pairs, ``i < j``, of overlapping ``(start, end, i)`` spans.
+
+    The sweep behind :func:`_overlapping_pairs`, for callers that already
+    hold packed positions.
+    """
+    proper = sorted(span for span in spans if span[0] < span[1])
+    degenerate = [span for span in spans if span[0] >= span[1]]
+
+    pairs: list[tuple[int, int]] = []
+    open_spans: list[tuple[int, int]] = []  # heap of (end, idx)
+    for start, end, idx in proper:
+        while open_spans and open_spans[0][0] <= start:
+            heapq.heappop(open_spans)
+        pairs.extend((min(idx, other), max(idx, other)) for _, other in open_spans)
+        heapq.heappush(open_spans, (end, idx))
+
+    for a_start, a_end, a_idx in degenerate:
+        for b_start, b_end, b_idx in spans:
+            if b_idx == a_idx or (b_start >= b_end and b_idx < a_idx):
+                continue  # Self, or a degenerate pair already compared.
+            if a_start < b_end and b_start < a_end:
+                pairs.append((min(a_idx, b_idx), max(a_idx, b_idx)))
+
+    pairs.sort()
+    return pairs
+
+
+def _alias_errors(entities: dict[str, Any]) -> list[str]:
+    """Return an error for every alias claimed by more than one entity."""
+    errors: list[str] = []
+    alias_owner: dict[str, str] = {}
+    for eid, einfo in entities.items():
+        for alias in einfo.get("aliases", []):
+            if alias in alias_owner:
+                errors.append(
+                    f"Alias collision: '{alias}' is claimed by both "
+                    f"'{alias_owner[alias]}' and '{eid}'"
+                )
+            else:
+                alias_owner[alias] = eid
+    return errors
+
+
+def record_format_errors(r: dict[str, Any], vocab: Container[str]) -> list[str]:
+    """Return the vocabulary and format errors of one record.
+
+    These are the checks of :func:`validate_relationships` that read no
+    other record, in the order it reports them.
+    """
+    errors: list[str] = []
+    rid = r.get("id", "<unknown>")
+
+    # rel in vocabulary
+    if r.get("rel") not in vocab:
+        errors.append(f"{rid}: rel '{r.get('rel')}' not in rel_vocabulary")
+
+    # valid_from format
+    vf = r.get("valid_from", "")
+    if not _VALID_FROM_RE.match(str(vf)):
+        errors.append(f"{rid}: invalid valid_from format: {vf!r}")
+
+    # valid_to format (if present and not null)
+    vt = r.get("valid_to")
+    if vt is not None and not _VALID_FROM_RE.match(str(vt)):
+        errors.append(f"{rid}: invalid valid_to format: {vt!r}")
+
+    # source format
+    src = r.get("source", "")
+    if not _SOURCE_RE.match(str(src)):
+        errors.append(f"{rid}: invalid source format: {src!r}")
+
+    return errors
+
+
+def _record_errors(
+    r: dict[str, Any],
+    vocab: set[str],
+    rel_by_id: dict[Any, dict[str, Any]],
+) -> list[str]:
+    """Return the format, vocabulary and supersession-link errors of one record."""
+    errors = record_format_errors(r, vocab)
+    rid = r.get("id", "<unknown>")
+
+    # Supersession bidirectional consistency
+    supersedes = r.get("supersedes")
+    if supersedes is not None:
+        target = rel_by_id.get(supersedes)
+        if target is None:
+            errors.append(
+                f"{rid}: supersedes '{supersedes}' which does not exist"
+            )
+        elif target.get("superseded_by") != rid:
+            errors.append(
+                f"{rid}: supersedes '{supersedes}', but "
+                f"'{supersedes}'.superseded_by = {target.get('superseded_by')!r} "
+                f"(expected '{rid}')"
+            )
+
+    superseded_by = r.get("superseded_by")
+    if superseded_by is not None:
+        target = rel_by_id.get(superseded_by)
+        if target is None:
+            errors.append(
+                f"{rid}: superseded_by '{superseded_by}' which does not exist"
+            )
+        elif target.get("supersedes") != rid:
+            errors.append(
+                f"{rid}: superseded_by '{superseded_by}', but "
+                f"'{superseded_by}'.supersedes = {target.get('supersedes')!r} "
+                f"(expected '{rid}')"
+            )
+
+    return errors
+
+
+def _record_keys(idx: int, r: dict[str, Any]) -> _RecordKeys:
+    return (
+        r.get("id", f"<missing@{idx}>"),
+        "id" in r,
+        (r.get("from", ""), r.get("to", ""), r.get("rel", "")),
+        r.get("supersedes"),
+        r.get("superseded_by"),
+    )
+
+
+def _index_keys(state: ValidationState, idx: int, keys: _RecordKeys) -> None:
+    rid, _, triple, supersedes, superseded_by = keys
+    bisect.insort(state.ids.setdefault(rid, []), idx)
+    bisect.insort(state.triples.setdefault(triple, []), idx)
+    for target in (supersedes, superseded_by):
+        if target is not None:
+            state.referrers.setdefault(target, set()).add(idx)
+
+
+def _unindex_keys(state: ValidationState, idx: int, keys: _RecordKeys) -> None:
+    rid, _, triple, supersedes, superseded_by = keys
+    for index, key in ((state.ids, rid), (state.triples, triple)):
+        index[key].remove(idx)
+        if not index[key]:
+            del index[key]
+    for target in (supersedes, superseded_by):
+        if target is not None:
+            state.referrers[target].discard(idx)
+            if not state.referrers[target]:
+                del state.referrers[target]
+
+
+def _revalidate(
+    state: ValidationState,
+    relationships: list[dict[str, Any]],
+    delta: Iterable[int],
+) -> None:
+    """Re-index the records at *delta* and re-run every check they can affect.
+
+    A record's own checks also read the records its supersession links name,
+    so records linking to a changed ID are re-checked too. Duplicate-ID and
+    cycle checks are re-run for every ID a changed record had or has, and
+    overlap checks for every triple it belonged or belongs to.
+    """
+    delta = sorted(delta)
+    touched_ids: set[Any] = set()
+    touched_triples: set[tuple[str, str, str]] = set()
+    for idx in delta:
+        keys = _record_keys(idx, relationships[idx])
+        if idx < len(state.keys):
+            old = state.keys[idx]
+            _unindex_keys(state, idx, old)
+            touched_ids.add(old[0])
+            touched_triples.add(old[2])
+            state.keys[idx] = keys
+        else:
+            state.keys.append(keys)
+        _index_keys(state, idx, keys)
+        touched_ids.add(keys[0])
+        touched_triples.add(keys[2])
+
+    # -- ID index: rel_by_id keeps the last record with each ID ------------
+    for rid in touched_ids:
+        indices = state.ids.get(rid)
+        if indices and state.keys[indices[-1]][1]:
+            state.rel_by_id[rid] = relationships[indices[-1]]
+        else:
+            state.rel_by_id.pop(rid, None)
+
+        # -- Duplicate relationship IDs ------------------------------------
+        if indices and len(indices) > 1:
+            state.duplicate_errors[rid] = [
+                (idx, f"Duplicate relationship ID: {rid}") for idx in indices[1:]
+            ]
+        else:
+            state.duplicate_errors.pop(rid, None)
+
+    # -- Per-relationship checks -------------------------------------------
+    recheck = set(delta)
+    for rid in touched_ids:
+        recheck.update(state.referrers.get(rid, ()))
+    for idx in recheck:
+        errors = _record_errors(relationships[idx], state.vocab, state.rel_by_id)
+        if errors:
+            state.record_errors[idx] = errors
+        else:
+            state.record_errors.pop(idx, None)
+
+    # -- Circular supersession detection -----------------------------------
+    # A cycle can only appear or disappear through an edge that changed, so
+    # drop the cycles through touched IDs and walk again from those IDs.
+    for rid in touched_ids:
+        start = state.cycle_of.get(rid)
+        if start is not None:
+            for member in state.cycles.pop(start):
+                del state.cycle_of[member]
+    starts = [rid for rid in touched_ids if rid in state.rel_by_id]
+    for cycle in _supersession_cycles(state.rel_by_id, starts):
+        # Start each cycle at its earliest member so it is keyed (and
+        # reported) the same whichever walk found it.
+        first = min(range(len(cycle)), key=lambda i: state.ids[cycle[i]][0])
+        cycle = cycle[first:] + cycle[:first]
+        if cycle[0] not in state.cycles:
+            state.cycles[cycle[0]] = cycle
+            for member in cycle:
+                state.cycle_of[member] = cycle[0]
+
+    # -- Temporal overlap for identical (from, to, rel) triples ------------
+    for triple_key in touched_triples:
+        indices = state.triples.get(triple_key, [])
+        group = [relationships[idx] for idx in indices]
+        errors = [
+            f"Temporal overlap: {group[i].get('id')} and {group[j].get('id')} "
+            f"share ({triple_key[0]}, {triple_key[1]}, {triple_key[2]}) "
+            f"with overlapping validity"
+            for i, j in (_overlapping_pairs(group) if len(group) > 1 else ())
+        ]
+        if errors:
+            state.overlap_errors[triple_key] = errors
+        else:
+            state.overlap_errors.pop(triple_key, None)
+
+
+def _collect_errors(state: ValidationState) -> list[str]:
+    """Assemble the stored errors in full-pass order."""
+    errors = [
+        msg for _, msg in sorted(
+            (entry for entries in state.duplicate_errors.values() for entry in entries),
+            key=lambda entry: entry[0],
+        )
+    ]
+    errors.extend(state.alias_errors)
+    for idx in sorted(state.record_errors):
+        errors.extend(state.record_errors[idx])
+    for start in sorted(state.cycles, key=lambda rid: state.ids[rid][0]):
+        cycle = state.cycles[start]
+        errors.append(
+            "Circular supersession chain detected involving: "
+            + " -> ".join(str(rid) for rid in cycle + [cycle[0]])
+        )
+    for triple_key in sorted(state.overlap_errors, key=lambda t: state.triples[t][0]):
+        errors.extend(state.overlap_errors[triple_key])
+    return errors
+
+
+def validate_relationships(
+    data: dict[str, Any],
+    previous: ValidationState | None = None,
+    changed: Iterable[int] = (),
+) -> ValidationResult:
+    """Run full semantic validation on a relationships data structure.
+
+    Checks performed:
+    - No duplicate relationship IDs
+    - No alias collisions across entities
+    - Every ``rel`` matches a term in ``rel_vocabulary``
+    - Supersession bidirectional consistency
+    - Circular supersession detection
+    - Temporal overlap for identical ``(from, to, rel)`` triples
+    - Source citation format
+    - ``valid_from`` / ``valid_to`` format
+
+    For incremental validation pass the ``state`` of an earlier result on the
+    same *data* as *previous*, and the indices of relationships edited since
+    as *changed*; relationships appended since are picked up automatically.
+    Only the checks the edits can affect are re-run, and the result is the
+    same as a full pass. *previous* is updated in place and returned as the
+    new result's ``state``. The delta covers relationship records only: a
+    changed ``rel_vocabulary`` falls back to a full pass, and edits to
+    ``entities`` need one (``previous=None``).
+
+    Raises:
+        ValueError: If relationships were removed since *previous*.
+    """
+    relationships: list[dict[str, Any]] = data.get("relationships", [])
+    vocab = _flatten_vocabulary(data.get("rel_vocabulary", {}))
+
+    state = previous
+    if state is None or state.vocab != vocab:
+        state = ValidationState(vocab=vocab, alias_errors=_alias_errors(data.get("entities", {})))
+        delta: Iterable[int] = range(len(relationships))
+    elif len(relationships) < len(state.keys):
+        raise ValueError(
+            f"Relationships were removed since the previous validation "
+            f"({len(state.keys)} -> {len(relationships)}); run a full validation."
+        )
+    else:
+        delta = set(changed).union(range(len(state.keys), len(relationships)))
+
+    _revalidate(state, relationships, delta)
+    errors = _collect_errors(state)
+    return ValidationResult(ok=len(errors) == 0, errors=errors, state=state)
+
+
+# ---------------------------------------------------------------------------
+# Bulk import
+# ---------------------------------------------------------------------------
+
+IMPORT_FORMATS = ("jsonl", "csv")
+CONFIDENCE_LEVELS = ("low", "medium", "high")
+
+_IMPORT_SUFFIXES = {".jsonl": "jsonl", ".ndjson": "jsonl", ".csv": "csv"}
+_IMPORT_FIELDS = frozenset(
+    ("id", *_RECORD_FIELDS, "valid_to", "supersedes", "superseded_by")
+)
+# Optional columns whose empty CSV cells mean null.
+_NULLABLE_FIELDS = ("id", "valid_to", "supersedes", "superseded_by")
+
+
+def import_format(path: str, fmt: str | None = None) -> str:
+    """Return *fmt*, or the import format implied by *path*'s extension.
+
+    Raises:
+        ValueError: If neither gives one of :data:`IMPORT_FORMATS`.
+    """
+    fmt = fmt or _IMPORT_SUFFIXES.get(Path(path).suffix.lower())
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(
+            f"Cannot tell the import format of {path!r}; pass --format "
+            f"({', '.join(IMPORT_FORMATS)})."
+        )
+    return fmt
+
+
+def read_import_rows(
+    stream: IO[str],
+    fmt: str,
+) -> tuple[list[tuple[int, dict[str, Any]]], list[tuple[int, str]]]:
+    """Parse a JSONL or CSV stream of relationship records.
+
+    Returns ``(rows, rejects)``: ``(line, record)`` pairs for every parsed
+    record and ``(line, message)`` pairs, as in :class:`ImportReport`, for
+    lines that could not be parsed. Empty CSV cells in optional columns become None.
+    """
+    rows: list[tuple[int, dict[str, Any]]] = []
+    rejects: list[tuple[int, str]] = []
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            if None in record:
+                rejects.append((reader.line_num, "more cells than header columns"))
+                continue
+            for key in _NULLABLE_FIELDS:
+                if record.get(key) == "":
+                    record[key] = None
+            rows.append((reader.line_num, record))
+        return rows, rejects
+
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            rejects.append((line_no, f"invalid JSON: {e}"))
+            continue
+        if isinstance(record, dict):
+            rows.append((line_no, record))
+        else:
+            rejects.append((line_no, "expected a JSON object"))
+    return rows, rejects
+
+
+def _import_errors(record: dict[str, Any], vocab: Iterable[str]) -> list[str]:
+    """Return why *record* cannot be imported; the checks of :func:`_record_errors`."""
+    errors: list[str] = []
+    unknown = sorted(set(record) - _IMPORT_FIELDS)
+    if unknown:
+        errors.append(f"unknown fields: {', '.join(unknown)}")
+    missing = [f for f in _RECORD_FIELDS if not isinstance(record.get(f), str) or not record[f]]
+    if missing:
+        errors.append(f"missing fields: {', '.join(missing)}")
+
+    if "rel" not in missing and record["rel"] not in vocab:
+        errors.append(f"rel '{record['rel']}' not in rel_vocabulary")
+    if "valid_from" not in missing and not _VALID_FROM_RE.match(record["valid_from"]):
+        errors.append(f"invalid valid_from format: {record['valid_from']!r}")
+    vt = record.get("valid_to")
+    if vt is not None and not _VALID_FROM_RE.match(str(vt)):
+        errors.append(f"invalid valid_to format: {vt!r}")
+    if "source" not in missing and not _SOURCE_RE.match(record["source"]):
+        errors.append(f"invalid source format: {record['source']!r}")
+    if "confidence" not in missing and record["confidence"] not in CONFIDENCE_LEVELS:
+        errors.append(f"invalid confidence: {record['confidence']!r}")
+    return errors
+
+
+def _import_batch(
+    rows: Iterable[tuple[int, dict[str, Any]]],
+    vocab: Iterable[str],
+    existing_ids: Container[Any],
+    high_water: int,
+) -> ImportReport:
+    """Check every row in one pass and build the records to append.
+
+    Rows that carry an ``id`` keep it; the rest are numbered after both
+    *high_water* and the largest accepted ``rel_N`` ID in the batch.
+    """
+    report = ImportReport()
+    accepted: list[dict[str, Any]] = []
+    batch_ids: set[Any] = set()
+    for line, record in rows:
+        errors = _import_errors(record, vocab)
+        rid = record.get("id")
+        if rid is not None and (rid in existing_ids or rid in batch_ids):
+            errors.append(f"duplicate id {rid!r}")
+        if errors:
+            report.rejected.extend((line, err) for err in errors)
+            continue
+        if rid is not None:
+            batch_ids.add(rid)
+            high_water = max(high_water, _rel_number(rid))
+        accepted.append(record)
+
+    for record in accepted:
+        new_rel = {"id": record.get("id")}
+        if new_rel["id"] is None:
+            high_water += 1
+            new_rel["id"] = f"rel_{high_water:03d}"
+        new_rel.update((f, record[f]) for f in _RECORD_FIELDS)
+        new_rel.update(
+            (f, record[f]) for f in ("valid_to", "supersedes", "superseded_by")
+            if record.get(f) is not None
+        )
+        report.accepted.append(new_rel)
+    return report
+
+
+def import_records(
+    data: dict[str, Any],
+    rows: Iterable[tuple[int, dict[str, Any]]],
+) -> ImportReport:
+    """Validate ``(line, record)`` rows and append the good ones to *data*.
+
+    Every row is checked for required fields, vocabulary, ``valid_from`` /
+    ``valid_to`` and ``source`` format, confidence level and duplicate IDs
+    (against *data* and the rest of the batch) before anything is added.
+    Rejected rows are reported, not raised. Cross-record rules (duplicate
+    triples, supersession links) are left to :func:`validate_relationships`.
+    """
+    relationships = data.setdefault("relationships", [])
+    report = _import_batch(
+        rows,
+        _flatten_vocabulary(data.get("rel_vocabulary", {})),
+        {r.get("id") for r in relationships},
+        _next_rel_number(relationships) - 1,
+    )
+    relationships.extend(report.accepted)
+    return report
+
+
+# ---------------------------------------------------------------------------
+# Matrix rendering
+# ---------------------------------------------------------------------------
+
+def render_matrix(
+    data: dict[str, Any],
+    as_of: str | None = None,
+    *,
+    sparse: bool = False,
+    edges: bool = False,
+    types: Iterable[str] | None = None,
+    ids: Iterable[str] | None = None,
+    page_size: int | None = None,
+    page: int | None = None,
+) -> str:
+    """Render a markdown adjacency matrix of entity relationships.
+
+    Rows and columns are entity IDs. Cells contain the ``rel`` value(s)
+    connecting the row entity (``from``) to the column entity (``to``).
+
+    Options for large casts:
+        sparse:    Drop rows without outgoing and columns without incoming edges.
+        edges:     Render an edge list, one row per connected pair, instead.
+        types:     Keep only entities whose ``type`` is listed.
+        ids:       Keep only the listed entity IDs.
+        page_size: Split the matrix into ``page_size`` x ``page_size`` tiles
+                   (or the edge list into pages of ``page_size`` rows).
+        page:      Render only this 1-based tile or page.
+
+    Raises:
+        ValueError: If *page_size* is not positive or *page* is out of range.
+    """
+    return _render_matrix(
+        data.get("entities", {}), _active_relationships(data, as_of),
+        sparse=sparse, edges=edges, types=types, ids=ids, page_size=page_size, page=page,
+    )
+
+
+def _active_relationships(data: dict[str, Any], as_of: str | None) -> Iterator[dict[str, Any]]:
+    """Yield the relationships active at *as_of* (all of them if None).
+
+    Records with a malformed position are skipped.
+    """
+    as_of_pos: tuple[int, int] | None = None
+    if as_of is not None:
+        as_of_pos = parse_position(as_of)
+
+    for r in data.get("relationships", []):
+        if as_of_pos is not None:
+            try:
+                if not _is_active(r, as_of_pos):
+                    continue
+            except ValueError:
+                continue
+        yield r
+
+
+def _render_matrix(
+    entities: dict[str, Any],
+    active: Iterable[dict[str, Any]],
+    *,
+    sparse: bool = False,
+    edges: bool = False,
+    types: Iterable[str] | None = None,
+    ids: Iterable[str] | None = None,
+    page_size: int | None = None,
+    page: int | None = None,
+) -> str:
+    """Render the markdown view of the already-filtered *active* relationships.
+
+    See :func:`render_matrix` for the options.
+    """
+    if not entities:
+        return "(no entities defined)"
+    if page_size is not None and page_size < 1:
+        raise ValueError(f"page_size must be positive, got {page_size}")
+
+    type_filter = set(types) if types is not None else None
+    id_filter = set(ids) if ids is not None else None
+    selected = [
+        eid for eid, einfo in entities.items()
+        if (type_filter is None or einfo.get("type") in type_filter)
+        and (id_filter is None or eid in id_filter)
+    ]
+    if not selected:
+        return "(no matching entities)"
+    order = {eid: n for n, eid in enumerate(selected)}
+
+    # Non-empty cells only: row ID -> column ID -> rel terms, in file order.
+    cells: dict[str, dict[str, list[str]]] = defaultdict(dict)
+    for r in active:
+        from_e = r.get("from", "")
+        to_e = r.get("to", "")
+        if from_e in order and to_e in order:
+            cells[from_e].setdefault(to_e, []).append(r.get("rel", ""))
+
+    if edges:
+        rows = [
+            f"| {row_id} | {col_id} | {', '.join(cells[row_id][col_id])} |"
+            for row_id in selected if row_id in cells
+            for col_id in sorted(cells[row_id], key=order.__getitem__)
+        ]
+        if not rows:
+            return "(no relationships)"
+        step = page_size or len(rows)
+        pages = [
+            (
+                f"edges {start + 1}-{min(start + step, len(rows))} of {len(rows)}",
+                "\n".join(["| From | To | Relationships |", "| --- | --- | --- |",
+                           *rows[start:start + step]]),
+            )
+            for start in range(0, len(rows), step)
+        ]
+        return _select_page(pages, page, "Page")
+
+    row_ids = col_ids = selected
+    if sparse:
+        targets = {col for row, row_cells in cells.items() for col in row_cells if col != row}
+        row_ids = [eid for eid in selected if any(col != eid for col in cells.get(eid, ()))]
+        col_ids = [eid for eid in selected if eid in targets]
+        if not row_ids:
+            return "(no relationships)"
+
+    step = page_size or max(len(row_ids), len(col_ids))
+    tiles = [
+        (
+            f"rows {rows[0]}..{rows[-1]}, columns {cols[0]}..{cols[-1]}",
+            _matrix_table(cells, rows, cols),
+        )
+        for r0 in range(0, len(row_ids), step)
+        for rows in [row_ids[r0:r0 + step]]
+        for c0 in range(0, len(col_ids), step)
+        for cols in [col_ids[c0:c0 + step]]
+    ]
+    return _select_page(tiles, page, "Tile")
+
+
+def _matrix_table(
+    cells: dict[str, dict[str, list[str]]],
+    row_ids: list[str],
+    col_ids: list[str],
+) -> str:
+    """Render one markdown table; rows are pre-filled so only edges cost work."""
+    position = {col_id: n for n, col_id in enumerate(col_ids)}
+    lines: list[str] = [
+        "| From / To |" + "".join(f" {col_id} |" for col_id in col_ids),
+        "| --- |" + " --- |" * len(col_ids),
+    ]
+    for row_id in row_ids:
+        row = ["  |"] * len(col_ids)
+        for col_id, terms in cells.get(row_id, {}).items():
+            n = position.get(col_id)
+            if n is not None:
+                row[n] = f" {', '.join(terms)} |"
+        if row_id in position:
+            row[position[row_id]] = " --- |"
+        lines.append(f"| **{row_id}** |" + "".join(row))
+
+    return "\n".join(lines)
+
+
+def _select_page(pages: list[tuple[str, str]], page: int | None, kind: str) -> str:
+    """Join labelled *pages*, or return only the 1-based *page*.
+
+    A single page is returned bare, so unpaginated output is a plain table.
+    """
+    if page is not None and not 1 <= page <= len(pages):
+        raise ValueError(f"{kind.lower()} {page} out of range (1-{len(pages)})")
+    if len(pages) == 1:
+        return pages[0][1]
+    chosen = range(len(pages)) if page is None else [page - 1]
+    return "\n\n".join(
+        f"**{kind} {n + 1}/{len(pages)}**: {pages[n][0]}\n\n{pages[n][1]}" for n in chosen
+    )
+
+
+# ---------------------------------------------------------------------------
+# Graph export
+# ---------------------------------------------------------------------------
+
+EXPORT_FORMATS = ("csv", "json", "graphml", "dot")
+
+
+def export_graph(
+    data: dict[str, Any],
+    out: IO[str],
+    fmt: str,
+    as_of: str | None = None,
+) -> int:
+    """Stream the relationship graph to *out* and return the number of edges.
+
+    Formats:
+        csv:     Adjacency matrix over entity IDs; cells hold ``rel`` terms.
+        json:    ``{"as_of", "nodes", "edges"}`` with full relationship records.
+        graphml: Directed GraphML; node ``type`` and edge ``rel``/validity data.
+        dot:     Graphviz digraph with ``rel`` edge labels.
+
+    Rows, nodes and edges are written as they are produced, so the rendered
+    graph is never held in memory. Only relationships active at *as_of* are
+    exported when it is given, as in :func:`render_matrix`.
+
+    Raises:
+        ValueError: If *fmt* is not one of :data:`EXPORT_FORMATS`.
+    """
+    active = _active_relationships(data, as_of)
+    return _export_graph(data.get("entities", {}), active, out, fmt, as_of)
+
+
+def _export_graph(
+    entities: dict[str, Any],
+    active: Iterable[dict[str, Any]],
+    out: IO[str],
+    fmt: str,
+    as_of: str | None,
+) -> int:
+    if fmt == "csv":
+        return _export_csv(entities, active, out)
+    if fmt == "json":
+        return _export_json(entities, active, out, as_of)
+    if fmt == "graphml":
+        return _export_graphml(entities, active, out)
+    if fmt == "dot":
+        return _export_dot(entities, active, out)
+    raise ValueError(f"Unknown export format {fmt!r}; expected one of {', '.join(EXPORT_FORMATS)}")
+
+
+def _export_csv(entities: dict[str, Any], active: Iterable[dict[str, Any]], out: IO[str]) -> int:
+    # Rows need every edge of their source entity, so cells are grouped
+    # first; only the terms are kept, not rendered rows.
+    cells: dict[str, dict[str, list[str]]] = defaultdict(dict)
+    count = 0
+    for r in active:
+        from_e = r.get("from", "")
+        to_e = r.get("to", "")
+        if from_e in entities and to_e in entities:
+            cells[from_e].setdefault(to_e, []).append(str(r.get("rel", "")))
+            count += 1
+
+    entity_ids = list(entities)
+    writer = csv.writer(out)
+    writer.writerow(["from/to", *entity_ids])
+    for row_id in entity_ids:
+        row_cells = cells.get(row_id, {})
+        writer.writerow([row_id, *(", ".join(row_cells.get(col_id, ())) for col_id in entity_ids)])
+    return count
+
+
+def _export_json(
+    entities: dict[str, Any],
+    active: Iterable[dict[str, Any]],
+    out: IO[str],
+    as_of: str | None,
+) -> int:
+    out.write(f'{{"as_of": {json.dumps(as_of)}, "nodes": [')
+    for n, (eid, einfo) in enumerate(entities.items()):
+        node = {"id": eid, "type": einfo.get("type"), "aliases": einfo.get("aliases", [])}
+        out.write(("," if n else "") + "\n  " + json.dumps(node, default=str))
+    out.write('\n], "edges": [')
+    count = 0
+    for r in active:
+        out.write(("," if count else "") + "\n  " + json.dumps(r, default=str))
+        count += 1
+    out.write("\n]}\n")
+    return count
+
+
+# GraphML ``<key>`` declarations: (id, domain); data values are strings.
+_GRAPHML_KEYS = (
+    ("type", "node"),
+    ("rel_id", "edge"),
+    ("rel", "edge"),
+    ("valid_from", "edge"),
+    ("valid_to", "edge"),
+    ("confidence", "edge"),
+)
+
+
+def _export_graphml(
+    entities: dict[str, Any],
+    active: Iterable[dict[str, Any]],
+    out: IO[str],
+) -> int:
+    def data_elements(values: dict[str, Any]) -> str:
+        return "".join(
+            f'<data key="{key}">{xml_escape(str(value))}</data>'
+            for key, value in values.items() if value is not None
+        )
+
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    out.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+    for key, domain in _GRAPHML_KEYS:
+        out.write(f'  <key id="{key}" for="{domain}" attr.name="{key}" attr.type="string"/>\n')
+    out.write('  <graph id="relationships" edgedefault="directed">\n')
+
+    declared: set[str] = set()
+    for eid, einfo in entities.items():
+        declared.add(eid)
+        node_data = data_elements({"type": einfo.get("type")})
+        out.write(f"    <node id={quoteattr(eid)}>{node_data}</node>\n")
+
+    count = 0
+    for r in active:
+        from_e = str(r.get("from", ""))
+        to_e = str(r.get("to", ""))
+        # Endpoints that are not entity IDs still need a node declaration.
+        for endpoint in (from_e, to_e):
+            if endpoint not in declared:
+                declared.add(endpoint)
+                out.write(f"    <node id={quoteattr(endpoint)}/>\n")
+        values = {
+            "rel_id": r.get("id"),
+            "rel": r.get("rel"),
+            "valid_from": r.get("valid_from"),
+            "valid_to": r.get("valid_to"),
+            "confidence": r.get("confidence"),
+        }
+        out.write(
+            f"    <edge source={quoteattr(from_e)} target={quoteattr(to_e)}>"
+            f"{data_elements(values)}</edge>\n"
+        )
+        count += 1
+
+    out.write("  </graph>\n</graphml>\n")
+    return count
+
+
+def _dot_id(value: Any) -> str:
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _export_dot(entities: dict[str, Any], active: Iterable[dict[str, Any]], out: IO[str]) -> int:
+    out.write("digraph relationships {\n")
+    for eid, einfo in entities.items():
+        out.write(f"  {_dot_id(eid)} [type={_dot_id(einfo.get('type', ''))}];\n")
+    count = 0
+    for r in active:
+        out.write(
+            f"  {_dot_id(r.get('from', ''))} -> {_dot_id(r.get('to', ''))} "
+            f"[label={_dot_id(r.get('rel', ''))}, id={_dot_id(r.get('id', ''))}];\n"
+        )
+        count += 1
+    out.write("}\n")
+    return count
+
+
+# ---------------------------------------------------------------------------
+# Mention extraction
+# ---------------------------------------------------------------------------
+
+def _fold(text: str) -> str:
+    """Lowercase *text* one character at a time, keeping offsets aligned.
+
+    Characters whose lowercase form is longer than one character (such as
+    ``"İ"``) are left as they are. ASCII text, where every character folds
+    to one, is lowered in a single call.
+    """
+    if text.isascii():
+        return text.lower()
+    return "".join(low if len(low := ch.lower()) == 1 else ch for ch in text)
+
+
+def _is_word(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def entity_names(entities: dict[str, Any]) -> dict[str, set[str]]:
+    """Map every name an entity goes by to the entity IDs that use it.
+
+    Names are each entity's ID, its ``label`` when it has one, and its
+    ``aliases``.
+    """
+    names: dict[str, set[str]] = {}
+    for eid, einfo in entities.items():
+        einfo = einfo or {}
+        for name in (eid, einfo.get("label"), *(einfo.get("aliases") or ())):
+            if isinstance(name, str) and name.strip():
+                names.setdefault(name.strip(), set()).add(eid)
+    return names
+
+
+class MentionMatcher:
+    """Aho-Corasick automaton over entity names.
+
+    :meth:`scan` finds every name in a text in one pass over its characters,
+    however many names there are. Matching ignores case and only accepts
+    whole words: a name that starts or ends with a letter, digit or
+    underscore must not be glued to another one in the text. Where matches
+    overlap, the leftmost wins, then the longest, so "Dr. Vasquez" is one
+    mention rather than "Dr. Vasquez" and "Vasquez".
+    """
+
+    def __init__(self, names: dict[str, Iterable[str]]) -> None:
+        # Trie transitions, failure links and, per state, the patterns that
+        # end there (its own plus those reached through failure links).
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]
+        # Per pattern: length, whether it must start / end on a word
+        # boundary, and the entity IDs it resolves to.
+        self._patterns: list[tuple[int, bool, bool, list[str]]] = []
+
+        by_folded: dict[str, set[str]] = {}
+        for name, ids in names.items():
+            by_folded.setdefault(_fold(name), set()).update(ids)
+        for pattern, ids in by_folded.items():
+            self._insert(pattern, sorted(ids))
+        self._link()
+
+    @classmethod
+    def from_entities(cls, entities: dict[str, Any]) -> MentionMatcher:
+        """Build a matcher for the names in an ``entities`` mapping."""
+        return cls(entity_names(entities))
+
+    def _insert(self, pattern: str, ids: list[str]) -> None:
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(len(self._patterns))
+        self._patterns.append((len(pattern), _is_word(pattern[0]), _is_word(pattern[-1]), ids))
+
+    def _link(self) -> None:
+        """Set failure links breadth-first and merge outputs along them."""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def scan(self, text: str) -> list[Mention]:
+        """Return the mentions in *text*, in text order."""
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self._patterns
+        folded = _fold(text)
+        size = len(text)
+        candidates: list[tuple[int, int, int]] = []
+        state = 0
+        for end, ch in enumerate(folded):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not out[state]:
+                continue
+            for p in out[state]:
+                length, word_start, word_end, _ = patterns[p]
+                start = end - length + 1
+                if word_start and start > 0 and _is_word(folded[start - 1]):
+                    continue
+                if word_end and end + 1 < size and _is_word(folded[end + 1]):
+                    continue
+                candidates.append((start, -length, p))
+
+        line_starts = [0] + [i + 1 for i, ch in enumerate(text) if ch == "\n"]
+        mentions = []
+        taken = 0
+        for start, neg_length, p in sorted(candidates):
+            if start < taken:
+                continue
+            taken = start - neg_length
+            line = bisect.bisect_right(line_starts, start)
+            mentions.append(Mention(
+                entity_ids=patterns[p][3],
+                text=text[start:taken],
+                line=line,
+                column=start - line_starts[line - 1],
+                offset=start,
+            ))
+        return mentions
+
+
+def find_mentions(data: dict[str, Any], text: str) -> list[Mention]:
+    """Find the entity names from *data* that occur in *text*.
+
+    Builds a :class:`MentionMatcher` per call; :attr:`RelationshipStore.mentions`
+    keeps one for repeated scans.
+    """
+    return MentionMatcher.from_entities(data.get("entities", {})).scan(text)
+
+
+def entities_checked(mentions: Iterable[Mention]) -> list[str]:
+    """Entity IDs in *mentions*, in order of first mention, for a continuity report."""
+    seen: dict[str, None] = {}
+    for mention in mentions:
+        seen.update(dict.fromkeys(mention.entity_ids))
+    return list(seen)
+
+
+# ---------------------------------------------------------------------------
+# Snapshot cache
+# ---------------------------------------------------------------------------
+
+# Bump when RelationshipStore, TemporalIndex, ValidationState or
+# MentionMatcher change shape.
+_SNAPSHOT_VERSION = 6
+
+
+@dataclass
+class SnapshotStats:
+    """Snapshot cache counters for one relationships file."""
+
+    hits: int = 0
+    misses: int = 0
+    last: str = ""
+
+
+def snapshot_path(file_path: str | Path, cache_dir: str | Path | None = None) -> Path:
+    """Return the snapshot file caching *file_path*.
+
+    Snapshots live in ``.cache/`` next to the YAML file unless *cache_dir* is
+    given, and are named after the file and a hash of its resolved path.
+    """
+    path = Path(file_path).resolve()
+    directory = Path(cache_dir) if cache_dir is not None else path.parent / ".cache"
+    digest = hashlib.sha256(str(path).encode("utf-8")).hexdigest()[:16]
+    return directory / f"{path.stem}.{digest}.pickle"
+
+
+def _canon_files(directory: Path) -> list[Path]:
+    """The files a sharded canon is read from."""
+    return [directory / SHARD_HEADER, *_shard_files(directory)]
+
+
+def _file_fingerprint(file_path: Path) -> dict[str, Any]:
+    stat = file_path.stat()
+    if not file_path.is_dir():
+        return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    # A directory's own mtime moves when shards are added, removed or
+    # atomically replaced, so the newest mtime covers every file.
+    stats = [path.stat() for path in _canon_files(file_path)]
+    return {
+        "mtime_ns": max(stat.st_mtime_ns, *(s.st_mtime_ns for s in stats)),
+        "size": sum(s.st_size for s in stats),
+    }
+
+
+def _content_hash(file_path: Path) -> str:
+    if not file_path.is_dir():
+        return hashlib.sha256(file_path.read_bytes()).hexdigest()
+    digest = hashlib.sha256()
+    for path in _canon_files(file_path):
+        digest.update(path.name.encode("utf-8") + b"\0" + path.read_bytes())
+    return digest.hexdigest()
+
+
+def _read_snapshot(file_path: Path, cache_file: Path) -> RelationshipStore | None:
+    """Return the cached store if *cache_file* matches *file_path*, else None.
+
+    A matching mtime and size is trusted; otherwise the content hash decides.
+    When only the stat fields moved (a ``touch``), the snapshot is rewritten
+    with the new ones so later loads skip the hash again. Unreadable or
+    outdated snapshots count as missing.
+    """
+    try:
+        with open(cache_file, "rb") as f:
+            header = pickle.load(f)
+            if header.get("version") != _SNAPSHOT_VERSION:
+                return None
+            fingerprint = _file_fingerprint(file_path)
+            stale = (
+                header.get("mtime_ns") != fingerprint["mtime_ns"]
+                or header.get("size") != fingerprint["size"]
+            )
+            if stale and header.get("sha256") != _content_hash(file_path):
+                return None
+            store = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if not isinstance(store, RelationshipStore):
+        return None
+    if stale:
+        try:
+            _dump_snapshot(store, cache_file, {**header, **fingerprint})
+        except OSError:
+            pass
+    return store
+
+
+def _dump_snapshot(store: RelationshipStore, cache_file: Path, header: dict[str, Any]) -> None:
+    """Atomically write *header* and *store* to *cache_file*."""
+    fd, tmp_name = tempfile.mkstemp(dir=cache_file.parent, prefix=cache_file.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(store, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, cache_file)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def write_snapshot(
+    store: RelationshipStore,
+    file_path: str | Path,
+    cache_dir: str | Path | None = None,
+) -> Path:
+    """Snapshot *store*, built from the current contents of *file_path*.
+
+    The temporal index and validation state are built first so a cache hit
+    needs no further work. The snapshot is written to a temporary file and
+    renamed into place, so readers never see a partial file.
+    """
+    path = Path(file_path)
+    cache_file = snapshot_path(path, cache_dir)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+
+    store.temporal  # builds the interval tree
+    store.validate()
+    header = {
+        "version": _SNAPSHOT_VERSION,
+        **_file_fingerprint(path),
+        "sha256": _content_hash(path),
+    }
+    _dump_snapshot(store, cache_file, header)
+    return cache_file
+
+
+def _stats_path(cache_file: Path) -> Path:
+    return cache_file.with_suffix(".stats.json")
+
+
+def snapshot_stats(file_path: str | Path, cache_dir: str | Path | None = None) -> SnapshotStats:
+    """Return the cumulative snapshot cache counters for *file_path*."""
+    try:
+        raw = json.loads(_stats_path(snapshot_path(file_path, cache_dir)).read_text("utf-8"))
+        return SnapshotStats(**raw)
+    except (OSError, ValueError, TypeError):
+        return SnapshotStats()
+
+
+def _record_lookup(cache_file: Path, outcome: str) -> None:
+    """Count a cache hit or miss; counters are best effort."""
+    stats_file = _stats_path(cache_file)
+    try:
+        raw = json.loads(stats_file.read_text("utf-8"))
+        stats = SnapshotStats(**raw)
+    except (OSError, ValueError, TypeError):
+        stats = SnapshotStats()
+    if outcome == "hit":
+        stats.hits += 1
+    else:
+        stats.misses += 1
+    stats.last = outcome
+    try:
+        tmp_file = stats_file.with_name(f"{stats_file.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(asdict(stats)), encoding="utf-8")
+        os.replace(tmp_file, stats_file)
+    except OSError:
+        pass
+
+
+def load_store(
+    file_path: str | Path,
+    cache_dir: str | Path | None = None,
+    use_cache: bool = True,
+) -> RelationshipStore:
+    """Return a :class:`RelationshipStore` for *file_path*, via the snapshot cache.
+
+    On a hit the YAML is not parsed at all; on a miss the file is loaded,
+    indexed, validated and snapshotted for the next caller.
+    """
+    path = Path(file_path)
+    if not use_cache:
+        return RelationshipStore(load(path))
+
+    cache_file = snapshot_path(path, cache_dir)
+    store = _read_snapshot(path, cache_file)
+    if store is not None:
+        _record_lookup(cache_file, "hit")
+        return store
+
+    store = RelationshipStore(load(path))
+    try:
+        write_snapshot(store, path, cache_dir)
+    except OSError:
+        pass  # Read-only checkout: still answer from the parsed file.
+    _record_lookup(cache_file, "miss")
+    return store
+
+
+# ---------------------------------------------------------------------------
+# Query server
+# ---------------------------------------------------------------------------
+
+# Seconds a client waits on a server before falling back to a local load.
+_CLIENT_TIMEOUT = 30.0
+# Seconds without a write before a server re-snapshots the file it changed.
+_SNAPSHOT_IDLE = 2.0
+
+
+def socket_path(file_path: str | Path, cache_dir: str | Path | None = None) -> Path:
+    """Return the Unix socket a ``serve`` process for *file_path* listens on."""
+    return snapshot_path(file_path, cache_dir).with_suffix(".sock")
+
+
+class _ServedFile:
+    """A relationships file and its store, reloaded when the file changes.
+
+    Each :meth:`store` call stats the file and reloads (through the snapshot
+    cache) if its mtime or size moved, so a long-lived server always
+    answers from the current contents.
+    """
+
+    def __init__(self, file_path: str | Path, use_cache: bool = True) -> None:
+        self.path = Path(file_path)
+        self.use_cache = use_cache
+        self._store: RelationshipStore | None = None
+        self._fingerprint: dict[str, Any] | None = None
+        self._saved_at: float | None = None  # last save not yet snapshotted
+
+    def store(self) -> RelationshipStore:
+        fingerprint = _file_fingerprint(self.path)
+        if self._store is None or fingerprint != self._fingerprint:
+            self._store = load_store(self.path, use_cache=self.use_cache)
+            self._fingerprint = fingerprint
+        return self._store
+
+    def invalidate(self) -> None:
+        """Drop the in-memory store; the next request reloads it."""
+        self._store = None
+
+    def save(self, appended: int = 0) -> None:
+        """Write the store back to the file.
+
+        *appended* new relationships are appended to the file (see
+        :func:`save`) unless it changed on disk since it was loaded. The
+        snapshot is left for :meth:`flush_snapshot`: rewriting it here would
+        hash and pickle the whole file on every write.
+        """
+        assert self._store is not None
+        if _file_fingerprint(self.path) != self._fingerprint:
+            appended = 0
+        save(self._store.data, self.path, appended=appended)
+        self._fingerprint = _file_fingerprint(self.path)
+        self._saved_at = time.monotonic()
+
+    def flush_snapshot(self, idle: float = 0.0) -> None:
+        """Snapshot the store if it was saved at least *idle* seconds ago.
+
+        Does nothing when nothing was saved since the last snapshot, or when
+        the file changed on disk since (the store no longer matches it).
+        """
+        if self._saved_at is None or time.monotonic() - self._saved_at < idle:
+            return
+        self._saved_at = None
+        if not self.use_cache or self._store is None:
+            return
+        try:
+            if _file_fingerprint(self.path) == self._fingerprint:
+                write_snapshot(self._store, self.path)
+        except OSError:
+            pass
+
+
+def _handle_request(served: _ServedFile, request: dict[str, Any]) -> dict[str, Any]:
+    """Answer one query/matrix/diff/traversal/mentions/validate/add/import request.
+
+    Requests and responses are the JSON objects exchanged with ``serve``;
+    the local CLI goes through the same function. Failures are returned as
+    ``{"status": "error", "error": ...}`` rather than raised.
+    """
+    op = request.get("op")
+    try:
+        store = served.store()
+        if op == "query":
+            return {
+                "status": "ok",
+                "relationships": store.query(request["entity"], as_of=request.get("as_of")),
+            }
+        if op == "query_many":
+            return {
+                "status": "ok",
+                "results": store.query_many(request["entities"], as_of=request.get("as_of")),
+            }
+        if op == "matrix":
+            matrix = store.render_matrix(
+                as_of=request.get("as_of"), **request.get("options", {})
+            )
+            return {"status": "ok", "matrix": matrix}
+        if op == "diff":
+            changes = store.diff(request["from"], request["to"])
+            return {
+                "status": "ok",
+                "diff": {
+                    "from": changes.pos_from,
+                    "to": changes.pos_to,
+                    "added": changes.added,
+                    "ended": changes.ended,
+                    "superseded": changes.superseded,
+                },
+            }
+        if op == "neighbors":
+            return {
+                "status": "ok",
+                "entities": store.neighborhood(
+                    request["entity"], request.get("hops", 1), **request.get("options", {})
+                ),
+            }
+        if op == "path":
+            path = store.shortest_path(
+                request["from"], request["to"], **request.get("options", {})
+            )
+            return {"status": "ok", "path": path}
+        if op == "mentions":
+            return _handle_mentions(store, request)
+        if op == "validate":
+            errors = store.validate().errors
+            if served.path.is_dir():
+                errors = shard_errors(served.path) + errors
+            return {"status": "ok", "ok": not errors, "errors": errors}
+        if op == "add":
+            return _handle_add(served, store, request)
+        if op == "import":
+            return _handle_import(served, store, request)
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "error", "error": f"{type(e).__name__}: {e}"}
+    return {"status": "error", "error": f"Unknown op: {op!r}"}
+
+
+def _handle_mentions(store: RelationshipStore, request: dict[str, Any]) -> dict[str, Any]:
+    """Scan each file in ``request["paths"]`` for entity mentions."""
+    files = []
+    for path in request["paths"]:
+        try:
+            text = Path(path).read_text(encoding="utf-8")
+        except (OSError, UnicodeDecodeError) as e:
+            return {"status": "error", "error": f"{path}: {e}"}
+        mentions = store.find_mentions(text)
+        files.append({
+            "path": path,
+            "entities_checked": entities_checked(mentions),
+            "mentions": [asdict(m) for m in mentions],
+        })
+    return {"status": "ok", "files": files}
+
+
+def _handle_add(
+    served: _ServedFile,
+    store: RelationshipStore,
+    request: dict[str, Any],
+) -> dict[str, Any]:
+    before = store.validate()
+    try:
+        new_rel = store.add(
+            from_e=request["from"],
+            to_e=request["to"],
+            rel=request["rel"],
+            context=request["context"],
+            valid_from=request["valid_from"],
+            confidence=request["confidence"],
+            source=request["source"],
+            valid_to=request.get("valid_to"),
+        )
+    except VocabularyError as e:
+        return {"status": "error", "error": str(e)}
+    # Validate on write: only the new record is re-checked, and only
+    # errors it introduces block the write.
+    known = set(before.errors)
+    after = store.validate()
+    introduced = [err for err in after.errors if err not in known]
+    if introduced:
+        served.invalidate()  # The rejected record is still in the store.
+        return {
+            "status": "error",
+            "error": f"{new_rel['id']} fails validation; file not written:",
+            "errors": introduced,
+        }
+    served.save(appended=1)
+    return {"status": "ok", "relationship": new_rel}
+
+
+def _handle_import(
+    served: _ServedFile,
+    store: RelationshipStore,
+    request: dict[str, Any],
+) -> dict[str, Any]:
+    """Import the request's rows; all accepted rows are written in one append."""
+    before = store.validate()
+    report = store.import_records(request["rows"])
+    rejected = sorted(
+        [*map(tuple, request.get("rejected", ())), *report.rejected], key=lambda r: r[0]
+    )
+    if not report.accepted:
+        return {"status": "ok", "accepted": [], "rejected": rejected}
+    known = set(before.errors)
+    introduced = [err for err in store.validate().errors if err not in known]
+    if introduced:
+        served.invalidate()
+        return {
+            "status": "error",
+            "error": f"{len(report.accepted)} imported records fail validation; file not written:",
+            "errors": introduced,
+        }
+    served.save(appended=len(report.accepted))
+    return {
+        "status": "ok",
+        "accepted": [r["id"] for r in report.accepted],
+        "rejected": rejected,
+    }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Reads JSON-line requests and writes one JSON-line response for each."""
+
+    server: _QueryServer
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response: dict[str, Any] = {"status": "error", "error": f"Bad request: {e}"}
+            else:
+                with self.server.lock:
+                    response = _handle_request(self.server.served, request)
+            # default=str: YAML may hold dates, which JSON cannot encode.
+            self.wfile.write(json.dumps(response, default=str).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+
+    class _QueryServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path: Path, served: _ServedFile) -> None:
+            self.served = served
+            self.lock = threading.Lock()
+            super().__init__(str(path), _RequestHandler)
+
+        def service_actions(self) -> None:
+            # Called between polls: re-snapshot once writes have gone quiet.
+            with self.lock:
+                self.served.flush_snapshot(idle=_SNAPSHOT_IDLE)
+
+
+def serve(
+    file_path: str | Path,
+    sock: str | Path | None = None,
+    use_cache: bool = True,
+) -> int:
+    """Serve requests for *file_path* on a Unix socket until interrupted.
+
+    The file is loaded once; later changes on disk are picked up before the
+    next request. Requests are answered one at a time. After writes, the
+    snapshot is refreshed once the server has been idle for a moment, and
+    on shutdown.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        print("Error: serve needs Unix domain sockets.", file=sys.stderr)
+        return 1
+
+    path = Path(sock) if sock is not None else socket_path(file_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        if _request(path, {"op": "validate"}, timeout=1.0) is not None:
+            print(f"Error: a server is already listening on {path}", file=sys.stderr)
+            return 1
+        path.unlink()  # Left behind by a server that did not shut down cleanly.
+
+    served = _ServedFile(file_path, use_cache=use_cache)
+    served.store()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server = _QueryServer(path, served)
+    print(f"Serving {file_path} on {path}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+        with server.lock:
+            served.flush_snapshot()
+    return 0
+
+
+def _request(
+    path: Path,
+    request: dict[str, Any],
+    timeout: float = _CLIENT_TIMEOUT,
+) -> dict[str, Any] | None:
+    """Send *request* to the server on *path*; None if none is reachable.
+
+    A missing, truncated or malformed reply (say from a server killed while
+    writing it) also returns None, so the caller falls back to a local load.
+    """
+    if not hasattr(socket, "AF_UNIX") or not path.exists():
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(timeout)
+            conn.connect(str(path))
+            conn.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with conn.makefile("rb") as reader:
+                line = reader.readline()
+    except OSError:
+        return None
+    try:
+        reply = json.loads(line) if line else None
+    except ValueError:
+        return None
+    return reply if isinstance(reply, dict) else None
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="relationship_query",
+        description="Query and mutate a YAML entity-relationship file.",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Run semantic validation on the file and exit.",
+    )
+    parser.add_argument(
+        "--file",
+        type=str,
+        help="Path to the relationships YAML file.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Parse the YAML file directly, bypassing the snapshot cache.",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print snapshot cache hit/miss counters to stderr.",
+    )
+    parser.add_argument(
+        "--no-server",
+        action="store_true",
+        help="Answer locally even if a serve process is running for the file.",
+    )
+    parser.add_argument(
+        "--db",
+        action="store_true",
+        help="Answer query, render-matrix, diff and --validate from the SQLite index "
+        "(see relationship_db.py), syncing it with the file first.",
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    # -- query -------------------------------------------------------------
+    q = subparsers.add_parser("query", help="Query relationships for an entity.")
+    target = q.add_mutually_exclusive_group(required=True)
+    target.add_argument("--entity", help="Entity ID or alias to search for.")
+    target.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="File of entity IDs/aliases, one per line ('-' for stdin); prints JSON.",
+    )
+    q.add_argument("--as-of", default=None, help="Temporal position filter (Act1/Ch2).")
+    q.add_argument("--file", required=True, dest="query_file", help="Relationships YAML file.")
+
+    # -- add ---------------------------------------------------------------
+    a = subparsers.add_parser("add", help="Add a new relationship.")
     a.add_argument("--from", required=True, dest="from_e", help="Source entity ID.")
     a.add_argument("--to", required=True, dest="to_e", help="Target entity ID.")
     a.add_argument("--rel", required=True, help="Relationship term.")
     a.add_argument("--context", required=True, help="Narrative context.")
     a.add_argument("--valid-from", required=True, help="Start position.")
-    a.add_argument("--confidence", required=True, choices=["low", "medium", "high"])
+    a.add_argument("--confidence", required=True, choices=CONFIDENCE_LEVELS)
     a.add_argument("--source", required=True, help="Canon source reference.")
     a.add_argument("--valid-to", default=None, help="End position (null if omitted).")
     a.add_argument("--file", required=True, dest="add_file", help="Relationships YAML file.")
 
+    # -- import ------------------------------------------------------------
+    im = subparsers.add_parser("import", help="Add relationships in bulk from JSONL or CSV.")
+    im.add_argument("--input", required=True, help="JSONL or CSV records ('-' for stdin).")
+    im.add_argument(
+        "--format", choices=IMPORT_FORMATS, default=None, dest="import_format",
+        help="Input format (default: from the --input extension).",
+    )
+    im.add_argument("--file", required=True, dest="import_file", help="Relationships YAML file.")
+
     # -- render-matrix -----------------------------------------------------
     rm = subparsers.add_parser("render-matrix", help="Render a markdown adjacency matrix.")
     rm.add_argument("--as-of", default=None, help="Temporal position filter.")
+    rm.add_argument(
+        "--sparse", action="store_true", help="Only rows/columns that have relationships."
+    )
+    rm.add_argument(
+        "--edges", action="store_true", help="Render an edge list instead of a matrix."
+    )
+    rm.add_argument(
+        "--type", action="append", dest="types", default=None,
+        help="Only entities of this type (repeatable).",
+    )
+    rm.add_argument("--entities", default=None, help="Comma-separated entity IDs to include.")
+    rm.add_argument(
+        "--page-size", type=int, default=None,
+        help="Split into N x N tiles (or pages of N edges).",
+    )
+    rm.add_argument("--page", type=int, default=None, help="Only this 1-based tile or page.")
     rm.add_argument("--file", required=True, dest="matrix_file", help="Relationships YAML file.")
 
+    # -- diff --------------------------------------------------------------
+    d = subparsers.add_parser("diff", help="Relationship changes between two positions (JSON).")
+    d.add_argument("--from", required=True, dest="diff_from", help="Earlier position.")
+    d.add_argument("--to", required=True, dest="diff_to", help="Later position.")
+    d.add_argument("--file", required=True, dest="diff_file", help="Relationships YAML file.")
+
+    # -- neighbors / path --------------------------------------------------
+    nb = subparsers.add_parser("neighbors", help="Entities within N hops of an entity (JSON).")
+    nb.add_argument("--entity", required=True, help="Entity ID or alias to start from.")
+    nb.add_argument("--hops", type=int, default=1, help="Maximum distance (default 1).")
+    nb.add_argument("--file", required=True, dest="neighbors_file", help="Relationships YAML file.")
+    pa = subparsers.add_parser("path", help="Shortest relationship chain between entities (JSON).")
+    pa.add_argument("--from", required=True, dest="path_from", help="Start entity ID or alias.")
+    pa.add_argument("--to", required=True, dest="path_to", help="End entity ID or alias.")
+    pa.add_argument("--file", required=True, dest="path_file", help="Relationships YAML file.")
+    for traversal in (nb, pa):
+        traversal.add_argument("--as-of", default=None, help="Temporal position filter.")
+        traversal.add_argument(
+            "--category", action="append", dest="categories", default=None,
+            help="Only follow rel terms in this rel_vocabulary category (repeatable).",
+        )
+        traversal.add_argument(
+            "--direction", choices=DIRECTIONS, default="both",
+            help="Follow edges from -> to ('out'), to -> from ('in') or both (default).",
+        )
+
+    # -- mentions ----------------------------------------------------------
+    mn = subparsers.add_parser("mentions", help="Entity mentions in scene or chapter files (JSON).")
+    mn.add_argument(
+        "--input", required=True, nargs="+", dest="mention_inputs",
+        help="Files to scan; directories are searched for *.md files.",
+    )
+    mn.add_argument("--file", required=True, dest="mentions_file", help="Relationships YAML file.")
+
+    # -- export ------------------------------------------------------------
+    ex = subparsers.add_parser("export", help="Stream the relationship graph to a file.")
+    ex.add_argument("--format", required=True, choices=EXPORT_FORMATS, dest="export_format")
+    ex.add_argument("--as-of", default=None, help="Temporal position filter.")
+    ex.add_argument("--output", default="-", help="Output path ('-' for stdout, the default).")
+    ex.add_argument("--file", required=True, dest="export_file", help="Relationships YAML file.")
+
+    # -- shard -------------------------------------------------------------
+    sh = subparsers.add_parser("shard", help="Split a relationships file into per-act shards.")
+    sh.add_argument("--file", required=True, dest="shard_file", help="Relationships YAML file.")
+    sh.add_argument("--output", required=True, help="Directory for header.yaml and act-N.yaml.")
+
+    # -- serve -------------------------------------------------------------
+    sv = subparsers.add_parser("serve", help="Answer CLI requests from a long-lived process.")
+    sv.add_argument("--file", required=True, dest="serve_file", help="Relationships YAML file.")
+    sv.add_argument("--socket", default=None, help="Socket path (default: next to the snapshot).")
+
     return parser
 
 
 def main(argv: list[str] | None = None) -> int:
-    """Entry point for the CLI."""
+    """Entry point for the CLI.
+
+    Commands are answered by a running ``serve`` process for the file when
+    there is one, and locally otherwise.
+    """
     parser = _build_parser()
     args = parser.parse_args(argv)
+    if args.validate and not args.file:
+        parser.error("--validate requires --file")
+    if args.command == "serve" and not args.validate:
+        return serve(args.serve_file, args.socket, use_cache=not args.no_cache)
+    if args.command == "export" and not args.validate:
+        return _export_command(args)
+    if args.command == "shard" and not args.validate:
+        data = load(args.shard_file)
+        save_shards(data, args.output)
+        shards = len(_group_by_shard(data.get("relationships") or []))
+        print(f"Wrote {len(data.get('relationships') or [])} relationships "
+              f"to {shards} shards in {args.output}")
+        return 0
+
+    try:
+        request = _request_from_args(args)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if request is None:
+        parser.print_help()
+        return 0
+    file_path = request.pop("file")
+
+    response = None
+    if args.db:
+        response = _db_request(file_path, request)
+    elif not args.no_server:
+        response = _request(socket_path(file_path), request)
+    if response is None:
+        served = _ServedFile(file_path, use_cache=not args.no_cache)
+        response = _handle_request(served, request)
+        served.flush_snapshot()
+    try:
+        return _print_response(request, response)
+    finally:
+        if args.stats and not args.no_cache:
+            stats = snapshot_stats(file_path)
+            print(
+                f"Snapshot cache: {stats.last} "
+                f"(hits={stats.hits}, misses={stats.misses}) {snapshot_path(file_path)}",
+                file=sys.stderr,
+            )
+
+
+# Requests ``--db`` can answer; the rest need the in-memory store.
+_DB_OPS = ("query", "query_many", "matrix", "diff", "validate")
+
+
+class _ServedDB:
+    """Presents a ``RelationshipDB`` to :func:`_handle_request` like a :class:`_ServedFile`."""
+
+    def __init__(self, db: Any) -> None:
+        self.db = db
+        self.path = db.source
+
+    def store(self) -> Any:
+        return self.db
+
+
+def _db_request(file_path: str, request: dict[str, Any]) -> dict[str, Any]:
+    """Answer *request* from the SQLite index for *file_path*."""
+    # Imported here: relationship_db builds on this module.
+    from relationship_db import RelationshipDB
+
+    if request["op"] not in _DB_OPS:
+        return {
+            "status": "error",
+            "error": "--db only answers query, render-matrix, diff and --validate",
+        }
+    db = RelationshipDB.for_file(file_path)
+    try:
+        return _handle_request(_ServedDB(db), request)
+    finally:
+        db.close()
+
+
+def _export_command(args: argparse.Namespace) -> int:
+    """Run ``export`` locally, streaming to ``--output``.
+
+    Exports bypass the query server: its responses are single JSON lines,
+    which would mean rendering the whole graph in memory.
+    """
+    try:
+        store = _ServedFile(args.export_file, use_cache=not args.no_cache).store()
+        if args.output == "-":
+            store.export(sys.stdout, args.export_format, as_of=args.as_of)
+        else:
+            with open(args.output, "w", encoding="utf-8", newline="") as out:
+                store.export(out, args.export_format, as_of=args.as_of)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
 
-    # -- validate mode (top-level flag) ------------------------------------
+def _request_from_args(args: argparse.Namespace) -> dict[str, Any] | None:
+    """Return the server request for the parsed command, plus its ``file``."""
     if args.validate:
-        file_path = args.file
-        if not file_path:
-            parser.error("--validate requires --file")
-        data = load(file_path)
-        result = validate_relationships(data)
-        if result.ok:
+        return {"op": "validate", "file": args.file}
+    if args.command == "query" and args.batch is not None:
+        return {
+            "op": "query_many",
+            "file": args.query_file,
+            "entities": _read_batch(args.batch),
+            "as_of": args.as_of,
+        }
+    if args.command == "query":
+        return {"op": "query", "file": args.query_file, "entity": args.entity, "as_of": args.as_of}
+    if args.command == "render-matrix":
+        options: dict[str, Any] = {
+            "sparse": args.sparse,
+            "edges": args.edges,
+            "types": args.types,
+            "ids": args.entities.split(",") if args.entities else None,
+            "page_size": args.page_size,
+            "page": args.page,
+        }
+        return {"op": "matrix", "file": args.matrix_file, "as_of": args.as_of, "options": options}
+    if args.command == "diff":
+        return {"op": "diff", "file": args.diff_file, "from": args.diff_from, "to": args.diff_to}
+    if args.command in ("neighbors", "path"):
+        options = {
+            "as_of": args.as_of,
+            "categories": args.categories,
+            "direction": args.direction,
+        }
+        if args.command == "neighbors":
+            return {
+                "op": "neighbors",
+                "file": args.neighbors_file,
+                "entity": args.entity,
+                "hops": args.hops,
+                "options": options,
+            }
+        return {
+            "op": "path",
+            "file": args.path_file,
+            "from": args.path_from,
+            "to": args.path_to,
+            "options": options,
+        }
+    if args.command == "mentions":
+        return {
+            "op": "mentions",
+            "file": args.mentions_file,
+            "paths": _mention_inputs(args.mention_inputs),
+        }
+    if args.command == "import":
+        rows, rejected = _read_import(args.input, args.import_format)
+        return {"op": "import", "file": args.import_file, "rows": rows, "rejected": rejected}
+    if args.command == "add":
+        return {
+            "op": "add",
+            "file": args.add_file,
+            "from": args.from_e,
+            "to": args.to_e,
+            "rel": args.rel,
+            "context": args.context,
+            "valid_from": args.valid_from,
+            "confidence": args.confidence,
+            "source": args.source,
+            "valid_to": args.valid_to,
+        }
+    return None
+
+
+def _read_batch(batch: str) -> list[str]:
+    """Return the non-blank, stripped lines of *batch* (a path, or '-' for stdin)."""
+    if batch == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        lines = Path(batch).read_text(encoding="utf-8").splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+def _mention_inputs(paths: list[str]) -> list[str]:
+    """Expand ``mentions --input`` into absolute file paths, for the server.
+
+    Raises:
+        ValueError: If a path does not exist.
+    """
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(path.rglob("*.md")))
+        elif path.exists():
+            files.append(path)
+        else:
+            raise ValueError(f"No such file or directory: {path}")
+    return [str(f.resolve()) for f in files]
+
+
+def _read_import(
+    path: str,
+    fmt: str | None,
+) -> tuple[list[tuple[int, dict[str, Any]]], list[tuple[int, str]]]:
+    """Parse the ``import --input`` file (or stdin) with :func:`read_import_rows`."""
+    if path == "-":
+        if fmt is None:
+            raise ValueError("--format is required when reading from stdin")
+        return read_import_rows(sys.stdin, fmt)
+    with open(path, encoding="utf-8", newline="") as f:
+        return read_import_rows(f, import_format(path, fmt))
+
+
+def _print_response(request: dict[str, Any], response: dict[str, Any]) -> int:
+    """Print *response* as the CLI output for *request*; return the exit code."""
+    if response.get("status") != "ok":
+        print(f"Error: {response.get('error')}", file=sys.stderr)
+        for err in response.get("errors", []):
+            print(f"  {err}", file=sys.stderr)
+        return 1
+
+    op = request["op"]
+    if op == "validate":
+        if response["ok"]:
             print("Validation passed.")
             return 0
         else:
             print("Validation failed:", file=sys.stderr)
-            for err in result.errors:
+            for err in response["errors"]:
                 print(f"  {err}", file=sys.stderr)
             return 1
 
-    # -- subcommands -------------------------------------------------------
-    if args.command == "query":
-        data = load(args.query_file)
-        results = query(data, args.entity, as_of=args.as_of)
+    if op == "query":
+        results = response["relationships"]
         if not results:
             print("No matching relationships found.")
             return 0
         for r in results:
-            print(yaml.dump(r, default_flow_style=False, sort_keys=False).rstrip())
+            print(safe_dump(r, default_flow_style=False, sort_keys=False).rstrip())
             print("---")
         return 0
 
-    if args.command == "add":
-        data = load(args.add_file)
-        try:
-            new_rel = add(
-                data,
-                from_e=args.from_e,
-                to_e=args.to_e,
-                rel=args.rel,
-                context=args.context,
-                valid_from=args.valid_from,
-                confidence=args.confidence,
-                source=args.source,
-                valid_to=args.valid_to,
-            )
-        except VocabularyError as e:
-            print(f"Error: {e}", file=sys.stderr)
+    if op == "query_many":
+        print(json.dumps(response["results"], indent=2, default=str))
+        return 0
+
+    if op == "diff":
+        print(json.dumps(response["diff"], indent=2, default=str))
+        return 0
+
+    if op == "neighbors":
+        print(json.dumps(response["entities"], indent=2))
+        return 0
+
+    if op == "mentions":
+        print(json.dumps(response["files"], indent=2))
+        return 0
+
+    if op == "path":
+        path = {"from": request["from"], "to": request["to"], "path": response["path"]}
+        print(json.dumps(path, indent=2, default=str))
+        return 0
+
+    if op == "import":
+        accepted = response["accepted"]
+        print(f"Imported {len(accepted)} relationships" + (":" if accepted else "."))
+        for rid in accepted:
+            print(f"  {rid}")
+        if response["rejected"]:
+            rows = len({line for line, _ in response["rejected"]})
+            print(f"Rejected {rows} rows:", file=sys.stderr)
+            for line, err in response["rejected"]:
+                print(f"  line {line}: {err}", file=sys.stderr)
             return 1
-        save(data, args.add_file)
-        print(f"Added relationship {new_rel['id']}:")
-        print(yaml.dump(new_rel, default_flow_style=False, sort_keys=False).rstrip())
         return 0
 
-    if args.command == "render-matrix":
-        data = load(args.matrix_file)
-        print(render_matrix(data, as_of=args.as_of))
+    if op == "add":
+        new_rel = response["relationship"]
+        print(f"Added relationship {new_rel['id']}:")
+        print(safe_dump(new_rel, default_flow_style=False, sort_keys=False).rstrip())
         return 0
 
-    parser.print_help()
+    print(response["matrix"])
     return 0
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    # Run through the importable module so snapshots pickle
+    # ``relationship_query`` classes rather than ``__main__`` ones.
+    import relationship_query
+
+    sys.exit(relationship_query.main())
@@ -16,7 +16,8 @@ from dataclasses import dataclass, field
 from pathlib import Path
 
 import jsonschema
-import yaml
+
+from yaml_io import safe_load
 
 
 SCHEMAS_DIR = Path(__file__).resolve().parent.parent / "schemas"
@@ -31,7 +32,7 @@ class ValidationResult:
 def load_schema(schema_path: Path) -> dict:
     """Load and return a YAML schema file."""
     with open(schema_path) as f:
-        return yaml.safe_load(f)
+        return safe_load(f)
 
 
 def validate(schema_name: str, data: dict, schemas_dir: Path = SCHEMAS_DIR) -> ValidationResult:
@@ -70,7 +71,7 @@ def validate_file(schema_path: Path, data_path: Path) -> ValidationResult:
     """Validate a YAML data file against a schema file."""
     schema = load_schema(schema_path)
     with open(data_path) as f:
-        data = yaml.safe_load(f)
+        data = safe_load(f)
     return validate_against_schema(schema, data)
 
 
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""Shared YAML loading and dumping for the pipeline scripts.
+
+Uses libyaml's ``CSafeLoader``/``CSafeDumper`` when PyYAML was built with
+libyaml, and the pure-Python ``SafeLoader``/``SafeDumper`` otherwise. Both
+accept and produce the same documents for the plain data the pipeline
+stores; the C implementations are several times faster on large files such
+as ``canon/relationships.yaml``.
+"""
+
+from __future__ import annotations
+
+from typing import IO, Any
+
+import yaml
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+
+    HAS_LIBYAML = True
+except ImportError:
+    from yaml import SafeDumper, SafeLoader  # type: ignore[assignment]
+
+    HAS_LIBYAML = False
+
+
+def safe_load(stream: str | bytes | IO[Any]) -> Any:
+    """Parse a YAML document, like :func:`yaml.safe_load`."""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def safe_dump(data: Any, stream: IO[str] | None = None, **kwargs: Any) -> str | None:
+    """Serialize *data*, like :func:`yaml.safe_dump`.
+
+    Returns the document as a string when *stream* is None.
+    """
+    return yaml.dump(data, stream, Dumper=SafeDumper, **kwargs)
@@ -2,7 +2,9 @@
 
 from __future__ import annotations
 
+import random
 from pathlib import Path
+from typing import Any, Callable
 
 import pytest
 
@@ -83,3 +85,108 @@ def canon_fixture_tree(tmp_path: Path) -> Path:
     (samples / "sample-01.md").write_text("# Style Sample 1\nStub sample.\n")
 
     return tmp_path
+
+
+# ---------------------------------------------------------------------------
+# Synthetic relationship data
+# ---------------------------------------------------------------------------
+
+_VOCABULARY = {
+    "positive": ["trusts", "loves", "respects", "allies_with", "protects", "depends_on"],
+    "negative": ["distrusts", "fears", "hates", "suspects", "resents"],
+    "neutral": ["knows", "employs", "related_to", "located_at", "possesses"],
+    "causal": ["caused", "prevented", "enabled", "discovered"],
+}
+
+
+def _synthetic_data(
+    n_entities: int,
+    n_relationships: int,
+    *,
+    acts: int = 3,
+    chapters: int = 12,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """Build a deterministic relationships dict with the canonical layout.
+
+    Entity IDs are ``e0000``, ``e0001``, ...; each has two aliases. Roughly a
+    third of the relationships carry a ``valid_to`` later than ``valid_from``.
+    """
+    rng = random.Random(seed)
+    terms = [t for category in _VOCABULARY.values() for t in category]
+
+    entities: dict[str, Any] = {}
+    for i in range(n_entities):
+        eid = f"e{i:04d}"
+        entities[eid] = {
+            "type": "character" if i % 5 else "location",
+            "aliases": [f"E{i}", f"entity {i}"],
+            "introduced": "L1/concept",
+        }
+    ids = list(entities)
+
+    relationships: list[dict[str, Any]] = []
+    for n in range(1, n_relationships + 1):
+        start = (rng.randint(1, acts), rng.randint(1, chapters))
+        rec: dict[str, Any] = {
+            "id": f"rel_{n:03d}",
+            "from": rng.choice(ids),
+            "to": rng.choice(ids),
+            "rel": rng.choice(terms),
+            "context": f"synthetic relationship {n}",
+            "valid_from": f"Act{start[0]}/Ch{start[1]}",
+            "valid_to": None,
+            "confidence": "medium",
+            "source": f"canon/acts/act-{start[0]}/ch{start[1]}-outline.md#L{n}",
+            "supersedes": None,
+            "superseded_by": None,
+        }
+        if rng.random() < 0.33:
+            end_act = rng.randint(start[0], acts)
+            end_ch = rng.randint(start[1] + 1 if end_act == start[0] else 1, chapters + 1)
+            rec["valid_to"] = f"Act{end_act}/Ch{end_ch}"
+        relationships.append(rec)
+
+    return {"rel_vocabulary": _VOCABULARY, "entities": entities, "relationships": relationships}
+
+
+def _supersession_chains(n_relationships: int, chain_length: int) -> dict[str, Any]:
+    """Build a valid relationships dict made of long revision histories.
+
+    Every chain is one ``(from, to, rel)`` triple re-asserted ``chain_length``
+    times: each record supersedes the previous one and is valid for one
+    chapter, so the file validates cleanly.
+    """
+    entities: dict[str, Any] = {}
+    relationships: list[dict[str, Any]] = []
+    for n in range(n_relationships):
+        chain, link = divmod(n, chain_length)
+        eid = f"e{chain:04d}"
+        entities.setdefault(eid, {"type": "character", "aliases": [], "introduced": "L1/concept"})
+        last = link == chain_length - 1 or n == n_relationships - 1
+        relationships.append({
+            "id": f"rel_{n + 1:03d}",
+            "from": eid,
+            "to": eid,
+            "rel": "trusts",
+            "context": f"revision {link} of chain {chain}",
+            "valid_from": f"Act1/Ch{link + 1}",
+            "valid_to": None if last else f"Act1/Ch{link + 2}",
+            "confidence": "medium",
+            "source": f"canon/acts/act-1/ch{link + 1}-outline.md",
+            "supersedes": f"rel_{n:03d}" if link else None,
+            "superseded_by": None if last else f"rel_{n + 2:03d}",
+        })
+    return {"rel_vocabulary": _VOCABULARY, "entities": entities, "relationships": relationships}
+
+
+@pytest.fixture
+def synthetic_data() -> Callable[..., dict[str, Any]]:
+    """Return a builder for deterministic relationships dicts of any size."""
+    return _synthetic_data
+
+
+@pytest.fixture
+def supersession_chains() -> Callable[[int, int], dict[str, Any]]:
+    """Return a builder for valid relationships dicts of long revision chains."""
+    return _supersession_chains
@@ -5,6 +5,7 @@ Tests the manifest generation rules at each pipeline level (L1-L5).
 
 from __future__ import annotations
 
+import os
 import sys
 from pathlib import Path
 
@@ -13,10 +14,22 @@ import pytest
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
 
 from context_loader import (
+    TOKEN_COUNTERS,
+    CanonScan,
+    TokenCache,
+    count_tokens,
+    estimate_tokens,
+    file_tokens,
     get_manifest,
     get_manifest_hash,
     get_manifest_with_meta,
     get_reproducibility_bundle,
+    main,
+    manifest_hash,
+    pack_manifest,
+    parse_sections,
+    read_entry,
+    slice_manifest,
 )
 
 
@@ -166,6 +179,70 @@ def test_manifest_includes_token_estimate(canon_fixture_tree):
     assert manifest["total_estimated_tokens"] > 0
 
 
+def test_manifest_with_meta_scans_each_directory_once(canon_fixture_tree, monkeypatch):
+    """The list, estimate and hash come from one scandir per directory."""
+    scanned = []
+    real_scandir = os.scandir
+
+    def counting_scandir(path):
+        scanned.append(Path(path))
+        return real_scandir(path)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    state = make_state(level="L5", act=1, chapter=1, scene=1)
+    manifest = get_manifest_with_meta(state, root=canon_fixture_tree)
+    assert len(scanned) == len(set(scanned))
+    monkeypatch.undo()
+
+    assert manifest["files"] == get_manifest(state, root=canon_fixture_tree)
+    assert manifest["manifest_hash"] == get_manifest_hash(state, root=canon_fixture_tree)
+    texts = [(canon_fixture_tree / f).read_text() for f in manifest["files"]]
+    assert manifest["total_estimated_tokens"] == sum(map(count_tokens, texts))
+
+
+def test_canon_scan_ignores_directories_and_missing_paths(canon_fixture_tree):
+    """CanonScan lists only regular files and treats missing paths as empty."""
+    (canon_fixture_tree / "canon" / "characters" / "extras.md").mkdir()
+    scan = CanonScan(canon_fixture_tree)
+    assert scan.glob("canon/characters", "*.md") == ["canon/characters/marcus.md"]
+    assert not scan.exists("canon/acts/act-1")
+    assert scan.glob("canon/acts/act-9", "*.md") == []
+    assert estimate_tokens(canon_fixture_tree, ["canon/missing.md"], scan) == 0
+
+
+def test_manifest_hash_covers_file_contents(canon_fixture_tree):
+    """Editing a loaded file changes the hash; touching it does not."""
+    state = make_state(level="L3", act=1)
+    before = get_manifest_hash(state, root=canon_fixture_tree)
+    arc = canon_fixture_tree / "canon" / "story-arc.md"
+    arc.write_text(arc.read_text())
+    os.utime(arc, ns=(1, 1))
+    assert get_manifest_hash(state, root=canon_fixture_tree) == before
+    arc.write_text("# Story Arc\nRevised.\n")
+    assert get_manifest_hash(state, root=canon_fixture_tree) != before
+    files = get_manifest(state, root=canon_fixture_tree)
+    assert manifest_hash(canon_fixture_tree, files[::-1]) != manifest_hash(canon_fixture_tree, files)
+
+
+def test_manifest_hash_rehashes_only_changed_files(canon_fixture_tree, monkeypatch):
+    """A repeated hash reads no files; after an edit it reads only that file."""
+    state = make_state(level="L5", act=1, chapter=1, scene=1)
+    get_manifest_hash(state, root=canon_fixture_tree)
+    read = []
+    real_read_bytes = Path.read_bytes
+
+    def counting_read_bytes(path):
+        read.append(path.name)
+        return real_read_bytes(path)
+
+    monkeypatch.setattr(Path, "read_bytes", counting_read_bytes)
+    get_manifest_hash(state, root=canon_fixture_tree)
+    assert read == []
+    (canon_fixture_tree / "canon" / "characters" / "marcus.md").write_text("# Marcus\nScarred.\n")
+    get_manifest_hash(state, root=canon_fixture_tree)
+    assert read == ["marcus.md"]
+
+
 def test_reproducibility_bundle_includes_all_fields(canon_fixture_tree):
     """Reproducibility bundle should have manifest_hash, canon_version, agent_config."""
     state = make_state(level="L3", act=1)
@@ -176,6 +253,281 @@ def test_reproducibility_bundle_includes_all_fields(canon_fixture_tree):
     assert bundle["canon_version"] == 1
 
 
+# ---------------------------------------------------------------------------
+# Token counting
+# ---------------------------------------------------------------------------
+
+
+def test_count_tokens_prices_pieces_not_bytes():
+    """count_tokens() prices words, punctuation and CJK, not bytes."""
+    assert count_tokens("") == 0
+    assert count_tokens("The soldier waits.") == 4
+    # A markdown table row is all one-character pieces: 9 bytes, 5 tokens.
+    assert count_tokens("| a | b |") == 5
+    # CJK is about a token per character: 15 bytes, 5 tokens.
+    assert count_tokens("兵士は待つ") == 5
+    assert count_tokens("key: 12345") == 4
+
+
+def test_token_cache_recounts_only_changed_files(canon_fixture_tree, monkeypatch):
+    """The token cache recounts only files whose contents changed."""
+    counted = []
+
+    def counter(text):
+        counted.append(text)
+        return len(text)
+
+    monkeypatch.setitem(TOKEN_COUNTERS, "test", lambda: counter)
+    files = ["canon/story-arc.md", "canon/timeline.md"]
+
+    def estimate():
+        return estimate_tokens(canon_fixture_tree, files, CanonScan(canon_fixture_tree, "test"))
+
+    first = estimate()
+    assert len(counted) == 2
+    assert estimate() == first
+    assert len(counted) == 2
+    assert (canon_fixture_tree / ".cache" / "context-tokens.json").exists()
+
+    (canon_fixture_tree / "canon" / "timeline.md").write_text("# Canon Timeline\nLonger now.\n")
+    assert estimate() == first + len("Longer now.") - len("Stub timeline.")
+    assert counted[2:] == ["# Canon Timeline\nLonger now.\n"]
+
+
+def test_cli_no_cache_writes_no_cache_files(cast_tree, capsys):
+    """--no-cache packs and slices without creating any .cache/ file."""
+    state_file = cast_tree / "state.yaml"
+    state_file.write_text("position: {level: L5, act: 1, chapter: 1, scene: 1}\n")
+    assert main(["--state", str(state_file), "--root", str(cast_tree), "--no-cache"]) == 0
+    assert main(["--state", str(state_file), "--root", str(cast_tree), "--no-cache",
+                 "--sections"]) == 0
+    assert "Manifest hash:" in capsys.readouterr().out
+    assert not list(cast_tree.rglob(".cache"))
+
+
+def test_token_cache_shares_counts_by_content_and_tokenizer(canon_fixture_tree):
+    """Files with the same contents share a digest; unknown tokenizers raise."""
+    (canon_fixture_tree / "canon" / "copy.md").write_bytes(
+        (canon_fixture_tree / "canon" / "story-arc.md").read_bytes()
+    )
+    scan = CanonScan(canon_fixture_tree)
+    cache = scan.token_cache
+    digests = {f: cache.digest(f, scan.stat(f)) for f in ("canon/story-arc.md", "canon/copy.md")}
+    assert len(set(digests.values())) == 1
+    with pytest.raises(ValueError, match="Unknown tokenizer"):
+        TokenCache(canon_fixture_tree, "nope")
+
+
+# ---------------------------------------------------------------------------
+# Section slicing
+# ---------------------------------------------------------------------------
+
+
+def test_parse_sections_nests_and_skips_code_fences():
+    """Sections nest by level, skip fenced code and dedupe slugs."""
+    content = (
+        "Preamble.\n"
+        "# Über Title\n"
+        "## Part\n"
+        "text\n"
+        "```\n"
+        "# not a heading\n"
+        "```\n"
+        "### Detail ###\n"
+        "## Part\n"
+    ).encode()
+    sections = parse_sections(content)
+    assert [(s.slug, s.level) for s in sections] == [
+        ("über-title", 1), ("part", 2), ("detail", 3), ("part-1", 2),
+    ]
+    title, part, detail, part1 = sections
+    assert content[title.start:title.end].startswith("# Über Title".encode())
+    assert title.end == len(content)
+    assert part.end == part1.start
+    assert content[detail.start:detail.end] == b"### Detail ###\n"
+
+
+@pytest.fixture
+def sliced_tree(canon_fixture_tree):
+    """Fixture tree whose Act 1 outline lists chapters and whose Ch1 names a cast."""
+    root = canon_fixture_tree
+    (root / "canon" / "acts" / "act-1-outline.md").write_text(
+        "# Act 1 Outline\n\n"
+        "## Act Overview\nThe hook.\n\n"
+        "## Chapter List\n\n"
+        "### Chapter 1: The Windmill\n- **Key Characters**: Marcus, Lenard\n\n"
+        "### Chapter 2: The Crater\n- **Key Characters**: Elena\n\n"
+        "## Continuity Touchpoints\n- Marcus distrusts Elena.\n"
+    )
+    (root / "canon" / "acts" / "act-1" / "ch1-outline.md").unlink()
+    (root / "canon" / "relationships.yaml").write_text(
+        "rel_vocabulary:\n  neutral: [knows]\n"
+        "entities:\n"
+        "  lenard: {type: character, aliases: [Lenard], introduced: Act1/Ch1}\n"
+        "  brian: {type: character, aliases: [Brian], introduced: Act1/Ch2}\n"
+        "relationships: []\n"
+    )
+    chars = root / "canon" / "characters"
+    (chars / "elena.md").write_text("# Elena\nDoctor.\n")
+    (chars / "supporting-cast.md").write_text(
+        "# Supporting Cast\n\n## Lenard\nRancher.\n\n## Brian\nBrother-in-law.\n"
+    )
+    return root
+
+
+def test_slice_manifest_keeps_current_chapter_and_its_cast(sliced_tree):
+    """L5 slices keep the current chapter's sections and its cast's profiles."""
+    state = make_state(level="L5", act=1, chapter=1, scene=1)
+    entries = slice_manifest(state, root=sliced_tree)
+    acts = [e for e in entries if e.startswith("canon/acts/")]
+    assert acts == [
+        "canon/acts/act-1-outline.md#act-1-outline:intro",
+        "canon/acts/act-1-outline.md#act-overview",
+        "canon/acts/act-1-outline.md#chapter-list:intro",
+        "canon/acts/act-1-outline.md#chapter-1-the-windmill",
+        "canon/acts/act-1-outline.md#continuity-touchpoints",
+        "canon/acts/act-2-outline.md",
+    ]
+    chars = [e for e in entries if e.startswith("canon/characters/")]
+    assert chars == [
+        "canon/characters/marcus.md",
+        "canon/characters/supporting-cast.md#lenard",
+    ]
+    assert read_entry(sliced_tree, chars[1]) == "## Lenard\nRancher.\n\n"
+    assert "canon/story-arc.md" in entries
+
+    whole = get_manifest_with_meta(state, root=sliced_tree)
+    sliced = get_manifest_with_meta(state, root=sliced_tree, sections=True)
+    assert sliced["files"] == entries
+    assert sliced["total_estimated_tokens"] < whole["total_estimated_tokens"]
+    assert sliced["manifest_hash"] != whole["manifest_hash"]
+
+
+def test_slice_manifest_keeps_intros_and_never_loses_a_file(sliced_tree):
+    """Split sections keep their intro; a file with nothing left is kept whole."""
+    acts = sliced_tree / "canon" / "acts"
+    (acts / "act-1-outline.md").write_text(
+        "# Act 1\nIntro under the title.\n\n"
+        "## Chapter 1\nThe windmill.\n\n## Chapter 2\nThe crater.\n\n## !!!\nUnnamed.\n"
+    )
+    (acts / "act-2-outline.md").write_text("## Chapter 1\nA.\n\n## Chapter 2\nB.\n")
+    state = make_state(level="L5", act=1, chapter=1, scene=1)
+    entries = [e for e in slice_manifest(state, root=sliced_tree) if e.startswith("canon/acts/")]
+    assert entries == [
+        "canon/acts/act-1-outline.md#act-1:intro",
+        "canon/acts/act-1-outline.md#chapter-1",
+        "canon/acts/act-2-outline.md",
+    ]
+    assert read_entry(sliced_tree, entries[0]) == "# Act 1\nIntro under the title.\n\n"
+    scan = CanonScan(sliced_tree)
+    assert scan.tokens(entries[0]) == count_tokens(read_entry(sliced_tree, entries[0]))
+
+
+def test_slice_manifest_at_l5_drops_other_chapter_outlines(canon_fixture_tree):
+    """L5 drops other chapters' outline files; L4 keeps them."""
+    (canon_fixture_tree / "canon" / "acts" / "act-1" / "ch1-outline.md").write_text(
+        "# Chapter 1 Outline\nMarcus waits.\n"
+    )
+    l5 = slice_manifest(make_state(level="L5", act=1, chapter=1, scene=1), root=canon_fixture_tree)
+    assert "canon/acts/act-1/ch1-outline.md" in l5
+    assert "canon/acts/act-1/ch2-outline.md" not in l5
+    l4 = slice_manifest(make_state(level="L4", act=1, chapter=1), root=canon_fixture_tree)
+    assert "canon/acts/act-1/ch2-outline.md" in l4
+
+
+def test_slice_manifest_leaves_other_levels_alone(sliced_tree):
+    """Below L4 the sliced manifest is the plain manifest."""
+    state = make_state(level="L3", act=1)
+    assert slice_manifest(state, root=sliced_tree) == get_manifest(state, root=sliced_tree)
+
+
+def test_pack_manifest_sections_counts_slices(sliced_tree):
+    """With sections, packing counts each slice's own tokens."""
+    state = make_state(level="L5", act=1, chapter=1, scene=1)
+    packed = pack_manifest(state, root=sliced_tree, sections=True)
+    assert packed["files"] == slice_manifest(state, root=sliced_tree)
+    assert packed["total_estimated_tokens"] == sum(
+        count_tokens(read_entry(sliced_tree, e)) for e in packed["files"]
+    )
+
+
+# ---------------------------------------------------------------------------
+# Budgeted packing
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture
+def cast_tree(canon_fixture_tree):
+    """Fixture tree with a larger cast; the Ch1 outline mentions two of them."""
+    chars = canon_fixture_tree / "canon" / "characters"
+    for name in ("elena-vasquez", "bystander", "another-bystander"):
+        (chars / f"{name}.md").write_text(f"# {name}\n" + "Profile detail.\n" * 50)
+    (canon_fixture_tree / "canon" / "acts" / "act-1" / "ch1-outline.md").write_text(
+        "# Chapter 1 Outline\nMarcus meets Elena Vasquez at the perimeter.\n"
+    )
+    return canon_fixture_tree
+
+
+def test_pack_manifest_within_budget_keeps_everything(cast_tree):
+    """A manifest within budget is packed unchanged."""
+    state = make_state(level="L5", act=1, chapter=1, scene=1)
+    packed = pack_manifest(state, root=cast_tree)
+    assert packed["files"] == get_manifest(state, root=cast_tree)
+    assert packed["dropped"] == []
+    assert not packed["over_budget"]
+
+
+def test_pack_manifest_drops_siblings_before_cast(cast_tree):
+    """Over budget, sibling outlines and the rest of the cast go first."""
+    state = make_state(level="L4", act=1, chapter=1)
+    tokens = file_tokens(cast_tree, get_manifest(state, root=cast_tree))
+    keep = [f for f in tokens if "bystander" not in f and f != "canon/acts/act-1/ch2-outline.md"
+            and f != "canon/acts/act-2-outline.md"]
+    packed = pack_manifest(state, root=cast_tree, budget=sum(tokens[f] for f in keep))
+    assert packed["files"] == keep
+    assert [d["tier"] for d in packed["dropped"]] == [
+        "siblings", "siblings", "characters", "characters",
+    ]
+
+
+def test_pack_manifest_always_keeps_system_files(cast_tree):
+    """System files are kept even when they alone exceed the budget."""
+    state = make_state(level="L5", act=1, chapter=1, scene=1)
+    packed = pack_manifest(state, root=cast_tree, budget=1)
+    assert packed["files"] == [
+        "CLAUDE.md", "canon/index.md", "canon/preferences.md", "canon/relationships.yaml",
+    ]
+    assert packed["over_budget"]
+    assert {d["tier"] for d in packed["dropped"]} >= {"current", "cast", "characters"}
+
+
+def test_reproducibility_bundle_hashes_the_packed_manifest(cast_tree):
+    """The bundle identifies the manifest that is loaded, not the unpacked one."""
+    state = make_state(level="L5", act=1, chapter=1, scene=1)
+    for budget, sections in ((None, False), (2000, False), (2000, True)):
+        bundle = get_reproducibility_bundle(state, cast_tree, budget, sections=sections)
+        packed = pack_manifest(state, cast_tree, budget, sections=sections)
+        assert bundle["context_manifest_hash"] == packed["manifest_hash"]
+    assert bundle["context_manifest_hash"] != get_manifest_hash(state, root=cast_tree)
+
+
+@pytest.mark.parametrize("content", [
+    "",
+    "- not a mapping\n",
+    "entities: [marcus]\n",
+    "entities:\n  marcus: a string\n  elena_vasquez: {aliases: Elena Vasquez}\n",
+    "entities: {unclosed\n",
+])
+def test_pack_manifest_survives_malformed_relationships(cast_tree, content):
+    """A malformed relationships file only loses its names; nothing is cached for it."""
+    (cast_tree / "canon" / "relationships.yaml").write_text(content)
+    state = make_state(level="L5", act=1, chapter=1, scene=1)
+    tokens = file_tokens(cast_tree, get_manifest(state, root=cast_tree))
+    packed = pack_manifest(state, root=cast_tree, budget=sum(tokens.values()) - 1)
+    assert "canon/characters/elena-vasquez.md" in packed["files"]
+    assert not list((cast_tree / "canon").glob(".cache/relationships.*"))
+
+
 # ---------------------------------------------------------------------------
 # Edge cases
 # ---------------------------------------------------------------------------
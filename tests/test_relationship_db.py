@@ -0,0 +1,140 @@
+"""Tests for scripts/relationship_db.py."""
+
+from __future__ import annotations
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from relationship_db import RelationshipDB
+from relationship_query import (
+    diff,
+    load,
+    query,
+    query_many,
+    render_matrix,
+    save,
+    save_shards,
+    validate_relationships,
+)
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+@pytest.fixture
+def messy_data(synthetic_data, supersession_chains) -> dict:
+    """Revision chains plus random records, with one of every validation error."""
+    data = supersession_chains(300, 30)
+    for n, rel in enumerate(synthetic_data(20, 700)["relationships"]):
+        data["relationships"].append(dict(rel, id=f"rel_{1000 + n}"))
+    rels = data["relationships"]
+    rels[5]["supersedes"] = "rel_999999"
+    rels[7]["id"] = rels[3]["id"]
+    rels[9]["valid_from"] = "sometime"
+    rels[11]["rel"] = "adores"
+    del rels[13]["id"]
+    rels[15]["valid_to"] = None
+    rels[16]["supersedes"] = rels[16]["id"]
+    rels[17]["source"] = "notes.txt"
+    rels[19].update(valid_from="Act1/Ch18", valid_to="Act1/Ch17")  # inverted range
+    data["entities"]["e0001"]["aliases"].append("E2")
+    return data
+
+
+def _db(tmp_path, data) -> RelationshipDB:
+    f = tmp_path / "relationships.yaml"
+    save(data, f)
+    return RelationshipDB.for_file(f)
+
+
+def test_db_answers_like_the_yaml_functions(tmp_path, messy_data):
+    """Queries, matrices and diffs from the database match the YAML functions."""
+    db = _db(tmp_path, messy_data)
+    for as_of in (None, "L1/concept", "Act1/Ch2", "Act2/Ch6"):
+        for entity in ("e0001", "E2", "entity 5", "nobody"):
+            assert db.query(entity, as_of) == query(messy_data, entity, as_of)
+        assert db.render_matrix(as_of, sparse=True) == render_matrix(
+            messy_data, as_of, sparse=True
+        )
+    assert db.query_many(["e0003", "E4", "e0003"], "Act1/Ch5") == query_many(
+        messy_data, ["e0003", "E4", "e0003"], "Act1/Ch5"
+    )
+    positions = ["L1/concept", "Act1/Ch1", "Act1/Ch2", "Act1/Ch12", "Act3/Ch12"]
+    for i, pos_from in enumerate(positions):
+        for pos_to in positions[i:]:
+            assert db.diff(pos_from, pos_to) == diff(messy_data, pos_from, pos_to)
+    with pytest.raises(ValueError):
+        db.diff("Act2/Ch1", "Act1/Ch1")
+
+
+def test_db_validate_matches_validate_relationships(tmp_path, messy_data):
+    """Database validation reports the same errors, in the same order."""
+    db = _db(tmp_path, messy_data)
+    errors = db.validate().errors
+    assert errors == validate_relationships(messy_data).errors
+    assert any(e.startswith("Circular supersession") for e in errors)
+    assert any(e.startswith("Temporal overlap") for e in errors)
+    assert any(e.startswith("Duplicate relationship ID") for e in errors)
+    sample = load(FIXTURES / "sample_relationships.yaml")
+    assert _db(tmp_path, sample).validate() == validate_relationships(sample)
+
+
+def test_db_sync_rewrites_only_changed_rows(tmp_path, messy_data):
+    """Sync rewrites only changed rows, and every row after a vocabulary change."""
+    f = tmp_path / "relationships.yaml"
+    save(messy_data, f)
+    db = RelationshipDB.for_file(f)
+    assert db.sync() == 0
+    messy_data["relationships"][40]["context"] = "revised"
+    messy_data["relationships"].pop()
+    messy_data["relationships"].append(dict(messy_data["relationships"][0], id="rel_5000"))
+    save(messy_data, f)
+    assert db.sync() == 2
+    assert db.query("e0001") == query(messy_data, "e0001")
+    assert db.validate().errors == validate_relationships(messy_data).errors
+
+    messy_data["rel_vocabulary"]["positive"].append("adores")
+    save(messy_data, f)
+    assert db.sync() == len(messy_data["relationships"])
+    assert db.validate().errors == validate_relationships(messy_data).errors
+    db.close()
+    # Reopening keeps the synced state.
+    assert RelationshipDB.for_file(f).sync() == 0
+
+
+def test_db_reads_sharded_canon(tmp_path, messy_data):
+    """A sharded relationships directory syncs and queries like a single file."""
+    save_shards(messy_data, tmp_path / "rels")
+    db = RelationshipDB.for_file(tmp_path / "rels")
+    data = load(tmp_path / "rels")
+    assert db.query("e0002", "Act2/Ch1") == query(data, "e0002", "Act2/Ch1")
+
+
+def test_cli_db_flag(tmp_path):
+    """--db answers CLI queries with the same output as the plain path."""
+    f = tmp_path / "rels.yaml"
+    save(load(FIXTURES / "sample_relationships.yaml"), f)
+
+    def run(*args):
+        return subprocess.run(
+            [sys.executable, "scripts/relationship_query.py", "--db", *args, "--file", str(f)],
+            capture_output=True, text=True,
+            cwd=str(Path(__file__).resolve().parent.parent),
+        )
+
+    plain = subprocess.run(
+        [sys.executable, "scripts/relationship_query.py", "--no-server",
+         "query", "--entity", "Elena", "--as-of", "Act2/Ch1", "--file", str(f)],
+        capture_output=True, text=True, cwd=str(Path(__file__).resolve().parent.parent),
+    )
+    result = run("query", "--entity", "Elena", "--as-of", "Act2/Ch1")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == plain.stdout
+    assert list((tmp_path / ".cache").glob("rels.*.sqlite"))
+    result = run("neighbors", "--entity", "Elena")
+    assert result.returncode == 1
+    assert "--db only answers" in result.stderr
@@ -6,8 +6,18 @@ Tests written first per Phase 0 plan S0.2.
 from __future__ import annotations
 
 import copy
+import csv
+import io
+import json
+import os
+import pickle
+import random
+import socket
 import subprocess
 import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
 from pathlib import Path
 
 import pytest
@@ -15,13 +25,37 @@ import yaml
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
 
+import relationship_query
 from relationship_query import (
+    MentionMatcher,
+    RelationshipStore,
+    TemporalIndex,
     VocabularyError,
+    _handle_request,
+    _request,
+    _ServedFile,
     add,
+    bulk_add,
+    diff,
+    entities_checked,
+    export_graph,
+    find_mentions,
+    import_records,
     load,
+    load_store,
     parse_position,
+    position_key,
     query,
+    query_many,
+    read_import_rows,
     render_matrix,
+    save,
+    save_shards,
+    shard_errors,
+    shard_name,
+    snapshot_path,
+    snapshot_stats,
+    socket_path,
     validate_relationships,
 )
 
@@ -53,6 +87,17 @@ def test_query_by_alias_string(sample_rels):
     assert any(r["from"] == "marcus" or r["to"] == "marcus" for r in results)
 
 
+@pytest.mark.parametrize("as_of", [None, "Act1/Ch5", "Act2/Ch1"])
+def test_query_many_matches_per_entity_query(sample_rels, as_of):
+    """query_many returns what query returns for each entity, keyed by entity."""
+    entities = ["marcus", "the soldier", "Dr. Vasquez", "zone_3", "nobody", "marcus"]
+    results = query_many(sample_rels, entities, as_of=as_of)
+    assert list(results) == ["marcus", "the soldier", "Dr. Vasquez", "zone_3", "nobody"]
+    for entity, rels in results.items():
+        assert rels == query(sample_rels, entity, as_of=as_of)
+    assert RelationshipStore(sample_rels).query_many(entities, as_of=as_of) == results
+
+
 def test_add_rejects_unknown_rel_vocabulary(sample_rels):
     """Cannot add a relationship with rel='is_suspicious_of' (not in vocab)."""
     with pytest.raises(VocabularyError):
@@ -102,6 +147,50 @@ def test_add_generates_sequential_ids(sample_rels):
     assert n2 == n1 + 1
 
 
+@pytest.mark.parametrize("hand_written", [True, False])
+def test_save_appends_added_relationships(tmp_path, sample_rels, hand_written):
+    """New records are appended as-is, matching the file's list indentation."""
+    f = tmp_path / "rels.yaml"
+    if hand_written:
+        f.write_bytes((FIXTURES / "sample_relationships.yaml").read_bytes())
+    else:
+        save(sample_rels, f)
+    original = f.read_bytes()
+    add(sample_rels, "elena", "zone_3", "knows", "maps it\nfrom orbit", "Act1/Ch4", "low",
+        "canon/acts/act-1/ch4-outline.md#L1")
+    add(sample_rels, "zone_3", "elena", "caused", "the storm", "Act1/Ch5", "high",
+        "canon/acts/act-1/ch5-outline.md#L2")
+    save(sample_rels, f, appended=2)
+    assert f.read_bytes().startswith(original)
+    assert load(f) == sample_rels
+    assert [p.name for p in tmp_path.iterdir()] == ["rels.yaml"]
+
+
+def test_save_rewrites_when_relationships_are_not_last(tmp_path, sample_rels):
+    """save() falls back to a full rewrite when relationships is not the last key."""
+    f = tmp_path / "rels.yaml"
+    sample_rels["notes"] = "trailing key"
+    save(sample_rels, f)
+    original = f.read_bytes()
+    add(sample_rels, "elena", "zone_3", "knows", "maps it", "Act1/Ch4", "low",
+        "canon/acts/act-1/ch4-outline.md#L1")
+    save(sample_rels, f, appended=1)
+    assert not f.read_bytes().startswith(original)
+    assert load(f) == sample_rels
+
+
+def test_save_new_files_respect_umask(tmp_path, sample_rels):
+    """New files and shards get the umask's mode, not mkstemp's 0600."""
+    old_mask = os.umask(0o027)
+    try:
+        save(sample_rels, tmp_path / "rels.yaml")
+        save_shards(sample_rels, tmp_path / "rels")
+    finally:
+        os.umask(old_mask)
+    written = [tmp_path / "rels.yaml", *(tmp_path / "rels").iterdir()]
+    assert {p.stat().st_mode & 0o777 for p in written} == {0o640}
+
+
 def test_render_matrix_produces_markdown(sample_rels):
     """render_matrix should output a valid markdown table."""
     md = render_matrix(sample_rels, as_of="Act1/Ch5")
@@ -116,6 +205,655 @@ def test_render_matrix_empty_entities():
     assert "no entities" in md.lower()
 
 
+def _table_cells(md):
+    """Parse a rendered matrix table into {(row, col): cell} for non-empty cells."""
+    lines = md.splitlines()
+    cols = [c.strip() for c in lines[0].strip("|").split("|")][1:]
+    cells = {}
+    for line in lines[2:]:
+        parts = [c.strip() for c in line.strip("|").split("|")]
+        row = parts[0].strip("*")
+        for col, cell in zip(cols, parts[1:]):
+            if cell and cell != "---":
+                cells[(row, col)] = cell
+    return cells
+
+
+def test_render_matrix_sparse_keeps_every_edge(synthetic_data):
+    """The sparse view drops empty rows/columns but no relationship."""
+    data = synthetic_data(40, 30)
+    dense = render_matrix(data, as_of="Act2/Ch1")
+    sparse = render_matrix(data, as_of="Act2/Ch1", sparse=True)
+    cells = _table_cells(dense)
+    assert _table_cells(sparse) == cells
+    header, _, *rows = sparse.splitlines()
+    assert [row.split("**")[1] for row in rows] == sorted({r for r, _ in cells})
+    assert sorted(c.strip() for c in header.strip("|").split("|")[1:]) == sorted(
+        {c for _, c in cells}
+    )
+
+
+def test_render_matrix_edge_list_and_filters(sample_rels):
+    """Edge rows match matrix cells; type and ID filters restrict both axes."""
+    cells = _table_cells(render_matrix(sample_rels, as_of="Act1/Ch5"))
+    edges = render_matrix(sample_rels, as_of="Act1/Ch5", edges=True).splitlines()
+    assert edges[0] == "| From | To | Relationships |"
+    assert {
+        (f, t): rels for f, t, rels in (
+            [c.strip() for c in line.strip("|").split("|")] for line in edges[2:]
+        )
+    } == cells
+
+    characters = render_matrix(sample_rels, types=["character"])
+    assert "zone_3" not in characters and "marcus" in characters
+    assert render_matrix(sample_rels, ids=["nobody"]) == "(no matching entities)"
+
+
+def test_render_matrix_pages_cover_whole_matrix(synthetic_data):
+    """Tiles together hold every cell of the unpaginated matrix."""
+    data = synthetic_data(12, 80)
+    full = _table_cells(render_matrix(data))
+    tiled = render_matrix(data, page_size=5)
+    assert tiled.count("**Tile ") == 9
+    merged = {}
+    for n in range(1, 10):
+        tile = render_matrix(data, page_size=5, page=n)
+        assert tile in tiled
+        merged.update(_table_cells(tile.split("\n\n", 1)[1]))
+    assert merged == full
+    assert RelationshipStore(data).render_matrix(page_size=5, page=4) == render_matrix(
+        data, page_size=5, page=4
+    )
+    with pytest.raises(ValueError):
+        render_matrix(data, page_size=5, page=10)
+
+
+class _CountingWriter(io.StringIO):
+    """StringIO that counts write() calls."""
+
+    writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super().write(text)
+
+
+def _active(data, as_of):
+    rels = data["relationships"]
+    return [rels[i] for i in _brute_force_active(rels, parse_position(as_of))]
+
+
+def test_export_csv_matches_matrix(sample_rels):
+    """CSV adjacency cells hold the same terms as the markdown matrix."""
+    out = io.StringIO()
+    export_graph(sample_rels, out, "csv", as_of="Act1/Ch5")
+    header, *rows = list(csv.reader(io.StringIO(out.getvalue())))
+    assert header[1:] == list(sample_rels["entities"])
+    cells = {
+        (row[0], col): cell
+        for row in rows for col, cell in zip(header[1:], row[1:])
+        if cell and row[0] != col
+    }
+    assert cells == _table_cells(render_matrix(sample_rels, as_of="Act1/Ch5"))
+
+
+def test_export_json_and_graphml_edges(sample_rels):
+    """JSON and GraphML carry every active relationship and every entity."""
+    active = _active(sample_rels, "Act1/Ch5")
+
+    out = io.StringIO()
+    assert export_graph(sample_rels, out, "json", as_of="Act1/Ch5") == len(active)
+    doc = json.loads(out.getvalue())
+    assert doc["as_of"] == "Act1/Ch5"
+    assert [n["id"] for n in doc["nodes"]] == list(sample_rels["entities"])
+    assert [e["id"] for e in doc["edges"]] == [r["id"] for r in active]
+
+    out = io.StringIO()
+    export_graph(sample_rels, out, "graphml", as_of="Act1/Ch5")
+    ns = {"g": "http://graphml.graphdrawing.org/xmlns"}
+    graph = ET.fromstring(out.getvalue()).find("g:graph", ns)
+    edges = graph.findall("g:edge", ns)
+    assert [e.find("g:data[@key='rel_id']", ns).text for e in edges] == [r["id"] for r in active]
+    node_ids = {n.get("id") for n in graph.findall("g:node", ns)}
+    assert all(e.get("source") in node_ids and e.get("target") in node_ids for e in edges)
+
+
+def test_export_streams_and_store_matches(sample_rels):
+    """Exporters write per edge, and the store's export is identical."""
+    store = RelationshipStore(sample_rels)
+    for fmt in ("csv", "json", "graphml", "dot"):
+        out = _CountingWriter()
+        export_graph(sample_rels, out, fmt)
+        assert out.writes > len(sample_rels["entities"])
+        indexed = io.StringIO()
+        store.export(indexed, fmt, as_of="Act1/Ch5")
+        linear = io.StringIO()
+        export_graph(sample_rels, linear, fmt, as_of="Act1/Ch5")
+        assert indexed.getvalue() == linear.getvalue()
+    with pytest.raises(ValueError):
+        export_graph(sample_rels, io.StringIO(), "xlsx")
+
+
+# ---------------------------------------------------------------------------
+# Indexed store
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("entity", ["marcus", "the soldier", "Dr. Vasquez", "zone_3", "nobody"])
+@pytest.mark.parametrize("as_of", [None, "L1/concept", "Act1/Ch5", "Act1/Ch10", "Act2/Ch1"])
+def test_store_query_matches_linear_query(sample_rels, entity, as_of):
+    """RelationshipStore.query must return exactly what query() returns, in order."""
+    store = RelationshipStore(sample_rels)
+    assert store.query(entity, as_of=as_of) == query(sample_rels, entity, as_of=as_of)
+
+
+def test_store_add_keeps_indexes_consistent(sample_rels):
+    """Relationships added through the store are visible to indexed lookups."""
+    store = RelationshipStore(sample_rels)
+    new_rel = store.add(
+        "elena", "zone_3", "fears", "sees the anomaly", "Act1/Ch4",
+        "low", "canon/acts/act-1/ch4-outline.md",
+    )
+    assert new_rel in store.query("Dr. Vasquez")
+    assert new_rel in store.query("the dead zone", as_of="Act1/Ch4")
+    assert new_rel in store.with_rel("fears")
+    assert store.query("elena") == query(sample_rels, "elena")
+
+
+def _record(n, rel="knows"):
+    return {"from": "marcus", "to": "elena", "rel": rel, "context": f"batch {n}",
+            "valid_from": "Act1/Ch4", "confidence": "low",
+            "source": f"canon/acts/act-1/ch4-outline.md#L{n}"}
+
+
+def test_bulk_add_matches_sequential_adds(sample_rels):
+    """bulk_add assigns the same IDs and records as one add() per record."""
+    expected = copy.deepcopy(sample_rels)
+    for n in range(5):
+        r = _record(n)
+        add(expected, r["from"], r["to"], r["rel"], r["context"], r["valid_from"],
+            r["confidence"], r["source"])
+    store = RelationshipStore(copy.deepcopy(sample_rels))
+    added = store.bulk_add([_record(n) for n in range(5)])
+    assert [r["id"] for r in added] == ["rel_006", "rel_007", "rel_008", "rel_009", "rel_010"]
+    assert store.data == expected
+    assert store.query("elena") == query(store.data, "elena")
+    assert bulk_add(sample_rels, [_record(n) for n in range(5)]) == added
+
+
+def test_bulk_add_rejects_whole_batch(sample_rels):
+    """A bad record fails the whole batch, naming every offender, and adds nothing."""
+    store = RelationshipStore(sample_rels)
+    with pytest.raises(VocabularyError, match=r"record 2: 'adores'(.|\n)*record 4: 'envies'"):
+        store.bulk_add([_record(1), _record(2, "adores"), _record(3), _record(4, "envies")])
+    incomplete = _record(2)
+    del incomplete["source"]
+    with pytest.raises(ValueError, match="record 2: missing source"):
+        store.bulk_add([_record(1), incomplete])
+    assert len(sample_rels["relationships"]) == 5
+    assert store.add(*_record(9).values())["id"] == "rel_006"
+
+
+def test_store_add_tracks_external_changes(sample_rels):
+    """Direct appends are seen by the next store add; vocabulary edits after reindex()."""
+    store = RelationshipStore(sample_rels)
+    sample_rels["relationships"].append(dict(sample_rels["relationships"][0], id="rel_041"))
+    sample_rels["rel_vocabulary"]["positive"].append("admires")
+    with pytest.raises(VocabularyError):
+        store.add(*_record(1, "admires").values())
+    store.reindex()
+    new_rel = store.add(*_record(1, "admires").values())
+    assert new_rel["id"] == "rel_042"
+    assert store.query("marcus") == query(sample_rels, "marcus")
+    sample_rels["relationships"].pop(0)
+    with pytest.raises(ValueError, match="rebuild"):
+        store.add(*_record(2).values())
+
+
+def test_store_reindex_picks_up_in_place_edits(sample_rels):
+    """Reported record and vocabulary edits move the indexes."""
+    store = RelationshipStore(sample_rels)
+    sample_rels["rel_vocabulary"]["positive"][0] = "brand_new_term"
+    sample_rels["relationships"][0].update(id="rel_040", rel="brand_new_term", to="zone_3")
+    store.reindex([0])
+    assert "brand_new_term" in store.vocabulary
+    assert store.add(*_record(1).values())["id"] == "rel_041"
+    assert sample_rels["relationships"][0] in store.with_rel("brand_new_term")
+    assert store.query("marcus") == query(sample_rels, "marcus")
+    assert store.query("zone_3") == query(sample_rels, "zone_3")
+    assert store.validate().errors == validate_relationships(sample_rels).errors
+
+
+def test_module_add_numbers_from_the_current_ids(sample_rels):
+    """Module-level add() sees in-place edits and removals without any bookkeeping."""
+    assert add(sample_rels, *_record(1).values())["id"] == "rel_006"
+    sample_rels["relationships"][0]["id"] = "rel_007"
+    assert add(sample_rels, *_record(2, "fears").values())["id"] == "rel_008"
+    sample_rels["relationships"].pop()
+    sample_rels["relationships"].append(dict(_record(3, "respects"), id="rel_050"))
+    assert bulk_add(sample_rels, [_record(4, "resents")])[0]["id"] == "rel_051"
+
+
+def test_import_records_reports_every_reject(sample_rels):
+    """Import reports each rejected row by line and still accepts the good ones."""
+    text = "\n".join([
+        json.dumps(_record(1)),
+        "{not json",
+        json.dumps(dict(_record(3), rel="adores", valid_from="Chapter 3")),
+        json.dumps(dict(_record(4), id="rel_001")),
+        json.dumps(dict(_record(5), id="rel_050")),
+        json.dumps(dict(_record(6), id="rel_050", source="notes.txt")),
+        json.dumps(dict(_record(7), confidence="certain", chapter=7)),
+        json.dumps(_record(8)),
+    ])
+    rows, rejects = read_import_rows(io.StringIO(text), "jsonl")
+    assert [(line, err.split(":")[0]) for line, err in rejects] == [(2, "invalid JSON")]
+    store = RelationshipStore(copy.deepcopy(sample_rels))
+    report = store.import_records(rows)
+    assert [r["id"] for r in report.accepted] == ["rel_051", "rel_050", "rel_052"]
+    assert [line for line, _ in report.rejected] == [3, 3, 4, 6, 6, 7, 7]
+    assert (3, "rel 'adores' not in rel_vocabulary") in report.rejected
+    assert (4, "duplicate id 'rel_001'") in report.rejected
+    assert (7, "unknown fields: chapter") in report.rejected
+    assert import_records(sample_rels, rows) == report
+    assert store.query("marcus") == query(sample_rels, "marcus")
+
+
+def test_read_import_rows_csv_nulls_empty_cells():
+    """Empty CSV cells read as None and over-long rows are rejected."""
+    text = (
+        "from,to,rel,context,valid_from,valid_to,confidence,source\n"
+        "marcus,elena,knows,met,Act1/Ch1,,low,canon/acts/act-1/ch1-outline.md\n"
+        "marcus,elena,knows,met,Act1/Ch1,Act1/Ch2,low,canon/x.md,extra\n"
+    )
+    rows, rejects = read_import_rows(io.StringIO(text), "csv")
+    assert rows == [(2, dict(_record(0), context="met", valid_from="Act1/Ch1",
+                             valid_to=None, source="canon/acts/act-1/ch1-outline.md"))]
+    assert rejects == [(3, "more cells than header columns")]
+
+
+def test_store_entity_ids_for_resolves_aliases(sample_rels):
+    """Alias lookups go through the alias index, IDs through the entity table."""
+    store = RelationshipStore(sample_rels)
+    assert store.entity_ids_for("Reeves") == {"marcus"}
+    assert store.entity_ids_for("elena") == {"elena"}
+    assert store.entity_ids_for("unknown") == set()
+
+
+def _brute_force_active(relationships, pos):
+    return [
+        i for i, r in enumerate(relationships)
+        if parse_position(r["valid_from"]) <= pos
+        and (r.get("valid_to") is None or pos < parse_position(r["valid_to"]))
+    ]
+
+
+def test_temporal_index_active_at_matches_linear_filter(synthetic_data):
+    """The interval tree must agree with a linear scan at every chapter."""
+    rels = synthetic_data(20, 2000, acts=3, chapters=12)["relationships"]
+    index = TemporalIndex.from_relationships(rels)
+    for act in range(0, 5):
+        for ch in range(0, 15):
+            key = position_key(f"Act{act}/Ch{ch}")
+            assert index.active_at(key) == _brute_force_active(rels, (act, ch))
+
+
+def test_temporal_index_changed_between(synthetic_data):
+    """changed_between reports starts and ends inside (from, to] only."""
+    rels = synthetic_data(20, 500)["relationships"]
+    index = TemporalIndex.from_relationships(rels)
+    lo, hi = (1, 3), (2, 1)
+    started, ended = index.changed_between(position_key("Act1/Ch3"), position_key("Act2/Ch1"))
+    assert started == [
+        i for i, r in enumerate(rels) if lo < parse_position(r["valid_from"]) <= hi
+    ]
+    assert ended == [
+        i for i, r in enumerate(rels)
+        if r.get("valid_to") is not None and lo < parse_position(r["valid_to"]) <= hi
+    ]
+
+
+def test_temporal_index_sees_appended_records(synthetic_data):
+    """Records appended after the build are found, before and after a rebuild."""
+    data = synthetic_data(5, 50)
+    store = RelationshipStore(data)
+    store.active_at("Act1/Ch1")  # build the index
+    for n in range(TemporalIndex.rebuild_threshold + 2):
+        new_rel = store.add(
+            "e0000", "e0001", "knows", f"late {n}", "Act9/Ch1", "low", "canon/file.md",
+        )
+        assert store.active_at("Act9/Ch1")[-1] is new_rel
+    rels = data["relationships"]
+    assert store.active_at("Act9/Ch1") == [rels[i] for i in _brute_force_active(rels, (9, 1))]
+
+
+def test_diff_reports_added_ended_and_superseded(sample_rels):
+    """rel_004 supersedes rel_001 in Act2/Ch1; rel_005 ends at Act1/Ch9."""
+    changes = diff(sample_rels, "Act1/Ch3", "Act2/Ch1")
+    rels = {r["id"]: r for r in sample_rels["relationships"]}
+    assert changes.superseded == [{"old": rels["rel_001"], "new": rels["rel_004"]}]
+    assert changes.ended == [rels["rel_005"]]
+    assert changes.added == []
+    assert diff(sample_rels, "L1/concept", "Act1/Ch3").added == [
+        rels["rel_001"], rels["rel_002"], rels["rel_003"], rels["rel_005"]
+    ]
+    with pytest.raises(ValueError):
+        diff(sample_rels, "Act2/Ch1", "Act1/Ch1")
+
+
+def test_store_diff_matches_linear_diff(synthetic_data, supersession_chains):
+    """The endpoint-indexed diff agrees with the linear one, supersessions included."""
+    data = supersession_chains(300, 30)
+    for n, rel in enumerate(synthetic_data(20, 700)["relationships"]):
+        data["relationships"].append(dict(rel, id=f"rel_{1000 + n}"))
+    store = RelationshipStore(data)
+    positions = ["L1/concept", "Act1/Ch1", "Act1/Ch2", "Act1/Ch12", "Act1/Ch25", "Act3/Ch12"]
+    for i, pos_from in enumerate(positions):
+        for pos_to in positions[i:]:
+            assert store.diff(pos_from, pos_to) == diff(data, pos_from, pos_to)
+    assert len(diff(data, "Act1/Ch1", "Act1/Ch2").superseded) == 10
+
+
+def test_store_render_matrix_matches_linear(sample_rels):
+    """The indexed matrix renders identically to render_matrix()."""
+    store = RelationshipStore(sample_rels)
+    for as_of in (None, "Act1/Ch1", "Act1/Ch9", "Act2/Ch1"):
+        assert store.render_matrix(as_of) == render_matrix(sample_rels, as_of=as_of)
+
+
+# ---------------------------------------------------------------------------
+# Sharded storage
+# ---------------------------------------------------------------------------
+
+
+def test_shards_round_trip_in_act_order(tmp_path, synthetic_data):
+    """save_shards() writes one file per act that load() reads back in act order."""
+    data = synthetic_data(30, 400)
+    save_shards(data, tmp_path / "rels")
+    names = sorted(p.name for p in (tmp_path / "rels").iterdir())
+    assert names == ["act-1.yaml", "act-2.yaml", "act-3.yaml", "header.yaml"]
+    expected = dict(data, relationships=sorted(data["relationships"], key=shard_name))
+    assert load(tmp_path / "rels") == expected
+    assert shard_errors(tmp_path / "rels") == []
+
+
+def test_load_as_of_skips_shards_with_nothing_active(tmp_path, sample_rels, synthetic_data):
+    """An as_of load skips shards with nothing active yet returns every active record."""
+    for rel in sample_rels["relationships"][:3]:
+        rel["valid_to"] = "Act1/Ch12"
+    save(sample_rels, tmp_path / "rels.yaml")
+    save_shards(sample_rels, tmp_path / "rels")
+    partial = load(tmp_path / "rels", as_of="Act2/Ch1")
+    assert [r["id"] for r in partial["relationships"]] == ["rel_004"]
+    assert partial["entities"] == sample_rels["entities"]
+    data = synthetic_data(30, 400)
+    save_shards(data, tmp_path / "big")
+    for as_of in ("L1/concept", "Act1/Ch5", "Act2/Ch12", "Act3/Ch1"):
+        assert sorted(r["id"] for r in _active(load(tmp_path / "big", as_of=as_of), as_of)) == (
+            sorted(r["id"] for r in _active(data, as_of))
+        )
+
+
+def test_save_appends_to_the_right_shard(tmp_path, sample_rels):
+    """An appended relationship lands at the end of its act's shard."""
+    shards = tmp_path / "rels"
+    shards.mkdir()
+    save(sample_rels, shards)
+    act2 = (shards / "act-2.yaml").read_bytes()
+    store = RelationshipStore(load(shards))
+    store.add("elena", "zone_3", "knows", "surveys it", "Act2/Ch4", "low",
+              "canon/acts/act-2/ch4-outline.md#L1", valid_to="Act2/Ch9")
+    save(store.data, shards, appended=1)
+    assert (shards / "act-2.yaml").read_bytes().startswith(act2)
+    assert shard_errors(shards) == []
+    assert load(shards) == store.data
+    assert [r["id"] for r in load(shards, as_of="Act2/Ch5")["relationships"]][-1] == "rel_006"
+
+
+def test_shard_errors_report_misplaced_and_stale(tmp_path, sample_rels):
+    """shard_errors() flags records in the wrong shard and a stale header."""
+    shards = tmp_path / "rels"
+    save_shards(sample_rels, shards)
+    act1 = yaml.safe_load((shards / "act-1.yaml").read_text("utf-8"))
+    act1["relationships"][0]["valid_from"] = "Act3/Ch1"
+    act1["relationships"].append(dict(act1["relationships"][-1], id="rel_009"))
+    (shards / "act-1.yaml").write_text(yaml.safe_dump(act1, sort_keys=False), "utf-8")
+    errors = shard_errors(shards)
+    assert "rel_001: stored in act-1.yaml but valid_from 'Act3/Ch1' belongs in act-3.yaml" in errors
+    assert "header.yaml: shards entry for act-1.yaml is missing or stale" in errors
+
+
+# ---------------------------------------------------------------------------
+# Graph traversal
+# ---------------------------------------------------------------------------
+
+
+def _brute_force_distances(edges, start, hops):
+    """Hop distances from *start* by repeated scans over the (from, to) pairs."""
+    distance = {start: 0}
+    for hop in range(1, hops + 1):
+        for a, b in edges:
+            for x, y in ((a, b), (b, a)):
+                if distance.get(x) == hop - 1 and y not in distance:
+                    distance[y] = hop
+    return distance
+
+
+@pytest.mark.parametrize("as_of", [None, "Act2/Ch6"])
+def test_neighborhood_matches_brute_force(as_of, synthetic_data):
+    """neighborhood() distances match a brute-force BFS over the same edges."""
+    data = synthetic_data(60, 90)
+    store = RelationshipStore(data)
+    rels = data["relationships"] if as_of is None else _active(data, as_of)
+    edges = [(r["from"], r["to"]) for r in rels if r["from"] != r["to"]]
+    for start in ("e0000", "e0007", "e0031"):
+        for hops in (1, 2, 4):
+            assert store.neighborhood(start, hops, as_of=as_of) == _brute_force_distances(
+                edges, start, hops
+            )
+
+
+def test_neighborhood_filters_category_and_direction(sample_rels):
+    """neighborhood() honours aliases, categories, direction and as_of."""
+    store = RelationshipStore(sample_rels)
+    assert store.neighborhood("Elena", 2) == {"elena": 0, "marcus": 1, "zone_3": 2}
+    assert store.neighborhood("elena", 2, categories=["positive"]) == {"elena": 0, "marcus": 1}
+    assert store.neighborhood("zone_3", 2, direction="out") == {"zone_3": 0}
+    assert store.neighborhood("zone_3", 2, direction="in") == {"zone_3": 0, "marcus": 1, "elena": 2}
+    assert store.neighborhood("zone_3", 1, as_of="Act1/Ch1") == {"zone_3": 0, "marcus": 1}
+    with pytest.raises(ValueError, match="Unknown rel category"):
+        store.neighborhood("marcus", categories=["hostile"])
+    with pytest.raises(ValueError, match="Unknown direction"):
+        store.neighborhood("marcus", direction="sideways")
+
+
+def test_shortest_path_returns_relationship_chain(sample_rels):
+    """shortest_path() returns the relationships along the path, or None."""
+    store = RelationshipStore(sample_rels)
+    path = store.shortest_path("Dr. Vasquez", "the dead zone", as_of="Act1/Ch3")
+    assert [r["id"] for r in path] == ["rel_001", "rel_002"]
+    assert store.shortest_path("elena", "zone_3", direction="out") == [
+        sample_rels["relationships"][2], sample_rels["relationships"][1]
+    ]
+    assert store.shortest_path("zone_3", "elena", direction="out") is None
+    assert store.shortest_path("elena", "zone_3", categories=["positive"]) is None
+    assert store.shortest_path("Marcus", "marcus") == []
+
+
+def test_shortest_path_length_matches_neighborhood(synthetic_data):
+    """Shortest path lengths agree with neighborhood() distances."""
+    store = RelationshipStore(synthetic_data(80, 100, seed=3))
+    distances = store.neighborhood("e0001", 80)
+    for target in ("e0002", "e0040", "e0079"):
+        path = store.shortest_path("e0001", target)
+        assert (None if path is None else len(path)) == distances.get(target)
+
+
+def test_graph_sees_added_relationships(sample_rels):
+    """Relationships added through the store extend an already built graph."""
+    store = RelationshipStore(sample_rels)
+    assert "zone_3" not in store.neighborhood("elena")
+    store.add("elena", "zone_3", "knows", "surveyed it", "Act1/Ch4", "high",
+              "canon/acts/act-1/ch4-outline.md#L1")
+    assert store.neighborhood("elena")["zone_3"] == 1
+
+
+# ---------------------------------------------------------------------------
+# Mention extraction
+# ---------------------------------------------------------------------------
+
+
+def test_find_mentions_resolves_names_with_line_offsets(sample_rels):
+    """Mentions resolve IDs, aliases and labels to entities with line and column."""
+    text = (
+        "Dr. Vasquez watched Reeves.\n"
+        "The soldier crossed into the Dead Zone; Marcusian, zone_3.\n"
+    )
+    mentions = find_mentions(sample_rels, text)
+    assert [(m.entity_ids, m.text, m.line, m.column) for m in mentions] == [
+        (["elena"], "Dr. Vasquez", 1, 0),
+        (["marcus"], "Reeves", 1, 20),
+        (["marcus"], "The soldier", 2, 0),
+        (["zone_3"], "the Dead Zone", 2, 25),
+        (["zone_3"], "zone_3", 2, 51),
+    ]
+    assert all(text[m.offset:m.offset + len(m.text)] == m.text for m in mentions)
+    assert entities_checked(mentions) == ["elena", "marcus", "zone_3"]
+
+
+def test_find_mentions_shared_alias_and_label(sample_rels):
+    """A shared alias resolves to every entity using it; labels are names too."""
+    sample_rels["entities"]["marcus_sr"] = {"type": "character", "aliases": ["Reeves"]}
+    sample_rels["entities"]["zone_3"]["label"] = "Sector Three"
+    text = "Reeves left Sector Three."
+    assert [(m.entity_ids, m.text) for m in find_mentions(sample_rels, text)] == [
+        (["marcus", "marcus_sr"], "Reeves"),
+        (["zone_3"], "Sector Three"),
+    ]
+    store = RelationshipStore(sample_rels)
+    assert store.find_mentions(text) == find_mentions(sample_rels, text)
+
+
+def test_find_mentions_keeps_offsets_in_non_ascii_text(sample_rels):
+    """Non-ASCII text folds per character, so offsets match the ASCII fast path."""
+    sample_rels["entities"]["zoe"] = {"type": "character", "aliases": ["Zoë"]}
+    text = "İ saw ZOË with Reeves.\nZoë left."
+    assert [(m.text, m.line, m.column) for m in find_mentions(sample_rels, text)] == [
+        ("ZOË", 1, 6), ("Reeves", 1, 15), ("Zoë", 2, 0),
+    ]
+    ascii_text = "I saw Reeves."
+    assert [m.column for m in find_mentions(sample_rels, ascii_text)] == [6]
+
+
+def _brute_force_mentions(names, text):
+    """Leftmost-longest whole-word matches, one name and position at a time."""
+    def word(ch):
+        return ch.isalnum() or ch == "_"
+
+    lowered, found, start = text.lower(), [], 0
+    while start < len(text):
+        best = None
+        for name in names:
+            end = start + len(name)
+            if lowered[start:end] != name.lower():
+                continue
+            if word(name[0]) and start and word(text[start - 1]):
+                continue
+            if word(name[-1]) and end < len(text) and word(text[end]):
+                continue
+            if best is None or len(name) > len(best):
+                best = name
+        if best is None:
+            start += 1
+        else:
+            found.append((start, text[start:start + len(best)]))
+            start += len(best)
+    return found
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_mention_matcher_matches_brute_force(seed):
+    """MentionMatcher finds the same leftmost-longest matches as a brute-force scan."""
+    rng = random.Random(seed)
+    letters = "ab c."
+    names = {"".join(rng.choice(letters) for _ in range(rng.randint(1, 5))).strip(" ")
+             for _ in range(30)} - {""}
+    text = "".join(rng.choice(letters + "AB\n") for _ in range(2000))
+    matcher = MentionMatcher({name: [name] for name in names})
+    assert [(m.offset, m.text) for m in matcher.scan(text)] == _brute_force_mentions(names, text)
+
+
+# ---------------------------------------------------------------------------
+# Snapshot cache
+# ---------------------------------------------------------------------------
+
+
+def test_load_store_hits_snapshot_until_file_changes(tmp_path, sample_rels):
+    """A second load reuses the snapshot; editing the file invalidates it."""
+    f = tmp_path / "relationships.yaml"
+    save(sample_rels, f)
+
+    first = load_store(f)
+    assert snapshot_path(f).exists()
+    second = load_store(f)
+    assert snapshot_stats(f).hits == 1 and snapshot_stats(f).misses == 1
+    assert second.query("marcus", as_of="Act1/Ch5") == first.query("marcus", as_of="Act1/Ch5")
+    assert second.validate().errors == validate_relationships(sample_rels).errors
+
+    sample_rels["relationships"][0]["rel"] = "fears"
+    save(sample_rels, f)
+    third = load_store(f)
+    assert snapshot_stats(f).misses == 2
+    assert third.relationships[0]["rel"] == "fears"
+
+
+def test_load_store_refreshes_snapshot_after_touch(tmp_path, sample_rels):
+    """An mtime-only change is a hit and rewrites the snapshot's stat fields."""
+    f = tmp_path / "relationships.yaml"
+    save(sample_rels, f)
+    load_store(f)
+    stat = f.stat()
+    os.utime(f, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    load_store(f)
+    assert snapshot_stats(f).last == "hit"
+    with open(snapshot_path(f), "rb") as cache:
+        header = pickle.load(cache)
+    assert header["mtime_ns"] == f.stat().st_mtime_ns
+
+
+def test_served_writes_defer_the_snapshot(tmp_path, sample_rels, monkeypatch):
+    """Served adds only append to the file; the snapshot is rewritten on flush."""
+    f = tmp_path / "relationships.yaml"
+    save(sample_rels, f)
+    served = _ServedFile(f)
+    served.store()
+    written = []
+    monkeypatch.setattr(relationship_query, "write_snapshot",
+                        lambda store, path: written.append(path))
+    for n, rel in enumerate(["fears", "respects", "resents"]):
+        response = _handle_request(served, dict(_record(n, rel), op="add"))
+        assert response["status"] == "ok", response
+    assert written == []
+    served.flush_snapshot(idle=3600)
+    assert written == []
+    served.flush_snapshot()
+    served.flush_snapshot()
+    assert written == [f]
+
+
+def test_load_store_rebuilds_unreadable_snapshot(tmp_path, sample_rels):
+    """A corrupt snapshot is treated as a miss and replaced."""
+    f = tmp_path / "relationships.yaml"
+    save(sample_rels, f)
+    load_store(f)
+    snapshot_path(f).write_bytes(b"not a pickle")
+    store = load_store(f)
+    assert store.data == sample_rels
+    assert snapshot_stats(f).misses == 2
+    load_store(f)
+    assert snapshot_stats(f).last == "hit"
+
+
 # ---------------------------------------------------------------------------
 # Temporal ordering
 # ---------------------------------------------------------------------------
@@ -148,6 +886,36 @@ def test_parse_position_l_format():
     assert parse_position("L2/arc") == (0, 0)
 
 
+def test_position_key_preserves_parse_position_order():
+    """Packed keys must sort exactly like parse_position tuples."""
+    positions = ["L1/concept", "Act1/Ch1", "Act1/Ch9", "Act1/Ch10", "Act2/Ch1", "Act10/Ch2"]
+    assert sorted(positions, key=position_key) == sorted(positions, key=parse_position)
+    assert position_key("L2/arc") == position_key("L1/concept") == 0
+    with pytest.raises(ValueError):
+        position_key("chapter-3")
+
+
+def test_store_query_malformed_position_behaves_like_query():
+    """A malformed valid_to raises in both paths, unless valid_from already excludes it."""
+    data = {
+        "entities": {},
+        "relationships": [
+            {"id": "rel_001", "from": "a", "to": "b", "rel": "knows",
+             "valid_from": "Act1/Ch1", "valid_to": "soon"},
+            {"id": "rel_002", "from": "a", "to": "b", "rel": "knows",
+             "valid_from": "Act3/Ch1", "valid_to": "soon"},
+        ],
+    }
+    store = RelationshipStore(data)
+    with pytest.raises(ValueError):
+        query(data, "a", as_of="Act1/Ch2")
+    with pytest.raises(ValueError):
+        store.query("a", as_of="Act1/Ch2")
+    data["relationships"].pop(0)
+    store = RelationshipStore(data)
+    assert store.query("a", as_of="Act1/Ch2") == query(data, "a", as_of="Act1/Ch2") == []
+
+
 def test_parse_position_invalid_raises():
     """Invalid format should raise ValueError."""
     with pytest.raises(ValueError):
@@ -225,6 +993,63 @@ def test_validate_catches_circular_supersession():
     assert any("circular" in e.lower() for e in result.errors)
 
 
+def test_validate_reports_each_supersession_cycle_once(supersession_chains):
+    """A cycle is reported once, with all of its members; chains into it are not."""
+    data = supersession_chains(8, 8)
+    rels = data["relationships"]
+    # Cycles rel_001 <-> rel_002 and rel_003 -> rel_005 -> rel_004 -> rel_003;
+    # rel_006..rel_008 chain into the second one.
+    rels[0]["supersedes"] = "rel_002"
+    rels[2]["supersedes"] = "rel_005"
+    circular = [e for e in validate_relationships(data).errors if "circular" in e.lower()]
+    assert circular == [
+        "Circular supersession chain detected involving: rel_001 -> rel_002 -> rel_001",
+        "Circular supersession chain detected involving: "
+        "rel_003 -> rel_005 -> rel_004 -> rel_003",
+    ]
+
+
+def test_validate_long_supersession_chains(supersession_chains):
+    """20k relationships in 1000-long revision chains validate cleanly."""
+    data = supersession_chains(20000, 1000)
+    result = validate_relationships(data)
+    assert result.ok, result.errors[:5]
+
+
+def test_incremental_validation_matches_full_pass(synthetic_data, supersession_chains):
+    """Appends and in-place edits re-validated incrementally equal a full pass."""
+    data = supersession_chains(60, 6)
+    data["relationships"].extend(synthetic_data(4, 40)["relationships"][:20])
+    rels = data["relationships"]
+    state = validate_relationships(data).state
+
+    edits = [
+        lambda: rels.append(dict(rels[3], context="re-asserted")),  # duplicate ID, overlap
+        lambda: rels[7].update(supersedes="rel_011"),  # new cycle
+        lambda: rels[7].update(supersedes="rel_007"),  # cycle broken, link restored
+        lambda: rels[30].update(rel="adores", valid_to="later"),
+        lambda: rels[-1].update(id="rel_999", **{"from": "e0001"}),  # triple and ID change
+        lambda: rels.append({"id": "rel_001", "from": "a", "to": "b", "rel": "knows",
+                             "valid_from": "Act1/Ch1", "source": "canon/file.md"}),
+    ]
+    for n, edit in enumerate(edits):
+        before = len(rels)
+        edit()
+        changed = [] if len(rels) > before else [i for i in (7, 30, before - 1)]
+        result = validate_relationships(data, previous=state, changed=changed)
+        full = validate_relationships(data)
+        assert result.errors == full.errors, f"edit {n}"
+        state = result.state
+
+
+def test_incremental_validation_rejects_removed_relationships(sample_rels):
+    """Removing records is not a delta; it needs a full pass."""
+    state = validate_relationships(sample_rels).state
+    sample_rels["relationships"].pop()
+    with pytest.raises(ValueError):
+        validate_relationships(sample_rels, previous=state)
+
+
 def test_validate_catches_duplicate_relationship_ids():
     """Two relationships with the same ID should fail validation."""
     data = {
@@ -294,6 +1119,41 @@ def test_validate_catches_temporal_overlap():
     assert any("overlap" in e.lower() for e in result.errors)
 
 
+def _pairwise_overlap_errors(relationships):
+    """Reference O(k^2) overlap check, as validate_relationships used to run it."""
+    errors = []
+    groups = {}
+    for r in relationships:
+        groups.setdefault((r["from"], r["to"], r["rel"]), []).append(r)
+    for (f, t, rel), group in groups.items():
+        for i, a in enumerate(group):
+            for b in group[i + 1:]:
+                try:
+                    a_start, b_start = parse_position(a["valid_from"]), parse_position(b["valid_from"])
+                    a_end = parse_position(a["valid_to"]) if a.get("valid_to") else None
+                    b_end = parse_position(b["valid_to"]) if b.get("valid_to") else None
+                except ValueError:
+                    continue
+                if (b_end is None or a_start < b_end) and (a_end is None or b_start < a_end):
+                    errors.append(
+                        f"Temporal overlap: {a['id']} and {b['id']} "
+                        f"share ({f}, {t}, {rel}) with overlapping validity"
+                    )
+    return errors
+
+
+def test_validate_temporal_overlap_matches_pairwise_check(synthetic_data):
+    """The sweep reports exactly the pairs, in the order, of a pairwise scan."""
+    data = synthetic_data(3, 600, acts=2, chapters=6)
+    rels = data["relationships"]
+    rels[0]["valid_to"] = rels[0]["valid_from"]  # empty range
+    rels[1]["valid_to"] = "Act1/Ch1"  # inverted or empty range
+    rels[2]["valid_from"] = "sometime"  # malformed, skipped
+    errors = [e for e in validate_relationships(data).errors if e.startswith("Temporal overlap")]
+    assert errors
+    assert errors == _pairwise_overlap_errors(rels)
+
+
 def test_validate_checks_source_citation_format():
     """Source field must match canon path format."""
     data = {
@@ -382,6 +1242,258 @@ def test_validate_cli_invalid(tmp_path):
     assert result.returncode != 0
 
 
+def test_add_cli_rejects_record_that_fails_validation(tmp_path):
+    """add validates on write: a record overlapping an existing one is not saved."""
+    data = {
+        "rel_vocabulary": {"positive": ["trusts"], "negative": [], "neutral": [], "causal": []},
+        "entities": {},
+        "relationships": [
+            {
+                "id": "rel_001", "from": "a", "to": "b", "rel": "trusts",
+                "context": "x", "valid_from": "Act1/Ch1", "confidence": "high",
+                "source": "canon/file.md",
+            },
+        ],
+    }
+    f = tmp_path / "rels.yaml"
+    f.write_text(yaml.dump(data, default_flow_style=False))
+    cmd = [sys.executable, "scripts/relationship_query.py", "add",
+           "--from", "a", "--to", "b", "--rel", "trusts", "--context", "again",
+           "--confidence", "high", "--source", "canon/file.md", "--file", str(f)]
+    cwd = str(Path(__file__).resolve().parent.parent)
+
+    result = subprocess.run(cmd + ["--valid-from", "Act1/Ch3"], capture_output=True, text=True, cwd=cwd)
+    assert result.returncode != 0
+    assert "overlap" in result.stderr.lower()
+    assert len(load(f)["relationships"]) == 1
+
+    result = subprocess.run(
+        cmd + ["--valid-from", "L1/concept", "--valid-to", "Act1/Ch1"],
+        capture_output=True, text=True, cwd=cwd,
+    )
+    assert result.returncode == 0, result.stderr
+    assert len(load(f)["relationships"]) == 2
+
+
+def test_cli_stats_reports_snapshot_cache(tmp_path, sample_rels):
+    """--stats prints the snapshot counters; the second call is a hit."""
+    f = tmp_path / "rels.yaml"
+    save(sample_rels, f)
+    cmd = [sys.executable, "scripts/relationship_query.py", "--stats",
+           "query", "--entity", "marcus", "--file", str(f)]
+    cwd = str(Path(__file__).resolve().parent.parent)
+    first = subprocess.run(cmd, capture_output=True, text=True, cwd=cwd)
+    second = subprocess.run(cmd, capture_output=True, text=True, cwd=cwd)
+    assert "Snapshot cache: miss (hits=0, misses=1)" in first.stderr
+    assert "Snapshot cache: hit (hits=1, misses=1)" in second.stderr
+    assert first.stdout == second.stdout
+
+
+def test_render_matrix_cli_sparse_page(tmp_path, sample_rels):
+    """render-matrix forwards the sparse/paging options."""
+    f = tmp_path / "rels.yaml"
+    save(sample_rels, f)
+    result = subprocess.run(
+        [sys.executable, "scripts/relationship_query.py", "render-matrix", "--sparse",
+         "--page-size", "2", "--page", "1", "--file", str(f)],
+        capture_output=True, text=True,
+        cwd=str(Path(__file__).resolve().parent.parent),
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.rstrip() == render_matrix(sample_rels, sparse=True, page_size=2, page=1)
+
+
+def test_diff_cli_prints_json(tmp_path, sample_rels):
+    """diff prints the changes as JSON for the continuity agent."""
+    f = tmp_path / "rels.yaml"
+    save(sample_rels, f)
+    result = subprocess.run(
+        [sys.executable, "scripts/relationship_query.py", "diff",
+         "--from", "Act1/Ch3", "--to", "Act2/Ch1", "--file", str(f)],
+        capture_output=True, text=True,
+        cwd=str(Path(__file__).resolve().parent.parent),
+    )
+    assert result.returncode == 0, result.stderr
+    doc = json.loads(result.stdout)
+    assert (doc["from"], doc["to"]) == ("Act1/Ch3", "Act2/Ch1")
+    assert [pair["new"]["id"] for pair in doc["superseded"]] == ["rel_004"]
+    assert [r["id"] for r in doc["ended"]] == ["rel_005"]
+
+
+def test_path_and_neighbors_cli_print_json(tmp_path, sample_rels):
+    """The path and neighbors commands print their results as JSON."""
+    f = tmp_path / "rels.yaml"
+    save(sample_rels, f)
+    cwd = str(Path(__file__).resolve().parent.parent)
+    result = subprocess.run(
+        [sys.executable, "scripts/relationship_query.py", "path", "--from", "elena",
+         "--to", "zone_3", "--direction", "out", "--file", str(f)],
+        capture_output=True, text=True, cwd=cwd,
+    )
+    assert result.returncode == 0, result.stderr
+    doc = json.loads(result.stdout)
+    assert [r["id"] for r in doc["path"]] == ["rel_003", "rel_002"]
+    result = subprocess.run(
+        [sys.executable, "scripts/relationship_query.py", "neighbors", "--entity", "elena",
+         "--hops", "2", "--category", "positive", "--file", str(f)],
+        capture_output=True, text=True, cwd=cwd,
+    )
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout) == {"elena": 0, "marcus": 1}
+
+
+def test_mentions_cli_scans_files_and_directories(tmp_path, sample_rels):
+    """The mentions command scans *.md files under a directory and prints JSON."""
+    f = tmp_path / "rels.yaml"
+    save(sample_rels, f)
+    scenes = tmp_path / "scenes"
+    scenes.mkdir()
+    (scenes / "ch1.md").write_text("Marcus met Dr. Vasquez.\n", encoding="utf-8")
+    (scenes / "notes.txt").write_text("Zone 3\n", encoding="utf-8")
+    cwd = str(Path(__file__).resolve().parent.parent)
+    result = subprocess.run(
+        [sys.executable, "scripts/relationship_query.py", "mentions",
+         "--input", str(scenes), "--file", str(f)],
+        capture_output=True, text=True, cwd=cwd,
+    )
+    assert result.returncode == 0, result.stderr
+    [doc] = json.loads(result.stdout)
+    assert doc["path"] == str((scenes / "ch1.md").resolve())
+    assert doc["entities_checked"] == ["marcus", "elena"]
+    assert doc["mentions"][1] == {
+        "entity_ids": ["elena"], "text": "Dr. Vasquez", "line": 1, "column": 11, "offset": 11,
+    }
+
+
+def test_import_cli_writes_accepted_rows_once(tmp_path, sample_rels):
+    """import appends the good rows in one write and lists the rejects."""
+    f = tmp_path / "rels.yaml"
+    save(sample_rels, f)
+    original = f.read_bytes()
+    rows = tmp_path / "extracted.jsonl"
+    rows.write_text("\n".join([
+        json.dumps(_record(1)), json.dumps(_record(2, "adores")), json.dumps(_record(3, "loves")),
+    ]), encoding="utf-8")
+    result = subprocess.run(
+        [sys.executable, "scripts/relationship_query.py", "--no-server", "import",
+         "--input", str(rows), "--file", str(f)],
+        capture_output=True, text=True,
+        cwd=str(Path(__file__).resolve().parent.parent),
+    )
+    assert result.returncode == 1
+    assert "rel_006" in result.stdout and "rel_007" in result.stdout
+    assert "line 2: rel 'adores' not in rel_vocabulary" in result.stderr
+    assert f.read_bytes().startswith(original)
+    assert [r["rel"] for r in load(f)["relationships"][5:]] == ["knows", "loves"]
+
+
+def test_shard_cli_and_sharded_file(tmp_path, sample_rels):
+    """shard splits a file; other commands accept the directory as --file."""
+    f = tmp_path / "rels.yaml"
+    save(sample_rels, f)
+    shards = tmp_path / "rels"
+
+    def run(*args):
+        return subprocess.run(
+            [sys.executable, "scripts/relationship_query.py", "--no-server", *args],
+            capture_output=True, text=True,
+            cwd=str(Path(__file__).resolve().parent.parent),
+        )
+
+    result = run("shard", "--file", str(f), "--output", str(shards))
+    assert result.returncode == 0, result.stderr
+    assert "5 relationships to 2 shards" in result.stdout
+    result = run("add", "--from", "elena", "--to", "zone_3", "--rel", "knows",
+                 "--context", "surveys it", "--valid-from", "Act2/Ch2", "--confidence", "low",
+                 "--source", "canon/acts/act-2/ch2-outline.md", "--file", str(shards))
+    assert result.returncode == 0, result.stderr
+    result = run("query", "--entity", "zone_3", "--as-of", "Act2/Ch3", "--file", str(shards))
+    assert "rel_006" in result.stdout and "rel_002" in result.stdout
+    # The fixture's own errors are reported once; the shards add none.
+    sharded = run("--validate", "--file", str(shards)).stderr
+    assert sharded == run("--validate", "--file", str(f)).stderr
+    assert "rel_004: supersedes 'rel_001'" in sharded
+
+
+def test_export_cli_writes_output_file(tmp_path, sample_rels):
+    """export --output streams the chosen format to a file."""
+    f = tmp_path / "rels.yaml"
+    save(sample_rels, f)
+    out = tmp_path / "graph.dot"
+    result = subprocess.run(
+        [sys.executable, "scripts/relationship_query.py", "export", "--format", "dot",
+         "--as-of", "Act1/Ch5", "--output", str(out), "--file", str(f)],
+        capture_output=True, text=True,
+        cwd=str(Path(__file__).resolve().parent.parent),
+    )
+    assert result.returncode == 0, result.stderr
+    text = out.read_text(encoding="utf-8")
+    assert text.startswith("digraph relationships {")
+    assert text.count(" -> ") == len(_active(sample_rels, "Act1/Ch5"))
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+def test_cli_uses_running_server(tmp_path, sample_rels):
+    """With serve running, CLI commands go through it and see file changes."""
+    f = tmp_path / "rels.yaml"
+    save(sample_rels, f)
+    cwd = str(Path(__file__).resolve().parent.parent)
+    script = [sys.executable, "scripts/relationship_query.py"]
+
+    def run(*args):
+        return subprocess.run(script + list(args), capture_output=True, text=True, cwd=cwd)
+
+    server = subprocess.Popen(script + ["serve", "--file", str(f)], cwd=cwd)
+    try:
+        deadline = time.monotonic() + 20
+        while not socket_path(f).exists():
+            assert server.poll() is None and time.monotonic() < deadline
+            time.sleep(0.05)
+
+        query_args = ("query", "--entity", "marcus", "--as-of", "Act1/Ch5", "--file", str(f))
+        served = run(*query_args)
+        assert served.returncode == 0
+        assert served.stdout == run("--no-server", *query_args).stdout
+
+        added = run("add", "--from", "marcus", "--to", "elena", "--rel", "loves",
+                    "--context", "late", "--valid-from", "Act2/Ch1", "--confidence", "low",
+                    "--source", "canon/file.md", "--file", str(f))
+        assert added.returncode == 0, added.stderr
+        assert len(load(f)["relationships"]) == len(sample_rels["relationships"]) + 1
+
+        sample_rels["relationships"].clear()
+        save(sample_rels, f)
+        assert "No matching" in run(*query_args).stdout
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    assert not socket_path(f).exists()
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+@pytest.mark.parametrize("reply", [b'{"ok": true, "out', b"not json\n", b"[1, 2]\n"])
+def test_request_treats_bad_reply_as_no_server(tmp_path, reply):
+    """A truncated or malformed server reply falls back like a refused connection."""
+    path = tmp_path / "rq.sock"
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(str(path))
+    listener.listen(1)
+
+    def answer():
+        conn, _ = listener.accept()
+        with conn:
+            conn.recv(65536)
+            conn.sendall(reply)
+
+    thread = threading.Thread(target=answer)
+    thread.start()
+    try:
+        assert _request(path, {"op": "validate"}, timeout=5) is None
+    finally:
+        thread.join(timeout=5)
+        listener.close()
+
+
 def test_query_cli(tmp_path):
     """query subcommand should output results."""
     data = {
@@ -410,6 +1522,22 @@ def test_query_cli(tmp_path):
     assert "trusts" in result.stdout
 
 
+def test_query_batch_cli_reads_stdin(tmp_path, sample_rels):
+    """query --batch - resolves every listed entity and prints JSON keyed by entity."""
+    f = tmp_path / "rels.yaml"
+    save(sample_rels, f)
+    result = subprocess.run(
+        [sys.executable, "scripts/relationship_query.py", "query", "--batch", "-",
+         "--as-of", "Act1/Ch5", "--file", str(f)],
+        input="marcus\n\nthe dead zone\n", capture_output=True, text=True,
+        cwd=str(Path(__file__).resolve().parent.parent),
+    )
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout) == query_many(
+        sample_rels, ["marcus", "the dead zone"], as_of="Act1/Ch5"
+    )
+
+
 def test_render_matrix_cli(tmp_path):
     """render-matrix subcommand should output markdown."""
     data = {
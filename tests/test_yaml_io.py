@@ -0,0 +1,41 @@
+"""Tests for the shared YAML loader/dumper."""
+
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import pytest
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from yaml_io import HAS_LIBYAML, SafeLoader, safe_dump, safe_load
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+def test_safe_load_matches_pyyaml():
+    """The shared loader parses files exactly like yaml.safe_load."""
+    text = (FIXTURES / "sample_relationships.yaml").read_text(encoding="utf-8")
+    assert safe_load(text) == yaml.safe_load(text)
+
+
+def test_safe_dump_matches_pyyaml(synthetic_data):
+    """Saved files are byte-identical to the pure-Python dumper's output."""
+    data = synthetic_data(10, 200)
+    kwargs = {"default_flow_style": False, "sort_keys": False, "allow_unicode": True}
+    assert safe_dump(data, **kwargs) == yaml.dump(data, **kwargs)
+    assert safe_load(safe_dump(data, **kwargs)) == data
+
+
+def test_uses_libyaml_when_available():
+    """The C loader is picked whenever PyYAML was built with libyaml."""
+    assert HAS_LIBYAML == hasattr(yaml, "CSafeLoader")
+    assert (SafeLoader is yaml.CSafeLoader) == HAS_LIBYAML
+
+
+def test_safe_load_rejects_python_tags():
+    """Both loaders stay safe: arbitrary Python objects are not constructed."""
+    with pytest.raises(yaml.YAMLError):
+        safe_load("!!python/object/apply:os.system ['true']")